@@ -28,10 +28,26 @@ def parse():
     parser.add_argument('image', type=str, nargs='?', help='the image file to process')
     parser.add_argument('-t','--test',   action='store_true',  help='run a unit test on Image and Editor')
     parser.add_argument('-g','--grade',   action='store_true', help='grade the assignment')
+    parser.add_argument('-e','--encode', type=str, metavar='FILE', help='hide the contents of FILE in the image (no GUI)')
+    parser.add_argument('-d','--decode', action='store_true', help='extract the message hidden in the image (no GUI)')
+    parser.add_argument('-o','--output', type=str, help='the output file for --encode (a PNG), --decode, --scan or --benchmark')
+    parser.add_argument('-b','--bits', type=int, choices=[0,1,2,4], default=0, help='the bits per color channel for --encode')
+    parser.add_argument('-z','--compress', choices=['zlib','lzma'], help='compress the message for --encode')
+    parser.add_argument('-s','--scan', type=str, nargs='+', metavar='PATH', help='scan image files and folders for hidden messages (no GUI)')
+    parser.add_argument('-j','--jobs', type=int, help='the number of processes for --scan or --serve (default one per core)')
+    parser.add_argument('--profile', action='store_true', help='print the time and memory of each stage of each action in the GUI')
+    parser.add_argument('--trace', type=str, metavar='FILE', help='save a trace of the GUI action stages to FILE on exit')
+    parser.add_argument('--benchmark', action='store_true', help='time every operation on generated images (no GUI)')
+    parser.add_argument('--baseline', type=str, metavar='FILE', help='the benchmark results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='the allowed slowdown against --baseline (default 0.25)')
+    parser.add_argument('--max-size', type=int, default=8192, help='the largest image size for --benchmark (default 8192)')
+    parser.add_argument('--limit', type=float, default=10.0, help='the seconds after which --benchmark stops growing an operation')
+    parser.add_argument('--startup', action='store_true', help='time the imports of the headless modules (no GUI)')
+    parser.add_argument('--serve', type=str, metavar='ADDRESS', help='run the image service on a Unix socket path or [HOST:]PORT (no GUI)')
     return parser.parse_args()
 
 
-def launch(image):
+def launch(image, profile=False, trace=None):
     """
     Launches the gui application with the given image and output (if specified)
     
@@ -40,9 +56,15 @@ def launch(image):
     
     Parameter output: The output file for saving any changes
     Precondition: output is a filename string or None
+    
+    Parameter profile: Whether to print the timings of each action
+    Precondition: profile is a bool
+    
+    Parameter trace: The file to save a trace of the action stages to
+    Precondition: trace is a filename string or None
     """
     from interface import launch
-    launch(image)
+    launch(image,profile,trace)
 
 
 def unittest():
@@ -53,6 +75,196 @@ def unittest():
     test_all()
 
 
+def encode(image, message, output, bits=0, compress=None):
+    """
+    Hides the contents of a file in an image, without the GUI.
+    
+    The message is streamed from the file straight into the image (see 
+    Encoder.encode_stream), so it can be much larger than the text panel 
+    could handle.  The result is saved as a PNG file.
+    
+    Parameter image: The image file to hide the message in
+    Precondition: image is a filename string
+    
+    Parameter message: The file to hide
+    Precondition: message is a filename string
+    
+    Parameter output: The PNG file to save the result to
+    Precondition: output is a filename string
+    
+    Parameter bits: The number of bits to use in each color channel
+    Precondition: bits is 0, 1, 2 or 4
+    
+    Parameter compress: The compression method
+    Precondition: compress is None, 'zlib' or 'lzma'
+    """
+    import sys
+    from imagefile import read_image, write_png
+    from a6encode import Encoder
+    
+    encoder = Encoder(read_image(image))
+    with open(message,'rb') as file:
+        if not encoder.encode_stream(file,bits,compress):
+            print('The message does not fit in '+image)
+            sys.exit(1)
+    write_png(encoder.getCurrent(),output)
+
+
+def decode(image, output=None):
+    """
+    Extracts the message hidden in an image, without the GUI.
+    
+    The message is streamed from the image straight to the output file (see 
+    Encoder.decode_stream).  If output is None, it is written to standard 
+    output instead.  The program exits with status 1 if there is no message,
+    and 2 if the message is damaged.
+    
+    Parameter image: The image file with the hidden message
+    Precondition: image is a filename string
+    
+    Parameter output: The file to write the message to
+    Precondition: output is a filename string or None
+    """
+    import sys
+    from imagefile import read_image
+    from a6encode import Encoder
+    
+    encoder = Encoder(read_image(image))
+    try:
+        if output is None:
+            result = encoder.decode_stream(sys.stdout.buffer)
+            sys.stdout.flush()
+        else:
+            with open(output,'wb') as file:
+                result = encoder.decode_stream(file)
+    except ValueError as e:
+        print('The hidden message in '+image+' is damaged ('+str(e)+')', file=sys.stderr)
+        sys.exit(2)
+    if result is None:
+        print('No hidden message found in '+image, file=sys.stderr)
+        sys.exit(1)
+
+
+def scan(paths, output=None, jobs=None):
+    """
+    Scans image files and folders for hidden messages, without the GUI.
+    
+    The results are written as JSON lines (see the module scanner).  If output
+    is None, they are written to standard output instead.  A summary is 
+    written to standard error.
+    
+    Parameter paths: The files and folders to scan
+    Precondition: paths is a list of strings
+    
+    Parameter output: The file to write the results to
+    Precondition: output is a filename string or None
+    
+    Parameter jobs: The number of worker processes (None for one per core)
+    Precondition: jobs is None or an int > 0
+    """
+    import sys
+    import scanner
+    
+    if output is None:
+        files, found = scanner.scan(paths,sys.stdout,jobs)
+    else:
+        with open(output,'w',encoding='utf-8') as file:
+            files, found = scanner.scan(paths,file,jobs)
+    print('Scanned '+str(files)+' files, found '+str(found), file=sys.stderr)
+
+
+def benchmark(output=None, baseline=None, threshold=0.25, maxsize=8192, limit=10.0):
+    """
+    Runs the benchmark suite, without the GUI.
+    
+    Each measurement is printed as it is made.  The results are saved as JSON
+    if output is not None.  If baseline is not None, the results are compared
+    against it, and the program exits with status 1 if there are regressions.
+    
+    Parameter output: The JSON file to save the results to
+    Precondition: output is a filename string or None
+    
+    Parameter baseline: The JSON file of earlier results
+    Precondition: baseline is a filename string or None
+    
+    Parameter threshold: The allowed increase over the baseline, as a fraction
+    Precondition: threshold is a number >= 0
+    
+    Parameter maxsize: The largest image size to try
+    Precondition: maxsize is an int > 0
+    
+    Parameter limit: The seconds after which an operation is not grown
+    Precondition: limit is a number > 0
+    """
+    import sys
+    import benchmark
+    
+    def report(result):
+        if result.get('skipped'):
+            return
+        peak = result['peak_bytes']
+        print('%-20s %5d  %9.4f s  %12.0f px/s  %s' % (result['operation'],result['size'],
+              result['seconds'],result['pixels_per_second'],
+              '-' if peak is None else str(peak//1024)+' KB'))
+    
+    sizes = [size for size in benchmark.SIZES if size <= maxsize]
+    results = benchmark.run(sizes,limit=limit,report=report)
+    if not output is None:
+        benchmark.save(results,output)
+    if not baseline is None:
+        regressions = benchmark.compare(results,benchmark.load(baseline),threshold)
+        for line in regressions:
+            print('REGRESSION: '+line)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against '+baseline)
+
+
+def startup():
+    """
+    Measures how long each headless module takes to import, without the GUI.
+    
+    The program exits with status 1 if a headless module imports Kivy, or 
+    imports PIL before an image is read (see benchmark.startup).
+    """
+    import sys
+    import benchmark
+    
+    failed = False
+    print('%-12s %10s %10s  %s' % ('module','import','process','slowest import'))
+    for result in benchmark.startup():
+        print('%-12s %8.1fms %8.1fms  %s' % (result['module'],1000*result['seconds'],
+              1000*result['process'],result['slowest']))
+        if result['gui'] or result['pil']:
+            print('ERROR: '+result['module']+' imports '+', '.join(result['gui']+(['PIL'] if result['pil'] else [])))
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+def serve(address, jobs=None):
+    """
+    Runs the image service until interrupted, without the GUI.
+    
+    Parameter address: The Unix socket path or [HOST:]PORT to listen on
+    Precondition: address is a non-empty string
+    
+    Parameter jobs: The number of worker processes (None for one per core)
+    Precondition: jobs is None or an int > 0
+    """
+    import sys
+    import service
+    
+    server = service.Service(service.parse_address(address),jobs)
+    print('Serving on '+str(server.address), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
 def grade(image):
     """
     Grades the assignment.
@@ -80,8 +292,27 @@ def execute():
         unittest()
     elif args.grade:
         grade(image)
+    elif args.encode:
+        if image is None or args.output is None:
+            print('--encode needs an image file and an --output file')
+        else:
+            encode(image,args.encode,args.output,args.bits,args.compress)
+    elif args.decode:
+        if image is None:
+            print('--decode needs an image file')
+        else:
+            decode(image,args.output)
+    elif args.scan:
+        scan(args.scan,args.output,args.jobs)
+    elif args.benchmark:
+        benchmark(args.output,args.baseline,args.threshold,args.max_size,args.limit)
+    elif args.startup:
+        startup()
+    elif args.serve:
+        serve(args.serve,args.jobs)
     else:
-        launch(image)
+        launch(image,args.profile,args.trace)
 
-# Do it
-execute()
\ No newline at end of file
+# Do it (but not in the worker processes started by --scan)
+if __name__ == '__main__':
+    execute()
\ No newline at end of file
@@ -7,13 +7,24 @@ keeps track of all modifications of an original image.  It allows for
 edit history. The filter functions are in a subclass of this class so that 
 they can take advantage of the edit history.
 
+An edit can also be double-buffered, so that a worker thread can change the
+image while other threads (such as the GUI) keep reading it.  The worker 
+calls begin, which gives it a private copy of the current image (the back 
+buffer), edits it, and then calls commit to swap it into the edit history in
+one step.  Until the commit, every other thread still sees the old image, so 
+it never sees a half-finished edit.
+
+An edit that only changes a region of the image (see region.Region) can be 
+committed with that region.  The edit history then keeps just the old pixels
+of the region, rather than a whole copy of the previous image.
+
 Based on an original file by Dexter Kozen (dck10) and Walker White (wmw2)
 
 Author: Walker White (wmw2)
 Date:   October 29, 2019
 """
-# THIS FILE IS COMPLETE.  DO NOT MODIFY THIS FILE AT ALL
 import a6image
+import threading
 
 
 class Editor(object):
@@ -29,6 +40,9 @@ class Editor(object):
     If the number of edits exceeds MAX_HISTORY, the oldest edit will be
     deleted.  
     
+    The methods of this class are safe to call from several threads.  Only
+    one thread can have a double-buffered edit (see begin) at a time.
+    
     Attribute MAX_HISTORY: A CLASS ATTRIBUTE for the maximum number of edits
     Invariant: MAX_HISTORY is an int > 0
     """
@@ -38,7 +52,18 @@ class Editor(object):
     #
     # Attribute _history: The edit history
     # Invariant: _history is a non-empty list of Image objects. In addition, 
-    #the length of _history should never be longer than MAX_HISTORY.
+    #the length of _history should never be longer than MAX_HISTORY.  Every
+    #element but the last may instead be a patch: a (Region, Image) pair with
+    #the old pixels of the region changed by the next edit.
+    #
+    # Attribute _back: The back buffer of the edit in progress (None if no edit)
+    # Invariant: _back is an Image object or None
+    #
+    # Attribute _writer: The thread that owns the edit in progress
+    # Invariant: _writer is a thread identifier (int), or None if _back is None
+    #
+    # Attribute _lock: The lock guarding _history, _back and _writer
+    # Invariant: _lock is a threading.Lock
     
     # The number of edits that we are allowed to keep track of.
     # (THIS GOES IN CLASS FOLDER)
@@ -54,8 +79,21 @@ class Editor(object):
     def getCurrent(self):
         """
         Returns the most recent edit
+        
+        If the calling thread has an edit in progress (see begin), this is its
+        back buffer.  Every other thread gets the most recent committed edit.
+        """
+        with self._lock:
+            if not self._back is None and self._writer == threading.get_ident():
+                return self._back
+            return self._history[-1]
+    
+    def isEditing(self):
+        """
+        Returns True if a thread has an edit in progress (see begin)
         """
-        return self._history[-1]
+        with self._lock:
+            return not self._back is None
     
     # INITIALIZER
     def __init__(self,original):
@@ -71,6 +109,9 @@ class Editor(object):
         assert isinstance(original,a6image.Image), repr(original)+' is not an image'
         self._original = original
         self._history  = [original.copy()]
+        self._back   = None
+        self._writer = None
+        self._lock   = threading.Lock()
     
     # EDIT METHODS
     def undo(self):
@@ -82,9 +123,15 @@ class Editor(object):
         be empty.  If this method is called on an edit history of one element,
         this method returns False instead.
         """
-        if len(self._history) > 1:
-            self._history.pop()
-            return True
+        with self._lock:
+            if len(self._history) > 1:
+                current = self._history.pop()
+                if type(self._history[-1]) == tuple:
+                    region, part = self._history.pop()
+                    previous = current.copy()
+                    region.paste(previous,part)
+                    self._history.append(previous)
+                return True
         return False
     
     def clear(self):
@@ -94,7 +141,8 @@ class Editor(object):
         When this method completes, the object should have the same values that 
         it did once it was first initialized.
         """
-        self._history = [self._original.copy()]
+        with self._lock:
+            self._history = [self._original.copy()]
     
     def increment(self):
         """
@@ -104,7 +152,75 @@ class Editor(object):
         end of the history.  If this causes the history to grow to larger 
         (greater than MAX_HISTORY), this method deletes the oldest edit.
         """
-        self._history.append(self.getCurrent().copy())
+        with self._lock:
+            self._push(self._history[-1].copy())
+    
+    def begin(self):
+        """
+        Starts a double-buffered edit, returning the back buffer.
+        
+        The back buffer is a copy of the current image.  Until the edit is 
+        committed (or aborted), getCurrent returns the back buffer in the 
+        calling thread, so the image processing methods change it instead of
+        the edit history.  Other threads are not affected.
+        
+        Precondition: No thread has an edit in progress
+        """
+        with self._lock:
+            assert self._back is None, 'an edit is already in progress'
+            self._back = self._history[-1].copy()
+            self._writer = threading.get_ident()
+            return self._back
+    
+    def commit(self, region=None):
+        """
+        Adds the back buffer to the edit history, ending the edit.
+        
+        This is the same as if the edit had been made after a call to 
+        increment, except that no other thread can see the image until now.
+        
+        If region is not None, the edit must only have changed the pixels in
+        that region.  Instead of keeping the whole previous image for undo, 
+        the edit history keeps just the old pixels of the region.
+        
+        Parameter region: The part of the image that the edit changed
+        Precondition: region is None or a Region that fits the back buffer
+        
+        Precondition: The calling thread has an edit in progress
+        """
+        with self._lock:
+            assert self._writer == threading.get_ident() and not self._back is None, 'there is no edit in progress'
+            if not region is None:
+                previous = self._history[-1]
+                assert region.fits(previous) and region.fits(self._back), repr(region)+' does not fit the image'
+                self._history[-1] = (region,region.crop(previous))
+            self._push(self._back)
+            self._back = None
+            self._writer = None
+    
+    def abort(self):
+        """
+        Ends the edit in progress without changing the edit history.
+        
+        This method does nothing unless the calling thread has an edit in
+        progress, so it is safe to call when cleaning up after an error.
+        """
+        with self._lock:
+            if self._writer == threading.get_ident():
+                self._back = None
+                self._writer = None
+    
+    # HELPER METHODS
+    def _push(self, image):
+        """
+        Adds image to the end of the edit history, deleting the oldest edit if necessary.
+        
+        This method must be called with the lock held.
+        
+        Parameter image: The new edit
+        Precondition: image is an Image object
+        """
+        self._history.append(image)
         if len(self._history) > self.MAX_HISTORY:
             self._history.pop(0)
 
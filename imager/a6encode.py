@@ -12,6 +12,335 @@ Nick Trejo nt286
 13 November 2022
 """
 import a6filter
+import a6image
+from pixels import Pixels
+
+
+# LOOKUP TABLES FOR BULK ENCODING
+# A byte is hidden as three decimal digits, one in the last digit of each channel.
+# These tables let us split bytes into digits, and put digits into channels, with
+# bytes.translate and whole-buffer addition instead of one pixel at a time.
+
+# The hundreds, tens and ones digits of each byte
+_HUNDREDS = bytes(v // 100 for v in range(256))
+_TENS     = bytes(v // 10 % 10 for v in range(256))
+_ONES     = bytes(v % 10 for v in range(256))
+
+# Each channel value with its last digit set to 0, and 10 more if it is 250 or above
+_ROUND = bytes(v-v%10 if v < 250 else 240 for v in range(256))
+_HIGH  = bytes(0 if v < 250 else 10 for v in range(256))
+
+# Maps a digit d (+10 if the channel is 250 or above) to the amount to add to _ROUND
+_SHIFT = bytes(list(range(10))+[d+10 if d < 6 else d for d in range(10)]+[0]*236)
+
+# The last digit of a channel times 10, times 100 (only for 1 or 2), and 100 if it is 2
+_TIMES10  = bytes(10*(v % 10) for v in range(256))
+_TIMES100 = bytes(100*(v % 10) if v % 10 < 3 else 0 for v in range(256))
+_IFTWO    = bytes(100 if v % 10 == 2 else 0 for v in range(256))
+
+
+
+# LOOKUP TABLES FOR BIT PACKING
+# In the packed formats, a byte is split into groups of 1, 2 or 4 bits, and each
+# group replaces the lowest bits of one color channel (its least significant bit
+# planes).  For each group size bits, _PLANES[bits] is a tuple (clear,split,join):
+#   clear    removes the lowest bits of a channel value
+#   split[k] pulls the k-th group (from the left) out of a byte
+#   join[k]  moves the lowest bits of a channel value into the k-th group of a byte
+
+def _make_planes(bits):
+    """
+    Returns the tuple (clear,split,join) of lookup tables for the given group size.
+    
+    Parameter bits: The number of bits in each group
+    Precondition: bits is 1, 2 or 4
+    """
+    mask   = (1 << bits)-1
+    shifts = range(8-bits,-1,-bits)
+    clear  = bytes(v & ~mask for v in range(256))
+    split  = tuple(bytes((v >> s) & mask for v in range(256)) for s in shifts)
+    join   = tuple(bytes((v & mask) << s for v in range(256)) for s in shifts)
+    return (clear,split,join)
+
+_PLANES = {bits: _make_planes(bits) for bits in (1,2,4)}
+
+
+# COMPRESSION AND STREAMING
+# The header flags that record how the message was compressed
+_COMPRESSION = {'zlib': 1, 'lzma': 2}
+
+# The header flag for one shard of a message split across images
+_SHARDED = 128
+
+# The number of characters (or bytes) to read from a message at a time
+_CHUNK = 1 << 20
+
+# The number of bytes to hide at a time when streaming.  This is a multiple of
+# 3, so that every block fills whole pixels in each of the packed formats.
+_BLOCK = 3 << 16
+
+
+def _compressor(method):
+    """
+    Returns a new compression object for the given method.
+    
+    The object has the methods compress and flush, like zlib.compressobj.
+    
+    Parameter method: The compression method
+    Precondition: method is 'zlib' or 'lzma'
+    """
+    if method == 'zlib':
+        import zlib
+        return zlib.compressobj()
+    import lzma
+    return lzma.LZMACompressor()
+
+
+def _decompressor(flags):
+    """
+    Returns a new decompression object for the given header flags.
+    
+    The object has the method decompress and the attributes eof and 
+    unused_data, like zlib.decompressobj.  If the flags are 0 (no compression),
+    this function returns None.  It raises a ValueError if the flags are not 
+    known.
+    
+    Parameter flags: The header flags
+    Precondition: flags is an int in 0..255
+    """
+    if flags == 0:
+        return None
+    elif flags == _COMPRESSION['zlib']:
+        import zlib
+        return zlib.decompressobj()
+    elif flags == _COMPRESSION['lzma']:
+        import lzma
+        return lzma.LZMADecompressor()
+    raise ValueError('unknown header flags '+repr(flags))
+
+
+def _compress(text, method):
+    """
+    Returns the pair (data, flags) for the UTF-8 bytes of text, compressed.
+    
+    The text is converted to UTF-8 and compressed a chunk at a time, so the 
+    full UTF-8 bytes of a long message never have to exist at the same time
+    as the compressed result.  If compression does not make the message 
+    smaller, this function returns the uncompressed bytes and flags 0.
+    Otherwise flags is the header flag for the compression method.
+    
+    Parameter text: The message to compress
+    Precondition: text is a string
+    
+    Parameter method: The compression method
+    Precondition: method is 'zlib' or 'lzma'
+    """
+    engine = _compressor(method)
+    parts = []
+    size  = 0
+    for start in range(0, len(text), _CHUNK):
+        chunk = text[start:start+_CHUNK].encode('utf-8')
+        size += len(chunk)
+        parts.append(engine.compress(chunk))
+    parts.append(engine.flush())
+    
+    data = b''.join(parts)
+    if len(data) >= size:
+        return (text.encode('utf-8'), 0)
+    return (data, _COMPRESSION[method])
+
+
+def _decompress(data, flags):
+    """
+    Returns the bytes data, decompressed according to the header flags.
+    
+    This raises a ValueError if the flags are not known or the data cannot
+    be decompressed.
+    
+    Parameter data: The bytes to decompress
+    Precondition: data is a bytes object
+    
+    Parameter flags: The header flags
+    Precondition: flags is an int in 0..255
+    """
+    engine = _decompressor(flags)
+    if engine is None:
+        return data
+    try:
+        result = engine.decompress(data)
+    except Exception as e:
+        raise ValueError('message could not be decompressed') from e
+    if not engine.eof or engine.unused_data:
+        raise ValueError('message could not be decompressed')
+    return result
+
+
+def _read_blocks(fileobj, compress=None):
+    """
+    Yields the contents of fileobj as blocks of _BLOCK bytes.
+    
+    The file is read a chunk at a time, and compressed as it is read if 
+    compress is not None.  Every block except the last has exactly _BLOCK 
+    bytes.  If the file is opened in text mode, its contents are converted 
+    to UTF-8.
+    
+    Parameter fileobj: The file to read
+    Precondition: fileobj is an open file (text or binary) or file-like object
+    
+    Parameter compress: The compression method
+    Precondition: compress is None, 'zlib' or 'lzma'
+    """
+    engine = None if compress is None else _compressor(compress)
+    buffer = bytearray()
+    while True:
+        data = fileobj.read(_CHUNK)
+        if not data:
+            break
+        if type(data) == str:
+            data = data.encode('utf-8')
+        if not engine is None:
+            data = engine.compress(data)
+        buffer += data
+        while len(buffer) >= _BLOCK:
+            yield bytes(buffer[:_BLOCK])
+            del buffer[:_BLOCK]
+    
+    if not engine is None:
+        buffer += engine.flush()
+    for start in range(0, len(buffer), _BLOCK):
+        yield bytes(buffer[start:start+_BLOCK])
+
+
+def _varint(value, size=1):
+    """
+    Returns the bytes of value as a variable-length integer.
+    
+    Each byte holds 7 bits of the value, lowest bits first.  The top bit of a 
+    byte is 1 if there are more bytes to come.  Small values take one byte, 
+    and there is no upper limit.
+    
+    If size is larger than the number of bytes needed, the value is padded 
+    (with bytes holding 7 zero bits) to that size.  This lets a length be 
+    written into space that was set aside before the length was known.
+    
+    Parameter value: The value to convert
+    Precondition: value is an int >= 0
+    
+    Parameter size: The minimum number of bytes to use
+    Precondition: size is an int >= 1
+    """
+    result = bytearray()
+    while value >= 128 or len(result) < size-1:
+        result.append(value & 127 | 128)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def _utf8_length(text):
+    """
+    Returns the number of bytes in the UTF-8 encoding of text.
+    
+    ASCII text has one byte per character, which Python can tell without 
+    looking at the characters.  Other text is measured a chunk at a time, so
+    the full encoding never has to exist at once.
+    
+    Parameter text: The text to measure
+    Precondition: text is a string
+    """
+    if text.isascii():
+        return len(text)
+    return sum(len(text[start:start+_CHUNK].encode('utf-8')) for start in range(0, len(text), _CHUNK))
+
+
+def _bytes_in(pixels, bits):
+    """
+    Returns the number of message bytes that fit in the given number of pixels.
+    
+    Parameter pixels: The number of pixels
+    Precondition: pixels is an int >= 0
+    
+    Parameter bits: The number of bits to use in each color channel
+    Precondition: bits is 0 (for decimal digits), 1, 2 or 4
+    """
+    if bits == 0:
+        return pixels
+    return pixels*3*bits // 8
+
+
+def _add_bytes(a, b):
+    """
+    Returns the bytes whose values are the sums of the values in a and b.
+    
+    This adds all of the bytes at once by treating a and b as (very large) 
+    integers.  That only works because no sum is allowed to go past 255; 
+    otherwise it would carry into the next byte.
+    
+    Parameter a: The first bytes to add
+    Precondition: a is a bytes-like object
+    
+    Parameter b: The second bytes to add
+    Precondition: b is a bytes-like object the same length as a, and every 
+    sum a[i]+b[i] is <= 255
+    """
+    total = int.from_bytes(a,'big') + int.from_bytes(b,'big')
+    return total.to_bytes(len(a),'big')
+
+
+def _changed_ranges(old, new, unit=1):
+    """
+    Returns a list of (start, stop) ranges covering every byte where new differs from old.
+    
+    The bytes are compared a block at a time (1024 units), and only the blocks
+    that differ are searched byte by byte, from each end, for the first and 
+    last difference.  Every start is a multiple of unit, as is every stop 
+    (except that a stop can be len(new)).  Any bytes of new past the end of 
+    old count as different.  The ranges are in order and do not overlap.
+    
+    Parameter old: The bytes before the change
+    Precondition: old is a bytes-like object
+    
+    Parameter new: The bytes after the change
+    Precondition: new is a bytes-like object
+    
+    Parameter unit: The size of the pieces to align the ranges to
+    Precondition: unit is an int > 0
+    """
+    ranges = []
+    block  = 1024*unit
+    for start in range(0, len(new), block):
+        stop = min(start+block, len(new))
+        if old[start:stop] == new[start:stop]:
+            continue
+        
+        first = start
+        while first < len(old) and old[first] == new[first]:
+            first += 1
+        last = stop
+        while last <= len(old) and old[last-1] == new[last-1]:
+            last -= 1
+        first -= first % unit
+        last = min(last + (-last) % unit, len(new))
+        
+        if len(ranges) > 0 and ranges[-1][1] >= first:
+            ranges[-1] = (ranges[-1][0], last)
+        else:
+            ranges.append((first, last))
+    return ranges
+
+
+def _crc32(data, value=0):
+    """
+    Returns the CRC32 checksum of data, continuing from value.
+    
+    Parameter data: The bytes to check
+    Precondition: data is a bytes-like object
+    
+    Parameter value: The checksum of the bytes before data
+    Precondition: value is an int in 0..2**32-1
+    """
+    import zlib
+    return zlib.crc32(data, value)
 
 
 class Encoder(a6filter.Filter):
@@ -25,9 +354,102 @@ class Encoder(a6filter.Filter):
     
     Both the `encode` and `decode` methods should work with the most recent
     image in the edit history.
+    
+    There are two ways to store a message.  The original (decimal) format 
+    hides one byte in each pixel, as three decimal digits.  The packed format 
+    instead hides the message in the lowest 1, 2 or 4 bits (bit planes) of 
+    every color channel.  With 4 bits per channel, the packed format fits 1.5 
+    bytes in each pixel.  The first pixels of the image say which format was 
+    used, so decode does not need to be told.
+    
+    The original format can only record lengths up to 999999 bytes.  Every 
+    other format uses the extended header, which has a version number, a 
+    magic value, a byte of flags, a checksum and a variable-length size, so
+    it has no length limit:
+    
+        pixels 0-4:    the indicator (see _indicate_encode)
+        pixel 5:       the header version (top 4 bits) and bits per channel
+        pixels 6-7:    the magic value MAGIC
+        pixel 8:       the flags (how the message was compressed, or 0)
+        pixels 9-12:   the CRC32 checksum of the stored message
+        pixels 13-...: the length, as a variable-length integer (see _varint)
+    
+    Each of these values is stored one byte per pixel, like the original 
+    format, and the message follows right after the length.  The length is 
+    the number of bytes actually stored, after any compression.  
+    
+    A message too large for one image can be split into shards, one per 
+    image (see the function encode_shards).  A shard has the flag 128 set, and its 
+    length is followed by its sequence number and the number of shards (as 
+    variable-length integers), and then a 4-byte id shared by every shard of
+    the message.  The checksum covers just that shard.
+    
+    The indicator digits are easy to match by accident, so a photo with no 
+    message can look like it has one.  The magic value rejects almost all of
+    those photos after reading 8 pixels, and the checksum catches a damaged 
+    message before it is decompressed or converted to text.  The method 
+    getStatus says which of these happened.
+    
+    Decoding a long message is slow, and the application decodes after every 
+    edit.  So this class remembers the messages that it has decoded, along 
+    with the image version (see Image.getVersion) and header pixels that they
+    came from.  The message is only read again if either of those changes.
+    
+    Attribute FORMAT: A CLASS ATTRIBUTE for the extended header version written
+    Invariant: FORMAT is an int in 1..15
+    
+    Attribute MAGIC: A CLASS ATTRIBUTE for the magic value in the extended header
+    Invariant: MAGIC is a bytes object of length 2
+    
+    Attribute NONE: A CLASS ATTRIBUTE for the status of an image with no message
+    Invariant: NONE is a string
+    
+    Attribute VALID: A CLASS ATTRIBUTE for the status of a message whose 
+    checksum matches
+    Invariant: VALID is a string
+    
+    Attribute UNCHECKED: A CLASS ATTRIBUTE for the status of a message in a 
+    format with no checksum
+    Invariant: UNCHECKED is a string
+    
+    Attribute CORRUPT: A CLASS ATTRIBUTE for the status of a message with a 
+    valid header that could not be read
+    Invariant: CORRUPT is a string
+    
+    Attribute SHARD: A CLASS ATTRIBUTE for the status of a valid shard, which
+    cannot be decoded on its own
+    Invariant: SHARD is a string
     """
+    # The version of the extended header format
+    FORMAT = 3
+    
+    # The two bytes that follow the version in the extended header
+    MAGIC = b'\xa6\x5e'
+    
+    # The results of getStatus
+    NONE      = 'none'
+    VALID     = 'valid'
+    UNCHECKED = 'unchecked'
+    CORRUPT   = 'corrupt'
+    SHARD     = 'shard'
+    
+    # HIDDEN ATTRIBUTES
+    # Attribute _decoded: The most recently decoded messages, oldest first
+    # Invariant: _decoded is an OrderedDict mapping (version,header) pairs to
+    # (status,message) pairs, with at most MAX_HISTORY entries
+    
+    def __init__(self, original):
+        """
+        Initializes an encoder (and edit history) for the given image.
+        
+        Parameter original: The image to edit
+        Precondition: original is an Image object
+        """
+        import collections
+        super().__init__(original)
+        self._decoded = collections.OrderedDict()
     
-    def encode(self, text):
+    def encode(self, text, bits=None, compress=None):
         """
         Returns True if it could hide the text; False otherwise.
         
@@ -39,6 +461,30 @@ class Encoder(a6filter.Filter):
         
         This allows the encode method to support all text, including emoji.
         
+        If bits is None, the bytes are hidden one per pixel, starting at pixel 
+        7, and they are all written to the image in one bulk step (see 
+        _encode_bytes).  Otherwise, the message is written after the extended
+        header (see the class specification).  If bits is 0, the bytes are 
+        hidden one per pixel as before, and if it is 1, 2 or 4, they are 
+        packed into the lowest bits of each color channel (see _pack_bits). 
+        The limits in the paragraph below only apply to the original format;
+        the extended header allows messages of any length that fits.
+        
+        If compress is 'zlib' or 'lzma', the UTF-8 bytes are compressed before 
+        they are hidden, and the header flags tell decode to decompress them.
+        This needs the extended header, so bits None is treated as 0.  If 
+        compression would not make the message smaller, it is skipped.
+        
+        If the image already holds a message in the same format, only the 
+        header and the pixels whose bytes have changed are rewritten (see 
+        _rewrite).  So editing a few characters of a long message and encoding
+        it again only touches a few pixels.
+        
+        Whether the message fits is checked before anything is written, so if
+        this method returns False the image is unchanged.  Use getRequired or
+        canEncode to find out ahead of time (for example, before adding an 
+        edit to the history).
+        
         If the text UTF-8 encoding requires more than 999999 bytes or the 
         picture does  not have enough pixels to store these bytes this method
         returns False without storing the message. However, if the number of
@@ -48,39 +494,56 @@ class Encoder(a6filter.Filter):
         
         Parameter text: a message to hide
         Precondition: text is a string
+        
+        Parameter bits: The number of bits to use in each color channel
+        Precondition: bits is None (for the original format), 0 (for decimal
+        digits), 1, 2 or 4
+        
+        Parameter compress: The compression method
+        Precondition: compress is None, 'zlib' or 'lzma'
         """
         # You may modify anything in the above specification EXCEPT
         # The first line (Returns True...)
         # The last paragraph (If the text UTF-8 encoding...)
         # The precondition (text is a string)
         assert type(text) == str
-        
-        current = self.getCurrent()
+        assert bits is None or bits == 0 or bits in _PLANES, repr(bits)+' is not a valid number of bits'
+        assert compress is None or compress in _COMPRESSION, repr(compress)+' is not a compression method'
         
         try:
+            if compress is None:
+                # Check the size before encoding (see getRequired)
+                assert self._fits(_utf8_length(text), bits)
+                blist = text.encode('utf-8')
+                flags = 0
+            else:
+                blist, flags = _compress(text, compress)
+                if bits is None:
+                    bits = 0
+                assert self._fits(len(blist), bits)
             
-            assert len(text) <= 1000000
-            assert len(text) <= len(current.getData())
-            
-            
-            self._indicate_encode()
-
-            
-            lst = list(text)
-            b = list(text.encode('utf-8'))
-            pos = 7
-            for i in b:
-                self._encode_pixel(i, pos)
-                pos += 1
+            if bits is None:
+                header = None
+                pos = 7
+            else:
+                header = self._make_header(len(blist), bits, flags, 1, _crc32(blist))
+                pos = 5+len(header)
             
-            self._store_length(len(b))
+            if not self._rewrite(blist, bits, header):
+                if header is None:
+                    self._indicate_encode()
+                    self._store_length(len(blist))
+                    self._encode_bytes(blist, 7)
+                else:
+                    self._indicate_encode(True)
+                    self._encode_bytes(header, 5)
+                    self._write_payload(blist, pos, bits)
             
             return True
         
         except AssertionError:
             return False
 
-    
     def decode(self):
         """
         Returns the secret message (a string) stored in the current image. 
@@ -97,30 +560,560 @@ class Encoder(a6filter.Filter):
         # You may modify anything in the above specification EXCEPT
         # The first line (Returns the secret...)
         # The last paragraph (If no message is detected...)
+        return self._lookup()[1]
+    
+    def getCapacity(self, bits=None):
+        """
+        Returns the number of bytes that encode could hide in the current image.
+        
+        This is the largest UTF-8 (or compressed) length that fits with the
+        given format, after the header.
+        
+        Parameter bits: The number of bits to use in each color channel
+        Precondition: bits is None (for the original format), 0, 1, 2 or 4
+        """
+        assert bits is None or bits == 0 or bits in _PLANES, repr(bits)+' is not a valid number of bits'
+        size = len(self.getCurrent())
+        if bits is None:
+            return max(0, min(999999, size-7))
+        
+        # The length takes more pixels as it gets longer, so try each size
+        result = 0
+        for digits in range(1,6):
+            fits = _bytes_in(max(0, size-len(self._make_header(0, bits, 0, digits))-5), bits)
+            result = max(result, min(fits, 128**digits-1))
+        return result
+    
+    def getRequired(self, text, bits=None, compress=None):
+        """
+        Returns the number of pixels that encode would need to hide text.
+        
+        This includes the indicator and header.  It does not change the image
+        and it does not build the UTF-8 bytes of the text, unless they have to
+        be compressed to know their size.  If the format cannot hold the text 
+        at all (the original format is limited to 999999 bytes), this method
+        returns None.
+        
+        Parameter text: The message to hide
+        Precondition: text is a string
+        
+        Parameter bits: The number of bits to use in each color channel
+        Precondition: bits is None (for the original format), 0, 1, 2 or 4
+        
+        Parameter compress: The compression method
+        Precondition: compress is None, 'zlib' or 'lzma'
+        """
+        assert bits is None or bits == 0 or bits in _PLANES, repr(bits)+' is not a valid number of bits'
+        assert compress is None or compress in _COMPRESSION, repr(compress)+' is not a compression method'
+        if compress is None:
+            return self._required(_utf8_length(text), bits)
+        return self._required(len(_compress(text, compress)[0]), 0 if bits is None else bits)
+    
+    def canEncode(self, text, bits=None, compress=None):
+        """
+        Returns True if encode would succeed with these arguments; False otherwise.
+        
+        This is the pre-flight check for encode.  It does not change the image.
+        
+        Parameter text: The message to hide
+        Precondition: text is a string
+        
+        Parameter bits: The number of bits to use in each color channel
+        Precondition: bits is None (for the original format), 0, 1, 2 or 4
+        
+        Parameter compress: The compression method
+        Precondition: compress is None, 'zlib' or 'lzma'
+        """
+        required = self.getRequired(text, bits, compress)
+        return not required is None and required <= len(self.getCurrent())
+    
+    def hasMessage(self):
+        """
+        Returns True if the current image starts with a valid message header.
+        
+        This only looks at the first pixels of the image (at most 32), not the
+        message itself, so it is a fast way to rule out images that have no 
+        message.  It works on an image that holds just the first rows of a 
+        larger picture.  A True result does not mean that the message can be
+        read; use getStatus or decode for that.
+        """
+        try:
+            if self._check_for_indicator():
+                self._read_length(5)
+                return True
+            if self._check_for_indicator(True):
+                self._read_header()
+                return True
+        except (AssertionError, ValueError, IndexError):
+            pass
+        return False
+    
+    def getStatus(self):
+        """
+        Returns the status of the message in the current image.
+        
+        The status is one of the class attributes NONE (there is no message), 
+        VALID (the message checksum matches), UNCHECKED (the message was read,
+        but its format has no checksum), CORRUPT (the header is valid, but 
+        the message is damaged) or SHARD (the checksum matches, but this is 
+        only one shard of a message).  In the last two cases, decode returns 
+        None.  The result is remembered along with the result of decode.
+        """
+        return self._lookup()[0]
+    
+    def encode_stream(self, fileobj, bits=0, compress=None):
+        """
+        Returns True if it could hide the contents of fileobj; False otherwise.
+        
+        This method is like encode, except that the message comes from a file 
+        instead of a string.  The file is read and hidden a block at a time,
+        so the whole message never has to be in memory (or in a text widget).
+        A binary file is hidden as is, and a text file is converted to UTF-8.
+        The message always uses the extended header (see the class 
+        specification), so bits cannot be None.
+        
+        Because the length of the message is not known until the file has been
+        read, space for the longest length that could fit is set aside, and the
+        header is written last.  If compress is not None, the file is 
+        compressed as it is read, even if that does not make it smaller.
+        
+        If the message does not fit, this method restores every pixel it 
+        changed and returns False.  If reading the file fails (or it is not
+        valid UTF-8 text), the pixels are restored too, and the error is 
+        raised again.
+        
+        Parameter fileobj: The file to hide
+        Precondition: fileobj is an open file (text or binary) or file-like object
+        
+        Parameter bits: The number of bits to use in each color channel
+        Precondition: bits is 0 (for decimal digits), 1, 2 or 4
+        
+        Parameter compress: The compression method
+        Precondition: compress is None, 'zlib' or 'lzma'
+        """
+        assert bits == 0 or bits in _PLANES, repr(bits)+' is not a valid number of bits'
+        assert compress is None or compress in _COMPRESSION, repr(compress)+' is not a compression method'
+        
         current = self.getCurrent()
+        flags = 0 if compress is None else _COMPRESSION[compress]
+        size  = len(_varint(3*len(current)))
+        pos   = 5+len(self._make_header(0, bits, flags, size))
+        saved = [(0, current.getBytes(0, min(pos, len(current))))]
+        
+        done = False
         try:
-            assert self._check_for_indicator()
-
-            length = int(str(self._decode_pixel(5)) + str(self._decode_pixel(6)))
-            lst = []
-            for i in range(length):
-                i += 7
-                v = self._decode_pixel(i)
-                lst.append(v)
-
-            if len(lst) == 0:
-                return ''
-            else:
-                c = bytes(lst).decode('utf-8')
-                return str(c)
-            
+            length = 0
+            checksum = 0
+            for block in _read_blocks(fileobj, compress):
+                count = self._payload_pixels(len(block), bits)
+                assert pos+count <= len(current)
+                saved.append((pos, current.getBytes(pos, pos+count)))
+                self._write_payload(block, pos, bits)
+                pos += count
+                length += len(block)
+                checksum = _crc32(block, checksum)
             
+            self._indicate_encode(True)
+            self._encode_bytes(self._make_header(length, bits, flags, size, checksum), 5)
+            done = True
+            return True
         
         except AssertionError:
+            return False
+        
+        finally:
+            # Roll back on any failure, not just when the message does not fit
+            if not done:
+                for pos, data in reversed(saved):
+                    current.setBytes(data, pos)
+    
+    def decode_stream(self, fileobj):
+        """
+        Returns the number of bytes of the secret message written to fileobj.
+        
+        This method is like decode, except that the message is written to a 
+        file instead of returned as a string.  The message is read from the 
+        image and written a block at a time (decompressing it if necessary).
+        A binary file gets the bytes as they were hidden, while a text file 
+        gets them converted from UTF-8.
+        
+        If no message is detected, this method writes nothing and returns None.
+        If the header has a checksum, it is checked before anything is written,
+        and this method raises a ValueError if it does not match.  Otherwise,
+        if the message turns out to be corrupt partway through, this method 
+        raises a ValueError, and part of the message may have been written.
+        
+        Parameter fileobj: The file to write
+        Precondition: fileobj is a writable file (text or binary) or file-like object
+        """
+        import io
+        try:
+            if self._check_for_indicator():
+                bits, flags, checksum, length, pos = (0, 0, None, self._read_length(5), 7)
+            else:
+                assert self._check_for_indicator(True)
+                bits, flags, checksum, length, pos = self._read_header()
+                assert not flags & _SHARDED
+        except (AssertionError, ValueError):
+            return None
+        
+        if pos+self._payload_pixels(length, bits) > len(self.getCurrent()):
+            if checksum is None:
+                return None
+            raise ValueError('message is longer than the image')
+        if not checksum is None:
+            total = 0
+            for start in range(0, length, _BLOCK):
+                count = min(_BLOCK, length-start)
+                total = _crc32(self._read_payload(pos+self._payload_pixels(start, bits), count, bits), total)
+            if total != checksum:
+                raise ValueError('message checksum does not match')
+        engine = _decompressor(flags)
+        
+        text = None
+        if isinstance(fileobj, io.TextIOBase):
+            import codecs
+            text = codecs.getincrementaldecoder('utf-8')()
+        
+        written = 0
+        for start in range(0, length, _BLOCK):
+            count = min(_BLOCK, length-start)
+            data = self._read_payload(pos, count, bits)
+            pos += self._payload_pixels(count, bits)
+            if not engine is None:
+                try:
+                    data = engine.decompress(data)
+                except Exception as e:
+                    raise ValueError('message could not be decompressed') from e
+            written += len(data)
+            if not text is None:
+                data = text.decode(data, start+count == length)
+            fileobj.write(data)
+        
+        if not engine is None and (not engine.eof or engine.unused_data):
+            raise ValueError('message could not be decompressed')
+        return written
+    
+    def encode_shard(self, data, shard, bits=0, flags=0):
+        """
+        Returns True if it could hide the given shard of a message; False otherwise.
+        
+        A shard is a piece of the (possibly compressed) bytes of a message 
+        that has been split across several images.  It is hidden like any 
+        other message, but its header also records its place in the message 
+        (see the class specification).  Use the function encode_shards rather
+        than calling this method directly.
+        
+        Parameter data: The bytes of this shard
+        Precondition: data is a bytes object
+        
+        Parameter shard: The shard id, sequence number and number of shards
+        Precondition: shard is a tuple (ident, index, count) of ints, with 
+        ident in 0..2**32-1 and 0 <= index < count
+        
+        Parameter bits: The number of bits to use in each color channel
+        Precondition: bits is 0 (for decimal digits), 1, 2 or 4
+        
+        Parameter flags: The compression flags of the whole message
+        Precondition: flags is 0 or a value of _COMPRESSION
+        """
+        assert bits == 0 or bits in _PLANES, repr(bits)+' is not a valid number of bits'
+        assert len(shard) == 3 and 0 <= shard[1] < shard[2], repr(shard)+' is not a valid shard'
+        
+        header = self._make_header(len(data), bits, flags | _SHARDED, 1, _crc32(data), shard)
+        pos = 5+len(header)
+        if pos+self._payload_pixels(len(data), bits) > len(self.getCurrent()):
+            return False
+        self._indicate_encode(True)
+        self._encode_bytes(header, 5)
+        self._write_payload(data, pos, bits)
+        return True
+    
+    def decode_shard(self):
+        """
+        Returns the tuple (shard, flags, data) for the shard in the current image.
+        
+        The value shard is the tuple (ident, index, count) from encode_shard,
+        flags is the compression flags of the whole message, and data is the
+        bytes of this shard.  If the image does not hold a shard, or its 
+        checksum does not match, this method returns None.
+        """
+        try:
+            assert self._check_for_indicator(True)
+            bits, flags, checksum, length, pos = self._read_header()
+            assert flags & _SHARDED
+            assert pos+self._payload_pixels(length, bits) <= len(self.getCurrent())
+            data = self._read_payload(pos, length, bits)
+            assert _crc32(data) == checksum
+            return (self._read_shard(), flags & ~_SHARDED, data)
+        except (AssertionError, ValueError):
             return None
-
     
     # HELPER METHODS
+    def _lookup(self):
+        """
+        Returns the (status, message) pair for the current image, from the cache if possible.
+        """
+        current = self.getCurrent()
+        key = (current.getVersion(),current.getBytes(0,min(7,len(current))))
+        if key in self._decoded:
+            self._decoded.move_to_end(key)
+            return self._decoded[key]
+        
+        result = self._decode_message()
+        self._decoded[key] = result
+        if len(self._decoded) > self.MAX_HISTORY:
+            self._decoded.popitem(last=False)
+        return result
+    
+    def _decode_message(self):
+        """
+        Returns the pair (status, message) for the current image.
+        
+        This is the uncached version of getStatus and decode.  The message is
+        None unless the status is VALID or UNCHECKED.  Once the header has been
+        read, the checksum (if any) is checked before anything else is done 
+        with the message.
+        """
+        try:
+            if self._check_for_indicator():
+                length = self._read_length(5)
+                return (self.UNCHECKED, self._decode_bytes(7, length).decode('utf-8'))
+            
+            assert self._check_for_indicator(True)
+            bits, flags, checksum, length, pos = self._read_header()
+        except (AssertionError, ValueError):
+            return (self.NONE, None)
+        
+        # The header was read, so any failure now is corruption
+        try:
+            assert pos+self._payload_pixels(length, bits) <= len(self.getCurrent())
+            data = self._read_payload(pos, length, bits)
+            assert _crc32(data) == checksum
+            if flags & _SHARDED:
+                return (self.SHARD, None)
+            return (self.VALID, _decompress(data, flags).decode('utf-8'))
+        except (AssertionError, ValueError):
+            return (self.CORRUPT, None)
+
+    def _required(self, length, bits):
+        """
+        Returns the number of pixels needed to hide length bytes, or None if impossible.
+        
+        Parameter length: The number of bytes to hide
+        Precondition: length is an int >= 0
+        
+        Parameter bits: The number of bits to use in each color channel
+        Precondition: bits is None (for the original format), 0, 1, 2 or 4
+        """
+        if bits is None:
+            return 7+length if length < 1000000 else None
+        return 5+len(self._make_header(length, bits))+self._payload_pixels(length, bits)
+    
+    def _fits(self, length, bits):
+        """
+        Returns True if length bytes fit in the current image; False otherwise.
+        
+        Parameter length: The number of bytes to hide
+        Precondition: length is an int >= 0
+        
+        Parameter bits: The number of bits to use in each color channel
+        Precondition: bits is None (for the original format), 0, 1, 2 or 4
+        """
+        required = self._required(length, bits)
+        return not required is None and required <= len(self.getCurrent())
+    
+    def _rewrite(self, data, bits, header):
+        """
+        Returns True if it could update the message in the current image in place.
+        
+        This method compares the new message bytes to the bytes already hidden
+        in the image.  If the image holds a message in the same format (and 
+        with a header of the same size), it writes the new header and the 
+        pixels whose bytes are different, and returns True.  Otherwise it 
+        changes nothing and returns False.
+        
+        Parameter data: The bytes to hide
+        Precondition: data is a bytes object that fits in the image
+        
+        Parameter bits: The number of bits to use in each color channel
+        Precondition: bits is None (for the original format), 0, 1, 2 or 4
+        
+        Parameter header: The extended header (None for the original format)
+        Precondition: header is a bytes object from _make_header, or None if 
+        bits is None
+        """
+        current = self.getCurrent()
+        try:
+            if header is None:
+                assert self._check_for_indicator()
+                length = self._read_length(5)
+                pos = 7
+            else:
+                assert self._check_for_indicator(True)
+                assert self._decode_pixel(5) == header[0]
+                _, flags, _, length, pos = self._read_header()
+                assert not flags & _SHARDED
+                assert pos == 5+len(header)
+            assert pos+self._payload_pixels(length, bits or 0) <= len(current)
+            old = self._read_payload(pos, length, bits or 0)
+        except (AssertionError, ValueError):
+            return False
+        
+        # Packed bytes fill whole pixels 3 at a time
+        unit = 1 if not bits else 3
+        if header is None:
+            self._store_length(len(data))
+        else:
+            self._encode_bytes(header, 5)
+        for start, stop in _changed_ranges(old, data, unit):
+            self._write_payload(data[start:stop], pos+self._payload_pixels(start, bits or 0), bits or 0)
+        return True
+    
+    def _make_header(self, length, bits, flags=0, size=1, checksum=0, shard=None):
+        """
+        Returns the bytes of the extended header (after the indicator).
+        
+        Parameter length: The length of the message in bytes
+        Precondition: length is an int >= 0
+        
+        Parameter bits: The number of bits used in each color channel
+        Precondition: bits is 0 (for decimal digits), 1, 2 or 4
+        
+        Parameter flags: The header flags
+        Precondition: flags is an int in 0..255
+        
+        Parameter size: The minimum number of bytes for the length
+        Precondition: size is an int in 1..5
+        
+        Parameter checksum: The CRC32 checksum of the stored message
+        Precondition: checksum is an int in 0..2**32-1
+        
+        Parameter shard: The shard id, sequence number and number of shards
+        Precondition: shard is None or a tuple (ident, index, count) of ints >= 0,
+        and shard is not None exactly when flags has _SHARDED set
+        """
+        result = (bytes([self.FORMAT << 4 | bits]) + self.MAGIC + bytes([flags]) + 
+                  checksum.to_bytes(4, 'big') + _varint(length, size))
+        if not shard is None:
+            result += _varint(shard[1]) + _varint(shard[2]) + shard[0].to_bytes(4, 'big')
+        return result
+    
+    def _read_header(self):
+        """
+        Returns the tuple (bits, flags, checksum, length, pos) read from the extended header.
+        
+        The value pos is the position of the first pixel of the message.  This
+        method assumes that the extended indicator is present.  It raises an 
+        AssertionError (or ValueError) if the header is not valid, which 
+        happens after at most 8 pixels are read unless the magic value is 
+        present.  Only the current version (FORMAT) is accepted.
+        """
+        assert len(self.getCurrent()) >= 8
+        mode = self._decode_pixel(5)
+        version = mode >> 4
+        bits = mode & 15
+        assert bits == 0 or bits in _PLANES
+        assert version == self.FORMAT
+        assert self._decode_bytes(6, 2) == self.MAGIC
+        assert len(self.getCurrent()) >= 14
+        header = self._decode_bytes(8, 5)
+        length, pos = self._read_varint(13)
+        if header[0] & _SHARDED:
+            index, pos = self._read_varint(pos)
+            count, pos = self._read_varint(pos)
+            assert index < count and pos+4 <= len(self.getCurrent())
+            pos += 4
+        return (bits, header[0], int.from_bytes(header[1:], 'big'), length, pos)
+    
+    def _read_shard(self):
+        """
+        Returns the tuple (ident, index, count) from the header of a shard.
+        
+        This method assumes that the current image holds a shard header.  It 
+        raises an AssertionError (or ValueError) if the header is not valid.
+        """
+        pos = self._read_varint(13)[1]
+        index, pos = self._read_varint(pos)
+        count, pos = self._read_varint(pos)
+        ident = int.from_bytes(self._decode_bytes(pos, 4), 'big')
+        return (ident, index, count)
+    
+    def _read_varint(self, pos):
+        """
+        Returns the pair (value, next) for the variable-length integer at pos.
+        
+        The value next is the position of the pixel after the integer.  This 
+        method raises an AssertionError if the pixels do not hold a valid 
+        integer of at most 5 bytes.
+        
+        Parameter pos: The pixel position of the first byte
+        Precondition: pos is an int >= 0
+        """
+        current = self.getCurrent()
+        value = 0
+        for n in range(5):
+            assert pos+n < len(current)
+            byte = self._decode_pixel(pos+n)
+            assert byte < 256
+            value |= (byte & 127) << 7*n
+            if byte < 128:
+                return (value, pos+n+1)
+        assert False, 'length is too long'
+    
+    def _payload_pixels(self, count, bits):
+        """
+        Returns the number of pixels needed to store count bytes.
+        
+        Parameter count: The number of bytes to store
+        Precondition: count is an int >= 0
+        
+        Parameter bits: The number of bits used in each color channel
+        Precondition: bits is 0 (for decimal digits), 1, 2 or 4
+        """
+        if bits == 0:
+            return count
+        return self._packed_pixels(count, bits)
+    
+    def _write_payload(self, data, pos, bits):
+        """
+        Hides the given bytes starting at pixel pos, in the given format.
+        
+        Parameter data: The bytes to hide
+        Precondition: data is a bytes object
+        
+        Parameter pos: The pixel position of the first byte
+        Precondition: pos is an int >= 0 and 
+        pos+_payload_pixels(len(data),bits) <= image length
+        
+        Parameter bits: The number of bits to use in each color channel
+        Precondition: bits is 0 (for decimal digits), 1, 2 or 4
+        """
+        if bits == 0:
+            self._encode_bytes(data, pos)
+        else:
+            self._pack_bits(data, pos, bits)
+    
+    def _read_payload(self, pos, count, bits):
+        """
+        Returns the count bytes hidden starting at pixel pos, in the given format.
+        
+        This raises a ValueError if the pixels do not hold valid bytes.
+        
+        Parameter pos: The pixel position of the first byte
+        Precondition: pos is an int >= 0
+        
+        Parameter count: The number of bytes to read
+        Precondition: count is an int >= 0 and 
+        pos+_payload_pixels(count,bits) <= image length
+        
+        Parameter bits: The number of bits used in each color channel
+        Precondition: bits is 0 (for decimal digits), 1, 2 or 4
+        """
+        if bits == 0:
+            return self._decode_bytes(pos, count)
+        return self._unpack_bits(pos, count, bits)
+    
     def _decode_pixel(self, pos):
         """
         Return: the number n hidden in pixel pos of the current image.
@@ -142,81 +1135,141 @@ class Encoder(a6filter.Filter):
         return  (red % 10) * 100  +  (green % 10) * 10  +  blue % 10
     
 
-    def _encode_pixel(self, code, pos):
+    def _encode_bytes(self, data, pos):
         """
-        Encodes a pixel with the value of a unicode character
-
-        This function converts a unicode character of type str into its 
-        respective numerical code. If the code is less than 3 digits, this
-        function concatenates 0's to the beginning until the str length is 3.
-
-        The function then sets the last digit of the red, green, and blue pixel
-        values of pixel in position pos equal to the first, second, and third
-        digits of the character code, respectively.
-
-        If any of the new pixel values go past the int limit of 255, the 
-        function subtracts 10 from the value(s).
-
-        Parameter code: a code to hide in a pixel
-        Precondition: code is an int >= 0 and < 4
-
-        Parameter pos: a pixel position
-        Precondition: pos is an int with 0 <= pos < image length (as a 1d list)
+        Hides the given bytes in the current image, one byte per pixel.
+        
+        Each byte is written as a 3-digit number into the last digit of the 
+        red, green and blue values of a pixel, starting at pixel pos.  This 
+        is the same format read by _decode_pixel, but all of the pixels are 
+        written in one step.
+        
+        Parameter data: The bytes to hide
+        Precondition: data is a bytes object
         
+        Parameter pos: The pixel position of the first byte
+        Precondition: pos is an int >= 0 and pos+len(data) <= image length
         """
-        assert type(code) == int and code >= 0
-        assert type(pos) == int and pos >= 0 and pos < len(self.getCurrent())
+        digits = bytearray(3*len(data))
+        digits[0::3] = data.translate(_HUNDREDS)
+        digits[1::3] = data.translate(_TENS)
+        digits[2::3] = data.translate(_ONES)
+        self._hide_digits(digits, pos)
+    
+    def _decode_bytes(self, pos, count):
+        """
+        Returns the count bytes hidden in the current image starting at pixel pos.
         
-        current = self.getCurrent()
+        This is the bulk version of _decode_pixel.  It raises a ValueError if 
+        any of the pixels holds a number that is not a byte (> 255).
         
-        string = str(code)
+        Parameter pos: The pixel position of the first byte
+        Precondition: pos is an int >= 0
         
-        if len(string) == 1:
-            string = '00' + string
-        elif len(string) == 2:
-            string = '0' + string
-
-        lst = []
-        for i in string:
-            lst.append(int(i))
+        Parameter count: The number of bytes to read
+        Precondition: count is an int >= 0 and pos+count <= image length
+        """
+        channels = self.getCurrent().getBytes(pos, pos+count)
+        red  = channels[0::3]
+        tens = _add_bytes(channels[1::3].translate(_TIMES10), channels[2::3].translate(_ONES))
         
-        red = current[pos][0]
-        green = current[pos][1]
-        blue = current[pos][2]
-
-        r = red % 10
-        g = green % 10
-        b = blue % 10
-
-        r1 = lst[0]
-        g1 = lst[1]
-        b1 = lst[2]
-
-        if r1 >= r:
-            redf = red + (r1 - r)
-        elif r > r1:
-            redf = red - (r - r1)
-        if redf > 255:
-            redf -= 10
-
-        if b1 >= b:
-            bluef = blue + (b1 - b)
-        elif b > b1:
-            bluef = blue - (b - b1)
-        if bluef > 255:
-            bluef -= 10
-
-        if g1 >= g:
-            greenf = green + (g1 - g)
-        elif g > g1:
-            greenf = green - (g - g1)
-        if greenf > 255:
-            greenf -= 10
+        # The number is a byte if red ends in 0 or 1, or red ends in 2 and tens <= 55
+        if max(red.translate(_ONES), default=0) > 2:
+            raise ValueError('pixel does not hold a byte')
+        if max(_add_bytes(red.translate(_IFTWO), tens), default=0) > 155:
+            raise ValueError('pixel does not hold a byte')
+        return _add_bytes(red.translate(_TIMES100), tens)
+    
+    def _pack_bits(self, data, pos, bits):
+        """
+        Hides the given bytes in the lowest bits of the color channels.
         
-        current[pos] = (redf, greenf, bluef)
-
+        Each byte is split into groups of bits (most significant first), and 
+        each group replaces the lowest bits of one color channel, going through
+        the red, green and blue values of each pixel in turn, starting at pixel
+        pos.  Any channels left over in the last pixel have those bits cleared.
+        
+        Parameter data: The bytes to hide
+        Precondition: data is a bytes object
+        
+        Parameter pos: The pixel position of the first byte
+        Precondition: pos is an int >= 0 and pos+_packed_pixels(len(data),bits) 
+        <= image length
+        
+        Parameter bits: The number of bits to use in each color channel
+        Precondition: bits is 1, 2 or 4
+        """
+        clear, split = _PLANES[bits][:2]
+        groups = 8 // bits
+        count  = self._packed_pixels(len(data), bits)
+        
+        values = bytearray(3*count)
+        for k in range(groups):
+            values[k:len(data)*groups:groups] = data.translate(split[k])
+        
+        current  = self.getCurrent()
+        channels = current.getBytes(pos, pos+count)
+        current.setBytes(_add_bytes(channels.translate(clear), values), pos)
+    
+    def _unpack_bits(self, pos, count, bits):
+        """
+        Returns the count bytes hidden in the lowest bits of the color channels.
+        
+        This reverses _pack_bits.
+        
+        Parameter pos: The pixel position of the first byte
+        Precondition: pos is an int >= 0
+        
+        Parameter count: The number of bytes to read
+        Precondition: count is an int >= 0 and pos+_packed_pixels(count,bits) 
+        <= image length
+        
+        Parameter bits: The number of bits used in each color channel
+        Precondition: bits is 1, 2 or 4
+        """
+        join     = _PLANES[bits][2]
+        groups   = 8 // bits
+        channels = self.getCurrent().getBytes(pos, pos+self._packed_pixels(count, bits))
+        
+        result = channels[0:count*groups:groups].translate(join[0])
+        for k in range(1,groups):
+            result = _add_bytes(result, channels[k:count*groups:groups].translate(join[k]))
+        return result
+    
+    def _packed_pixels(self, count, bits):
+        """
+        Returns the number of pixels needed to pack count bytes.
+        
+        Parameter count: The number of bytes to pack
+        Precondition: count is an int >= 0
+        
+        Parameter bits: The number of bits used in each color channel
+        Precondition: bits is 1, 2 or 4
+        """
+        channels = count*8 // bits
+        return (channels+2) // 3
+    
+    def _hide_digits(self, digits, pos):
+        """
+        Replaces the last digit of consecutive color channels with the given digits.
+        
+        The digits are written into the red, green and blue values of each 
+        pixel in turn, starting at pixel pos.  If a new value would go past 
+        255, it is reduced by 10 so that it keeps the right last digit.
+        
+        Parameter digits: The digits to hide
+        Precondition: digits is a bytes-like object of values in 0..9, with a 
+        length that is a multiple of 3
+        
+        Parameter pos: The pixel position of the first digit
+        Precondition: pos is an int >= 0 and pos+len(digits)//3 <= image length
+        """
+        current  = self.getCurrent()
+        channels = current.getBytes(pos, pos+len(digits)//3)
+        shift = _add_bytes(channels.translate(_HIGH), digits).translate(_SHIFT)
+        current.setBytes(_add_bytes(channels.translate(_ROUND), shift), pos)
 
-    def _indicate_encode(self):
+    def _indicate_encode(self, extended=False):
         """
         Alters the first 5 pixels to indicate the presence of a message
 
@@ -249,167 +1302,267 @@ class Encoder(a6filter.Filter):
         (ie. (0, 0, 0) (1, 0, 1) (2, 0, 0) (1, 0, 9) (12, 24, 53): (12, 24, 53) 
         becomes (12, 24, 57)
 
-        """
+        If extended is True, the fifth check adds 5 to the count first.  This 
+        marks a message that uses the extended header (see encode).
 
+        Parameter extended: Whether to indicate the extended header
+        Precondition: extended is a bool
+        """
         current = self.getCurrent()
-        counter = 0
-        for i in range(4):
-            for v in range(2):
-                if current[i][v] == 0:
-                    counter += 1
-
-            r = current[i][0]
-            g = current[i][1]
-            b = current[i][2]
-            if i == 0:
-                j = (r + g) % 10
-            elif i == 1:
-                j = (r - g) % 10
-            elif i == 2:
-                j = (r * g) % 10
-            else:
-                j = (r ** g) % 10
-
-            if j >= (b%10):
-                m = j - (b % 10)
-                b += m
-            else:
-                m = (b % 10) - j
-                b -= m
+        digits = bytearray(current.getBytes(0, 5)).translate(_ONES)
+        digits[2::3] = self._indicator_digits(extended)
+        self._hide_digits(digits, 0)
 
-            if b > 255:
-                b -= 10
-            
-            current[i] = (r, g, b)
+    def _indicator_digits(self, extended=False):
+        """
+        Returns the 5 blue digits expected by the indicator, as bytes.
         
-        blue = current[4][2]
+        The digits are computed from the red and green values of the first 5 
+        pixels of the current image, as described in _indicate_encode.  Since 
+        _indicate_encode only changes blue values, these digits are the same 
+        before and after the indicator is written.
         
-        if (counter%10) >= (blue%10):
-            l = (counter%10) - (blue%10)
-            blue += l
-        else:
-            l = (blue%10) - (counter%10)
-            blue -= l
-
-        if blue > 255:
-            blue -= 10
-        current[4] = (current[4][0],current[4][1],blue)
-
-
+        Parameter extended: Whether to use the extended indicator
+        Precondition: extended is a bool
+        """
+        current = self.getCurrent()
+        pixels  = current.getBytes(0, 5)
+        red   = pixels[0::3]
+        green = pixels[1::3]
+        r = red.translate(_ONES)
+        g = green.translate(_ONES)
+        
+        zeros = red[:4].count(0) + green[:4].count(0)
+        if extended:
+            zeros += 5
+        return bytes([(r[0] + g[0]) % 10, abs(r[1] - g[1]) % 10, 
+                      (r[2] * g[2]) % 10, (r[3] ** g[3]) % 10, zeros % 10])
     
-    def _store_length(self, l):
+    def _store_length(self, l, pos=5):
         """
-        Stores the length of the message in the 6th and 7th pixels
+        Stores the length of the message in the 2 pixels starting at pos
 
         This function takes the length l of the text and encodes each
         digit into the last digit of the 6 values that make up the 2
-        pixels  
+        pixels. By default these are the 6th and 7th pixels.
 
         Parameter l: the length of the message in pixels
-        Precondition: l is an int
+        Precondition: l is an int in 0..999999
+        
+        Parameter pos: the position of the first pixel
+        Precondition: pos is an int >= 0 and pos+2 <= image length
         """
-        assert type(l) == int
+        assert type(l) == int and 0 <= l < 1000000
 
-        current = self.getCurrent()
+        digits = bytes(int(d) for d in str(l).rjust(6,'0'))
+        self._hide_digits(digits, pos)
+    
+    def _read_length(self, pos):
+        """
+        Returns the length stored by _store_length in the 2 pixels starting at pos
         
-        string = str(l)
-        while len(string) < 6:
-            string = '0' + string
-        lst = []
-        for i in string:
-            lst.append(int(i))
-
-        n = 0
-        for pos in range(2):
-            pos += 5
-            red = current[pos][0]
-            green = current[pos][1]
-            blue = current[pos][2]
-
-            r = red % 10
-            g = green % 10
-            b = blue % 10
-
-            r1 = lst[n]
-            n += 1
-            g1 = lst[n]
-            n += 1
-            b1 = lst[n]
-            n += 1
-
-            if r1 >= r:
-                redf = red + (r1 - r)
-            elif r > r1:
-                redf = red - (r - r1)
-            if redf > 255:
-                redf -= 10
-
-            if b1 >= b:
-                bluef = blue + (b1 - b)
-            elif b > b1:
-                bluef = blue - (b - b1)
-            if bluef > 255:
-                bluef -= 10
-
-            if g1 >= g:
-                greenf = green + (g1 - g)
-            elif g > g1:
-                greenf = green - (g - g1)
-            if greenf > 255:
-                greenf -= 10
-            
-            current[pos] = (redf, greenf, bluef)
+        Parameter pos: the position of the first pixel
+        Precondition: pos is an int >= 0 and pos+2 <= image length
+        """
+        return self._decode_pixel(pos)*1000 + self._decode_pixel(pos+1)
     
-
-    def _check_for_indicator(self):
+    def _check_for_indicator(self, extended=False):
         """
         Returns True if a message is encoded. False otherwise.
 
-        This function asserts the tests set up by the function
+        This function checks the tests set up by the function
         _indicate_encode. If any of them fail, the function returns
         False. If they all pass, the function returns True.
+        
+        Parameter extended: Whether to check for the extended indicator
+        Precondition: extended is a bool
         """
-
         current = self.getCurrent()
-        r0 = current[0][0]
-        g0 = current[0][1]
-        b0 = current[0][2]
-
-        r1 = current[1][0]
-        g1 = current[1][1]
-        b1 = current[1][2]
-
-        r2 = current[2][0]
-        g2 = current[2][1]
-        b2 = current[2][2]
-
-        r3 = current[3][0]
-        g3 = current[3][1]
-        b3 = current[3][2]
-
-        b4 = current[4][2]
-        counter = 0
-        for i in range(4):
-            for v in range(2):
-                if current[i][v] == 0:
-                    counter += 1
-                else:
-                    pass
-        try:
-            
-            assert (r0%10)+(g0%10)==(b0%10)
-            if (r1%10) >= (g1%10):
-                assert (r1%10)-(g1%10)==(b1%10)
-            elif (g1%10)>(r1%10):
-                assert (g1%10)-(r1%10)==(b1%10)
-            assert (r2%10)*(g2%10)==(b2%10)
-            assert (r3%10)**(g3%10)==(b3%10)
-            assert (counter%10) == (b4%10)
-            return True
-        
-        except AssertionError:
+        if len(current) < 5:
             return False
+        
+        blue = current.getBytes(0, 5)[2::3].translate(_ONES)
+        return blue == self._indicator_digits(extended)
+
+
+# MULTI-IMAGE MESSAGES
+# The most pixels that a shard header (with the indicator) can use
+_SHARD_HEADER = 32
+
+
+def shard_capacity(image, bits=0):
+    """
+    Returns the number of message bytes that fit in image as one shard.
+    
+    Parameter image: The carrier image
+    Precondition: image is an Image object
+    
+    Parameter bits: The number of bits to use in each color channel
+    Precondition: bits is 0 (for decimal digits), 1, 2 or 4
+    """
+    return _bytes_in(max(0, len(image)-_SHARD_HEADER), bits)
+
+
+def encode_shards(images, text, bits=0, compress=None, workers=None):
+    """
+    Returns a list of new images that hide text between them, or None if it does not fit.
+    
+    The UTF-8 bytes of the text (compressed first if compress is not None) 
+    are split into one shard per image, in proportion to how much each image 
+    can hold (see shard_capacity).  So every image gets about the same share
+    of the work, and small images can carry a large message together.  Each 
+    shard is hidden by Encoder.encode_shard in a pool of worker processes.
+    
+    The images in the list are encoded copies of the images given, in the 
+    same order; the originals are not changed.  All of them are needed to 
+    decode the message (see decode_shards), but in any order.  The text does 
+    not fit if any image is too small to hold a shard header, even when the
+    other images have room for the whole message.
+    
+    Parameter images: The carrier images
+    Precondition: images is a non-empty list of Image objects
+    
+    Parameter text: The message to hide
+    Precondition: text is a string
+    
+    Parameter bits: The number of bits to use in each color channel
+    Precondition: bits is 0 (for decimal digits), 1, 2 or 4
+    
+    Parameter compress: The compression method
+    Precondition: compress is None, 'zlib' or 'lzma'
+    
+    Parameter workers: The number of worker processes (None for one per core)
+    Precondition: workers is None or an int > 0
+    """
+    assert len(images) > 0, 'there are no carrier images'
+    assert bits == 0 or bits in _PLANES, repr(bits)+' is not a valid number of bits'
+    assert compress is None or compress in _COMPRESSION, repr(compress)+' is not a compression method'
+    assert type(text) == str
+    
+    if compress is None:
+        data, flags = (text.encode('utf-8'), 0)
+    else:
+        data, flags = _compress(text, compress)
+    
+    # Every carrier needs room for its shard header, even if its shard is empty
+    if min(map(len, images)) < _SHARD_HEADER:
+        return None
+    limits = [shard_capacity(image, bits) for image in images]
+    total  = sum(limits)
+    if len(data) > total:
+        return None
+    
+    # Split in proportion to capacity, then hand out what rounding left over
+    sizes = [len(data)*limit // total for limit in limits]
+    extra = len(data)-sum(sizes)
+    for pos in range(len(sizes)):
+        if extra > 0 and sizes[pos] < limits[pos]:
+            sizes[pos] += 1
+            extra -= 1
+    
+    ident = _crc32(data)
+    jobs  = []
+    start = 0
+    for pos in range(len(images)):
+        shard = (ident, pos, len(images))
+        jobs.append((images[pos].getBytes(), images[pos].getWidth(), 
+                     data[start:start+sizes[pos]], shard, bits, flags))
+        start += sizes[pos]
+    
+    results = _map_shards(_encode_shard, jobs, workers)
+    if None in results:
+        return None
+    return [a6image.Image(Pixels(results[pos]), images[pos].getWidth()) for pos in range(len(images))]
+
+
+def decode_shards(images, workers=None):
+    """
+    Returns the message hidden across the given images, or None if there is none.
+    
+    The shards are read from the images by a pool of worker processes, and 
+    then put back together in order of their sequence numbers.  The images 
+    may be given in any order, and images without a shard are ignored.  If 
+    the images hold shards of more than one message, the first complete 
+    message is returned.  If a shard is missing or damaged, or the message 
+    does not match its id (the checksum of the whole message), the result 
+    is None.
+    
+    Parameter images: The images holding the shards
+    Precondition: images is a list of Image objects
+    
+    Parameter workers: The number of worker processes (None for one per core)
+    Precondition: workers is None or an int > 0
+    """
+    jobs = [(image.getBytes(), image.getWidth()) for image in images]
+    sets = {}
+    for result in _map_shards(_decode_shard, jobs, workers):
+        if not result is None:
+            (ident, index, count), flags, data = result
+            sets.setdefault((ident, count, flags), {})[index] = data
+    
+    for (ident, count, flags), pieces in sets.items():
+        if len(pieces) != count:
+            continue
+        data = b''.join(pieces[index] for index in range(count))
+        try:
+            assert _crc32(data) == ident
+            return _decompress(data, flags).decode('utf-8')
+        except (AssertionError, ValueError):
+            pass
+    return None
+
+
+def _map_shards(function, jobs, workers):
+    """
+    Returns the list of results of function on each job, using worker processes.
+    
+    If there is only one job or one worker, the jobs are run in this process 
+    instead, since starting a process would take longer than the job.
+    
+    Parameter function: The function to call on each job
+    Precondition: function is a module-level function of one argument
+    
+    Parameter jobs: The arguments to call function on
+    Precondition: jobs is a list of picklable values
+    
+    Parameter workers: The number of worker processes (None for one per core)
+    Precondition: workers is None or an int > 0
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    assert workers is None or (type(workers) == int and workers > 0), repr(workers)+' is not a number of workers'
+    if len(jobs) <= 1 or workers == 1:
+        return list(map(function, jobs))
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(function, jobs))
 
 
+def _encode_shard(job):
+    """
+    Returns the pixel bytes of a carrier image after hiding a shard in it.
+    
+    This is the work done by each worker process in encode_shards.  If the 
+    shard does not fit in the image, the result is None.
+    
+    Parameter job: The carrier and the shard to hide
+    Precondition: job is a tuple (pixels, width, data, shard, bits, flags), 
+    where pixels and width describe the image and the rest are the arguments
+    of Encoder.encode_shard
+    """
+    pixels, width, data, shard, bits, flags = job
+    encoder = Encoder(a6image.Image(Pixels(pixels), width))
+    if not encoder.encode_shard(data, shard, bits, flags):
+        return None
+    return encoder.getCurrent().getBytes()
 
 
+def _decode_shard(job):
+    """
+    Returns the result of Encoder.decode_shard for an image.
+    
+    This is the work done by each worker process in decode_shards.
+    
+    Parameter job: The image to read
+    Precondition: job is a tuple (pixels, width) describing the image
+    """
+    pixels, width = job
+    return Encoder(a6image.Image(Pixels(pixels), width)).decode_shard()
@@ -245,7 +245,128 @@ class Filter(a6editor.Editor):
             rgb = (int(red), int(green), int(blue))
             current[pos] = rgb
 
+    # NEIGHBORHOOD FILTERS
+    def convolve(self, kernel, border='clamp'):
+        """
+        Convolves the current image with the given kernel.
+
+        Each color channel of each pixel is replaced by the weighted sum of
+        that channel over the neighborhood of the pixel, using the weights of
+        the kernel (see Kernel).  The pixels past the edges of the image are
+        filled in according to border (see BORDERS).
+
+        Parameter kernel: The weights of the neighborhood
+        Precondition: kernel is a Kernel
+
+        Parameter border: How to fill in the pixels past the edges
+        Precondition: border is a string in BORDERS
+        """
+        assert isinstance(kernel,Kernel), repr(kernel)+' is not a Kernel'
+        assert border in BORDERS, repr(border)+' is not a valid border mode'
+        _convolve(self.getCurrent(),kernel,border)
+
+    def blur(self, radius=2):
+        """
+        Blurs the current image with a Gaussian of the given radius.
+
+        The neighborhood of each pixel is a square with sides 2*radius+1.
+
+        Parameter radius: The radius of the blur
+        Precondition: radius is an int > 0
+        """
+        self.convolve(Kernel.gaussian(radius))
+
+    def sharpen(self, amount=1.0, radius=1):
+        """
+        Sharpens the current image with an unsharp mask.
+
+        Each pixel moves away from the blur of its neighborhood (a Gaussian
+        of the given radius) by amount times its difference from the blur.
+
+        Parameter amount: The strength of the sharpening
+        Precondition: amount is a number, 0 <= amount <= 4
+
+        Parameter radius: The radius of the blur
+        Precondition: radius is an int > 0
+        """
+        self.convolve(Kernel.sharpen(amount,radius))
+
+    def edges(self):
+        """
+        Replaces the current image with its edges.
+
+        This is the Laplacian of the image: the amount that each pixel is
+        brighter than its eight neighbors.  Flat areas become black.
+        """
+        self.convolve(Kernel.laplacian())
+
+    # TONE FILTERS
+    def autoLevels(self, clip=0.005):
+        """
+        Stretches each color channel of the current image to the full range 0..255.
+        
+        In each channel, the darkest clip fraction of the pixels become 0, 
+        the brightest clip fraction become 255, and the values in between 
+        are stretched evenly.  Clipping a few pixels keeps a handful of 
+        extreme values from preventing the stretch.  The channels are 
+        stretched separately, so this also removes a color cast.
+        
+        Parameter clip: The fraction of pixels to clip at each end
+        Precondition: clip is a number, 0 <= clip < 0.5
+        """
+        assert type(clip) in (int,float) and 0 <= clip < 0.5, repr(clip)+' is not a valid clip'
+        current = self.getCurrent()
+        if len(current) == 0:
+            return
+        lows  = current.getPercentile(clip)
+        highs = current.getPercentile(1-clip)
+        self._applyTables([_stretch_table(low,high) for low, high in zip(lows,highs)])
 
+    def equalize(self):
+        """
+        Equalizes the histogram of each color channel of the current image.
+        
+        Each value is replaced by the fraction of pixels that are at or 
+        below it in that channel (scaled so that the smallest value present 
+        becomes 0 and the largest becomes 255).  This spreads the values 
+        as evenly as possible over 0..255.  A channel with only one value 
+        is not changed.
+        """
+        current = self.getCurrent()
+        if len(current) == 0:
+            return
+        self._applyTables([_equalize_table(counts) for counts in current.getHistogram()])
+
+    def applyRegion(self, region, name, *args):
+        """
+        Runs the image processing method name on just a region of the current image.
+        
+        The region is cut out of the current image, the method is run on it 
+        as if it were an image of its own, and the selected pixels are copied
+        back (see region.apply).  So the method only processes the pixels in 
+        the bounds of the region.  This raises a ValueError if the method 
+        changes the shape of the region (such as rotating a region that is 
+        not square).
+        
+        Parameter region: The part of the image to process
+        Precondition: region is a Region that fits the current image
+        
+        Parameter name: The method to run
+        Precondition: name is the name of an image processing method of this class
+        
+        Parameter(s) *args: The arguments to the method
+        Precondition: args are valid arguments for the method
+        """
+        import region as regions
+        def process(part):
+            editor = type(self)(part)
+            result = getattr(editor,name)(*args)
+            current = editor.getCurrent()
+            part.setBytes(current.getBytes())
+            if current.getWidth() != part.getWidth():
+                part.setWidth(current.getWidth())
+            return result
+        return regions.apply(self.getCurrent(),region,process)
     
     # HELPER METHODS
     def _drawHBar(self, row, pixel):
@@ -291,4 +412,570 @@ class Filter(a6editor.Editor):
             current.setPixel(row, col, pixel)
             current.setPixel(row, col+1, pixel)
             current.setPixel(row, col+2, pixel)
-            current.setPixel(row, col+3, pixel)
\ No newline at end of file
+            current.setPixel(row, col+3, pixel)
+
+    def _applyTables(self, tables):
+        """
+        Replaces every value in each color channel of the current image using a table.
+        
+        Each table is a lookup table (LUT): value v of the channel becomes
+        table[v].  The whole image is done at once with bytes.translate.
+        
+        Parameter tables: The tables for red, green and blue
+        Precondition: tables is a list of three bytes objects of length 256
+        """
+        current = self.getCurrent()
+        data = current.getBytes()
+        result = bytearray(len(data))
+        for channel in range(3):
+            result[channel::3] = data[channel::3].translate(tables[channel])
+        current.setBytes(result)
+
+class Kernel(object):
+    """
+    The weights for a convolution (see Filter.convolve).
+
+    The weights are a grid of ints with an odd number of rows and columns,
+    centered on the pixel being computed.  The arithmetic is all integer
+    (fixed point): the weighted sum is divided by 2**shift, rounded, and 
+    clamped to 0..255.  So a blur has weights that add up to 2**shift.
+
+    A kernel is split into terms when it is made.  Each term is a column 
+    of weights times a row of weights, so it can be applied as a vertical
+    pass followed by a horizontal pass, and the kernel is the sum of its
+    terms.  A separable kernel (such as a Gaussian) has just one term, so a
+    15x15 blur costs 30 weights per pixel instead of 225.  A separable 
+    kernel plus a multiple of the center (such as an unsharp mask or a 
+    Laplacian) has two terms, and any other kernel has one term per row.
+    """
+    # HIDDEN ATTRIBUTES
+    # Attribute _weights: The weights, one tuple per row
+    # Invariant: _weights is a non-empty tuple of equal length tuples of ints,
+    # with an odd number of rows and columns
+    #
+    # Attribute _shift: The power of two to divide the weighted sums by
+    # Invariant: _shift is an int, 0 <= _shift <= 24
+    #
+    # Attribute _terms: The (column,row) pairs whose outer products add up to _weights
+    # Invariant: _terms is a tuple of pairs of tuples of ints, each column as
+    # long as the number of rows in _weights and each row as long as a row of it
+
+    def __init__(self, weights, shift=None):
+        """
+        Initializes a kernel with the given weights.
+
+        If shift is None, the weights must add up to a power of two, and the
+        sums are divided by it (so the kernel keeps the brightness of the 
+        image).  The weights must be small enough that the sums fit in 30 
+        bits: 255 times the sum of their absolute values is less than 2**29.
+
+        Parameter weights: The weights, as a list of rows
+        Precondition: weights is a non-empty 2d list of ints, with an odd number
+        of rows and an odd number of columns
+
+        Parameter shift: The power of two to divide the weighted sums by
+        Precondition: shift is None or an int, 0 <= shift <= 24
+        """
+        assert len(weights) % 2 == 1, 'a kernel needs an odd number of rows'
+        assert len(weights[0]) % 2 == 1, 'a kernel needs an odd number of columns'
+        assert all(len(row) == len(weights[0]) for row in weights), 'the kernel rows are not the same length'
+        assert all(type(x) == int for row in weights for x in row), 'the kernel weights are not all ints'
+        if shift is None:
+            total = sum(map(sum,weights))
+            assert total > 0 and total & (total-1) == 0, 'the kernel weights do not add up to a power of two'
+            shift = total.bit_length()-1
+        assert type(shift) == int and 0 <= shift <= 24, repr(shift)+' is not a valid shift'
+
+        self._weights = tuple(tuple(row) for row in weights)
+        self._shift = shift
+        self._terms = tuple((tuple(col),tuple(row)) for col, row in _decompose(self._weights))
+        assert 255*self._getBound() < 2**29, 'the kernel weights are too large'
+
+    @classmethod
+    def gaussian(cls, radius, sigma=None):
+        """
+        Returns a Gaussian blur whose neighborhood has sides 2*radius+1.
+
+        Parameter radius: The radius of the neighborhood
+        Precondition: radius is an int > 0
+
+        Parameter sigma: The standard deviation of the Gaussian (default radius/2)
+        Precondition: sigma is None or a number > 0
+        """
+        line = _gaussian(radius,sigma,10)
+        return cls([[a*b for b in line] for a in line])
+
+    @classmethod
+    def sharpen(cls, amount=1.0, radius=1):
+        """
+        Returns an unsharp mask: the image plus amount times (image - blur).
+
+        The amount is rounded to a multiple of 1/8.
+
+        Parameter amount: The strength of the sharpening
+        Precondition: amount is a number, 0 <= amount <= 4
+
+        Parameter radius: The radius of the blur
+        Precondition: radius is an int > 0
+        """
+        assert type(amount) in (int,float) and 0 <= amount <= 4, repr(amount)+' is not a valid amount'
+        line = _gaussian(radius,None,7)
+        amount = round(amount*8)
+        weights = [[-amount*a*b for b in line] for a in line]
+        weights[radius][radius] += (1 << 17)+(amount << 14)
+        return cls(weights,17)
+
+    @classmethod
+    def laplacian(cls):
+        """
+        Returns the 3x3 Laplacian: eight times the center minus its neighbors.
+        """
+        return cls([[-1,-1,-1],[-1,8,-1],[-1,-1,-1]],0)
+
+    def getSize(self):
+        """
+        Returns the (width, height) of the neighborhood
+        """
+        return (len(self._weights[0]),len(self._weights))
+
+    def getWeights(self):
+        """
+        Returns a copy of the weights, as a list of rows
+        """
+        return [list(row) for row in self._weights]
+
+    def getShift(self):
+        """
+        Returns the power of two that the weighted sums are divided by
+        """
+        return self._shift
+
+    def getTerms(self):
+        """
+        Returns the terms of this kernel, as a list of (column,row) pairs.
+
+        The outer products of the pairs add up to the weights.
+        """
+        return [(list(col),list(row)) for col, row in self._terms]
+
+    def isSeparable(self):
+        """
+        Returns True if this kernel has at most one term
+        """
+        return len(self._terms) <= 1
+
+    def __repr__(self):
+        """
+        Returns the unambiguous string representation of this kernel
+        """
+        width, height = self.getSize()
+        return ('Kernel('+str(width)+'x'+str(height)+' >> '+str(self._shift)+
+                ', '+str(len(self._terms))+' terms)')
+
+    # HELPER METHODS
+    def _getBound(self):
+        """
+        Returns the largest weighted sum (over all the terms) for a pixel value of 1
+        """
+        return sum(sum(map(abs,col))*sum(map(abs,row)) for col, row in self._terms)
+
+
+# How to fill in the pixels past the edges of an image for a convolution:
+# 'clamp' repeats the edge pixels, 'reflect' mirrors the image about its 
+# edge pixels (without repeating them), 'wrap' tiles the image, and 'zero'
+# uses black
+BORDERS = ('clamp','reflect','wrap','zero')
+
+# The number of channel values (lanes) to convolve at once
+_TILE = 1 << 18
+
+
+# HELPER FUNCTIONS
+def _gaussian(radius, sigma, bits):
+    """
+    Returns the weights of a 1d Gaussian, as ints adding up to 2**bits.
+
+    Parameter radius: The number of weights on each side of the center
+    Precondition: radius is an int > 0
+
+    Parameter sigma: The standard deviation (default radius/2)
+    Precondition: sigma is None or a number > 0
+
+    Parameter bits: The precision of the weights
+    Precondition: bits is an int > 0
+    """
+    import math
+    assert type(radius) == int and radius > 0, repr(radius)+' is not a valid radius'
+    if sigma is None:
+        sigma = radius/2
+    assert type(sigma) in (int,float) and sigma > 0, repr(sigma)+' is not a valid sigma'
+    curve = [math.exp(-k*k/(2*sigma*sigma)) for k in range(-radius,radius+1)]
+    total = sum(curve)
+    line  = [round(x*(1 << bits)/total) for x in curve]
+    line[radius] += (1 << bits)-sum(line)
+    return line
+
+
+def _decompose(weights):
+    """
+    Returns a list of (column,row) pairs whose outer products add up to weights.
+
+    This tries one term (a separable kernel), then a separable kernel plus 
+    a multiple of the center, and otherwise makes one term for each row
+    that is not all zeros.
+
+    Parameter weights: The kernel weights
+    Precondition: weights is a 2d list of ints, with odd dimensions
+    """
+    height, width = len(weights), len(weights[0])
+    if not any(map(any,weights)):
+        return []
+
+    term = _rank_one(weights)
+    if not term is None:
+        return [term]
+
+    middle, center = height//2, width//2
+    term = _rank_one(weights,(middle,center))
+    if not term is None:
+        extra = weights[middle][center]-term[0][middle]*term[1][center]
+        return [term,(_unit(height,middle,extra),_unit(width,center,1))]
+
+    return [(_unit(height,pos,1),list(weights[pos])) for pos in range(height) if any(weights[pos])]
+
+
+def _rank_one(weights, skip=None):
+    """
+    Returns a (column,row) pair of ints whose outer product is weights, or None.
+
+    If skip is not None, the weight at that position is ignored (it can 
+    have any value).  The row is the first suitable row of weights, divided
+    by the gcd of its entries, so the column is also made of ints.
+
+    Parameter weights: The kernel weights
+    Precondition: weights is a 2d list of ints, not all zero
+
+    Parameter skip: The (row,column) position to ignore
+    Precondition: skip is None or a pair of ints inside weights
+    """
+    import math
+    height, width = len(weights), len(weights[0])
+    known = lambda i, j : (i,j) != skip
+
+    # The reference row, which must have a nonzero weight that is not skipped
+    choices = [pos for pos in range(height) if any(weights[pos][j] and known(pos,j) for j in range(width))]
+    if not choices:
+        return None
+    choices.sort(key=lambda pos : skip is not None and pos == skip[0])
+    line = list(weights[choices[0]])
+    if not skip is None and choices[0] == skip[0]:
+        line[skip[1]] = 0
+    factor = math.gcd(*line)
+    line = [x//factor for x in line]
+    if next(x for x in line if x) < 0:
+        line = [-x for x in line]
+
+    column = []
+    for i in range(height):
+        scale = 0
+        for j in range(width):
+            if line[j] and known(i,j):
+                if weights[i][j] % line[j]:
+                    return None
+                scale = weights[i][j]//line[j]
+                break
+        if any(known(i,j) and weights[i][j] != scale*line[j] for j in range(width)):
+            return None
+        column.append(scale)
+    return (column,line)
+
+
+def _unit(size, pos, value):
+    """
+    Returns a list of size zeros, except for value at pos.
+
+    Parameter size: The length of the list
+    Precondition: size is an int > 0
+
+    Parameter pos: The position of the nonzero value
+    Precondition: pos is an int, 0 <= pos < size
+
+    Parameter value: The nonzero value
+    Precondition: value is an int
+    """
+    result = [0]*size
+    result[pos] = value
+    return result
+
+
+def _border_index(pos, size, border):
+    """
+    Returns the position inside 0..size-1 to use for pos, or None for black.
+
+    Parameter pos: The position of a row or column, possibly outside the image
+    Precondition: pos is an int
+
+    Parameter size: The number of rows or columns in the image
+    Precondition: size is an int > 0
+
+    Parameter border: How to fill in the pixels past the edges
+    Precondition: border is a string in BORDERS
+    """
+    if 0 <= pos < size:
+        return pos
+    elif border == 'clamp':
+        return 0 if pos < 0 else size-1
+    elif border == 'wrap':
+        return pos % size
+    elif border == 'reflect':
+        if size == 1:
+            return 0
+        pos %= 2*(size-1)
+        return pos if pos < size else 2*(size-1)-pos
+    return None
+
+
+def _convolve(image, kernel, border):
+    """
+    Convolves image (in place) with kernel.
+
+    The image is processed in bands of rows, each with enough rows above and
+    below it (from the image, or from the border) to compute the band.  The 
+    bands are small (about _TILE channel values), so that the large integers
+    used for each band stay in the cache.  The bands are all read from a 
+    copy of the original pixels, so they do not see each other's results.
+
+    Parameter image: The image to convolve
+    Precondition: image is an Image object
+
+    Parameter kernel: The weights of the neighborhood
+    Precondition: kernel is a Kernel
+
+    Parameter border: How to fill in the pixels past the edges
+    Precondition: border is a string in BORDERS
+    """
+    width, height = image.getWidth(), image.getHeight()
+    across, down = kernel.getSize()
+    across, down = across//2, down//2
+    source = image.getBytes()
+    stride = 3*(width+2*across)
+    rows = max(_TILE//stride,4*down,1)
+    for top in range(0,height,rows):
+        bottom = min(top+rows,height)
+        band = _pad_band(source,width,height,top-down,bottom+down,across,border)
+        image.setBytes(_convolve_band(band,stride,bottom-top,width,kernel),top*width)
+
+
+def _pad_band(source, width, height, first, last, across, border):
+    """
+    Returns the rows first..last-1 of the image, with across pixels added to each side.
+
+    Rows and columns outside the image are filled in according to border.
+
+    Parameter source: The pixels of the image
+    Precondition: source is a bytes-like object of 3*width*height bytes
+
+    Parameter width: The image width
+    Precondition: width is an int > 0
+
+    Parameter height: The image height
+    Precondition: height is an int > 0
+
+    Parameter first: The first row to include
+    Precondition: first is an int <= last
+
+    Parameter last: The row after the last one to include
+    Precondition: last is an int
+
+    Parameter across: The number of pixels to add to each side
+    Precondition: across is an int >= 0
+
+    Parameter border: How to fill in the pixels past the edges
+    Precondition: border is a string in BORDERS
+    """
+    line  = 3*width
+    black = b'\x00\x00\x00'
+    left  = [_border_index(col,width,border) for col in range(-across,0)]
+    right = [_border_index(col,width,border) for col in range(width,width+across)]
+    blank = bytes(line+6*across)
+
+    pieces = []
+    for row in range(first,last):
+        pos = _border_index(row,height,border)
+        if pos is None:
+            pieces.append(blank)
+            continue
+        data = source[pos*line:(pos+1)*line]
+        pieces.extend(black if col is None else data[3*col:3*col+3] for col in left)
+        pieces.append(data)
+        pieces.extend(black if col is None else data[3*col:3*col+3] for col in right)
+    return b''.join(pieces)
+
+
+def _convolve_band(band, stride, count, width, kernel):
+    """
+    Returns the convolved pixels of a padded band (from _pad_band).
+
+    Every channel value of the band is put in a 32-bit lane of one large 
+    integer.  Shifting the integer by one lane moves to the next channel, 
+    by 3 lanes to the next pixel, and by stride lanes to the next row, so 
+    each weight of each pass is a single shift and multiply of the whole 
+    band.  Negative weights are subtracted from a bias, so that no lane 
+    ever goes negative (or borrows from its neighbor).
+
+    Parameter band: The padded rows
+    Precondition: band is a bytes-like object, a multiple of stride long
+
+    Parameter stride: The number of bytes in a padded row
+    Precondition: stride is an int > 0
+
+    Parameter count: The number of rows to compute
+    Precondition: count is an int > 0, with the kernel height - 1 more rows in band
+
+    Parameter width: The number of pixels to compute in each row
+    Precondition: width is an int > 0, with the kernel width - 1 fewer pixels than stride/3
+
+    Parameter kernel: The weights of the neighborhood
+    Precondition: kernel is a Kernel
+    """
+    lanes = len(band)
+    spread = bytearray(4*lanes)
+    spread[0::4] = band
+    value = int.from_bytes(spread,'little')
+    ones  = int.from_bytes(b'\x01\x00\x00\x00'*lanes,'little')
+
+    total, offset = 0, 0
+    for column, row in kernel.getTerms():
+        part, shift, top = _convolve_pass(value,column,32*stride,0,255,ones)
+        part, shift, top = _convolve_pass(part,row,96,shift,top,ones)
+        total  += part
+        offset += shift
+
+    # Only the first count rows are complete
+    lanes = count*stride
+    size  = (1 << 32*lanes)-1
+    data  = _normalize(total & size,ones & size,offset,kernel.getShift())
+    data  = data.to_bytes(4*lanes,'little')[0::4]
+    return b''.join(data[row*stride:row*stride+3*width] for row in range(count))
+
+
+def _convolve_pass(value, weights, step, offset, bound, ones):
+    """
+    Returns the result of a 1d pass of weights over the lanes of value.
+
+    Each lane of value holds a number v plus offset, between 0 and bound.  
+    The result is a tuple (value,offset,bound) in the same form, where each
+    lane holds the weighted sum of v over that lane and the ones after it 
+    (every step bits).
+
+    Parameter value: The lanes to sum
+    Precondition: value is an int >= 0
+
+    Parameter weights: The weights of the pass
+    Precondition: weights is a list of ints
+
+    Parameter step: The number of bits between the values being summed
+    Precondition: step is an int > 0
+
+    Parameter offset: The amount added to each lane of value
+    Precondition: offset is an int, 0 <= offset <= bound
+
+    Parameter bound: The largest possible lane of value
+    Precondition: bound is an int >= 0
+
+    Parameter ones: The number with a 1 in every lane
+    Precondition: ones is an int > 0
+    """
+    plus, minus = 0, 0
+    above, below = 0, 0
+    for pos, weight in enumerate(weights):
+        if weight == 0:
+            continue
+        shifted = value >> pos*step
+        if weight > 0:
+            plus  += shifted if weight == 1 else weight*shifted
+            above += weight
+        else:
+            minus += shifted if weight == -1 else -weight*shifted
+            below -= weight
+    if below:
+        plus += below*bound*ones-minus
+    return (plus,offset*(above-below)+below*bound,(above+below)*bound)
+
+
+def _normalize(value, ones, offset, shift):
+    """
+    Returns the lanes of value divided by 2**shift, rounded, and clamped to 0..255.
+
+    Each lane of value holds a weighted sum v plus offset, where v can be 
+    negative.  The lanes must be less than 2**30.  The clamping uses the 
+    top bit of each lane as a guard: subtracting from a lane with the guard
+    set cannot borrow from the next lane, and the guard is still set after
+    the subtraction only if the result is not negative.
+
+    Parameter value: The lanes to normalize
+    Precondition: value is an int >= 0
+
+    Parameter ones: The number with a 1 in every lane of value
+    Precondition: ones is an int > 0
+
+    Parameter offset: The amount added to each lane of value
+    Precondition: offset is an int >= 0
+
+    Parameter shift: The power of two to divide by
+    Precondition: shift is an int, 0 <= shift <= 24
+    """
+    guard = ones << 31
+    full  = ones*0x7FFFFFFF
+
+    # Divide by 2**shift, rounding, with every lane lifted by 'lift' so it is positive
+    lift  = -(-offset >> shift)
+    value = value+((lift << shift)-offset+((1 << shift) >> 1))*ones
+    value = (value >> shift) & (ones*((1 << 32-shift)-1))
+
+    # Set the negative lanes to 0
+    value = (value | guard)-lift*ones
+    value = value & full & (((value >> 31) & ones)*0x7FFFFFFF)
+
+    # Set the lanes above 255 to 255
+    over  = (((value | guard)-256*ones) >> 31) & ones
+    return (value & (full ^ (over*0x7FFFFFFF))) | over*255
+
+
+def _stretch_table(low, high):
+    """
+    Returns a lookup table that maps low to 0 and high to 255, linearly.
+    
+    Values below low become 0 and values above high become 255.  If high 
+    is not above low, the table does not change anything.
+    
+    Parameter low: The value to map to 0
+    Precondition: low is an int in 0..255
+    
+    Parameter high: The value to map to 255
+    Precondition: high is an int in 0..255
+    """
+    if high <= low:
+        return bytes(range(256))
+    return bytes(min(max(round((value-low)*255/(high-low)),0),255) for value in range(256))
+
+
+def _equalize_table(counts):
+    """
+    Returns a lookup table that equalizes a channel with the given histogram.
+    
+    See Filter.equalize.
+    
+    Parameter counts: The histogram of the channel
+    Precondition: counts is a list of 256 ints >= 0, not all zero
+    """
+    total = sum(counts)
+    first = next(count for count in counts if count)
+    if first == total:
+        return bytes(range(256))
+    table = bytearray(256)
+    below = 0
+    for value in range(256):
+        below += counts[value]
+        table[value] = max(round((below-first)*255/(total-first)),0)
+    return bytes(table)
@@ -4,11 +4,21 @@ The main class for our imager application.
 This modules contains a single class.  Instances of this class support an image that can 
 be modified.  This is the main class needed to display images in the viewer.
 
+An image can be made from an ordinary pixel list, or from a Pixels object (see the
+module pixels) when the pixels come straight from an image file.
+
 Based on an original file by Dexter Kozen (dck10) and Walker White (wmw2)
 
 Nick Trejo nt286
 9 November 2022
 """
+import math
+import itertools
+import collections
+from pixels import Pixels
+
+# The source of content versions.  Every change to an image gets a fresh number.
+_versions = itertools.count(1)
 
 def _is_pixel(item):
     """
@@ -40,6 +50,10 @@ def _is_pixel_list(data):
     Parameter data: The data to check
     Precondition: NONE (data can be anything)
     """
+    # A Pixels object is always a pixel list; no need to check every pixel
+    if isinstance(data, Pixels):
+        return True
+    
     try:
         for i in data:
             assert _is_pixel(i)
@@ -90,9 +104,31 @@ class Image(object):
     # Invariant: _height is an int > 0, _width*_height = len(_data)
     # height = 0 only if len(_data) = 0
     # Note that if you change width, you must change height (to satisfy the invariant)
+    #
+    # Attribute _version: The content version of this image (see getVersion)
+    # Invariant: _version is an int > 0
+    #
+    # Attribute _histogram: The remembered histograms and the version they are for
+    # Invariant: _histogram is None or a pair (version, histograms), where 
+    # histograms is a tuple of three tuples of 256 ints (see getHistogram)
     
     # PART A
     # GETTERS AND SETTERS
+    def getVersion(self):
+        """
+        Returns the content version of this image.
+        
+        The version changes every time the image is changed through one of 
+        its methods (setting pixels or changing the width or height).  Two 
+        images with the same version have the same contents, so the version 
+        can be used to remember the results of slow computations on an image.
+        A copy of an image starts with the same version as the original.
+        
+        Changes made directly to the pixel list given to the initializer are
+        NOT tracked.
+        """
+        return self._version
+    
     def getData(self):
         """
         Returns a COPY of the image data.
@@ -136,6 +172,7 @@ class Image(object):
             assert value > 0
 
         self._width = value
+        self._version = next(_versions)
     
     def getHeight(self):
         """
@@ -144,10 +181,7 @@ class Image(object):
         A value height is an int evenly dividing the number of pixels in the 
         image. Height can only be 0 if the image is empty.
         """
-        counter = 0
-        for i in self.getData():
-            counter += 1
-        return counter // self.getWidth()
+        return len(self._data) // self._width
     
     def setHeight(self,value):
         """
@@ -172,6 +206,7 @@ class Image(object):
             assert value > 0
 
         self._width = pixels // value
+        self._version = next(_versions)
     
     # INITIALIZER
     def __init__(self, data, width):
@@ -207,6 +242,8 @@ class Image(object):
         
         self._data = data
         self._width = width
+        self._version = next(_versions)
+        self._histogram = None
     
     # PART B
     # OPERATOR OVERLOADING
@@ -258,8 +295,8 @@ class Image(object):
         assert pos < len(self._data) and pos >= 0
         assert _is_pixel(pixel)
 
-        self._data.pop(pos)
-        self._data.insert(pos, pixel)
+        self._data[pos] = pixel
+        self._version = next(_versions)
     
     # PART C
     # TWO-DIMENSIONAL ACCESS METHODS
@@ -282,7 +319,7 @@ class Image(object):
         assert type(col) == int and col >= 0 and col < self.getWidth()
 
         pix = self.getWidth() * row + col
-        return self.getData()[pix]
+        return self._data[pix]
     
     def setPixel(self, row, col, pixel):
         """
@@ -304,9 +341,9 @@ class Image(object):
         assert type(col) == int and col >= 0 and col < self.getWidth()
         assert _is_pixel(pixel)
 
-        pix = pix = self.getWidth() * row + col
-        self._data.pop(pix)
-        self._data.insert(pix, pixel)
+        pix = self.getWidth() * row + col
+        self._data[pix] = pixel
+        self._version = next(_versions)
     
     # PART D
     def __str__(self):
@@ -357,6 +394,113 @@ class Image(object):
         
 
     
+    # BULK ACCESS METHODS
+    def getBytes(self, start=0, stop=None):
+        """
+        Returns the pixels from position start up to (but not including) stop as bytes.
+        
+        The bytes are the red, green and blue values of each pixel, in order, 
+        so the result has 3 bytes for every pixel.  This is much faster than 
+        reading the pixels one at a time, and it is the format expected by 
+        PIL and Kivy textures.  The result is a copy.
+        
+        Parameter start: The first pixel position
+        Precondition: start is an int with 0 <= start <= len(self)
+        
+        Parameter stop: The pixel position to stop at (None for the end)
+        Precondition: stop is None or an int with start <= stop <= len(self)
+        """
+        if stop is None:
+            stop = len(self._data)
+        assert type(start) == int and 0 <= start <= len(self._data)
+        assert type(stop) == int and start <= stop <= len(self._data)
+        
+        if isinstance(self._data, Pixels):
+            return bytes(self._data.getBuffer()[start*3:stop*3])
+        return bytes(itertools.chain.from_iterable(self._data[start:stop]))
+    
+    def setBytes(self, data, start=0):
+        """
+        Replaces pixels with the given bytes, beginning at position start.
+        
+        The bytes are the red, green and blue values of each pixel, in order.
+        This is the bulk version of __setitem__.
+        
+        Parameter data: The new red, green and blue values
+        Precondition: data is a bytes-like object whose length is a multiple of 3
+        
+        Parameter start: The first pixel position to replace
+        Precondition: start is an int >= 0 and start+len(data)//3 <= len(self)
+        """
+        assert len(data) % 3 == 0, 'data length is not a multiple of 3'
+        stop = start+len(data)//3
+        assert type(start) == int and 0 <= start and stop <= len(self._data)
+        
+        if isinstance(self._data, Pixels):
+            self._data.getBuffer()[start*3:stop*3] = data
+        else:
+            values = iter(data)
+            self._data[start:stop] = zip(values,values,values)
+        self._version = next(_versions)
+    
+    # STATISTICS
+    def getHistogram(self):
+        """
+        Returns the histograms of the red, green and blue values, as a list of three lists.
+        
+        Each histogram has 256 counts, where item v is the number of pixels
+        whose value in that color channel is v.  The histograms are computed
+        in one pass over the bytes of the image, and they are remembered 
+        until the image changes (see getVersion), so the other statistics 
+        methods are cheap once one of them has been called.  The result is 
+        a copy.
+        """
+        return [list(counts) for counts in self._getHistogram()]
+    
+    def getMean(self):
+        """
+        Returns the average red, green and blue values, as a tuple of three floats.
+        
+        This image must not be empty.
+        """
+        assert len(self._data) > 0, 'an empty image has no mean'
+        return tuple(sum(map(int.__mul__,range(256),counts))/len(self._data) 
+                     for counts in self._getHistogram())
+    
+    def getRange(self):
+        """
+        Returns the smallest and largest value in each color channel.
+        
+        The result is a tuple of three (smallest,largest) pairs, for red, 
+        green and blue.  This image must not be empty.
+        """
+        return tuple(zip(self.getPercentile(0),self.getPercentile(1)))
+    
+    def getPercentile(self, fraction):
+        """
+        Returns the given percentile of the red, green and blue values, as a tuple of three ints.
+        
+        The percentile of a channel is the smallest value v such that at 
+        least fraction of the pixels have a value <= v in that channel.  So 
+        fraction 0 gives the smallest values and fraction 1 the largest.  
+        This image must not be empty.
+        
+        Parameter fraction: The fraction of pixels at or below the percentile
+        Precondition: fraction is a number, 0 <= fraction <= 1
+        """
+        assert type(fraction) in (int,float) and 0 <= fraction <= 1, repr(fraction)+' is not a valid fraction'
+        assert len(self._data) > 0, 'an empty image has no percentiles'
+        target = max(math.ceil(fraction*len(self._data)),1)
+        result = []
+        for counts in self._getHistogram():
+            total = 0
+            for value in range(256):
+                total += counts[value]
+                if total >= target:
+                    break
+            result.append(value)
+        return tuple(result)
+    
     # ADDITIONAL METHODS (WE HAVE PROVIDED THESE FOR YOU)
     def swapPixels(self, row1, col1, row2, col2):
         """
@@ -387,6 +531,28 @@ class Image(object):
         The underlying pixel data must be copied (e.g. the copy cannot refer 
         to the same list of pixels that this object does).
         """
-        return Image(self._data[:],self._width)
+        result = Image(self._data[:],self._width)
+        result._version = self._version
+        result._histogram = self._histogram
+        return result
+    
+    # HELPER METHODS
+    def _getHistogram(self):
+        """
+        Returns the (remembered) histograms, as a tuple of three tuples of 256 ints.
+        """
+        known = self._histogram
+        if not known is None and known[0] == self._version:
+            return known[1]
+        
+        version = self._version
+        data = self.getBytes()
+        result = []
+        for channel in range(3):
+            counts = collections.Counter(data[channel::3])
+            result.append(tuple(counts[value] for value in range(256)))
+        result = tuple(result)
+        self._histogram = (version,result)
+        return result
 
 
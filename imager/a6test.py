@@ -14,6 +14,15 @@ import introcs
 import a6image
 import a6filter
 import a6encode
+import actions
+import pixels
+import imagefile
+import scanner
+import benchmark
+import profiler
+import service
+import filterworker
+import region
 import traceback
 
 # Helper to read the test images
@@ -29,28 +38,15 @@ def load_image(file):
     Precondition: file is a string
     """
     import os.path
-    from PIL import Image as CoreImage
     path = os.path.split(__file__)[0]
     path = os.path.join(path,'tests',file+'.png')
     
     try:
-        image = CoreImage.open(path)
-        image = image.convert("RGB")
-        buffer = list(image.getdata())
-        size  = image.size[0]*image.size[1]
-        width = image.size[0]
+        result = imagefile.read_image(path)
     except:
         traceback.print_exc()
         print('Could not load the file '+path)
-        buffer = None
-    
-    result = None
-    if not buffer is None:
-        try:
-            result = a6image.Image(buffer,width)
-        except:
-            traceback.print_exc()
-            result = None
+        result = None
     return result
 
 
@@ -254,6 +250,200 @@ def test_image_str():
     introcs.assert_equals(str4,str(image))
 
 
+def test_image_bytes():
+    """
+    Tests the bulk byte access methods and Pixels storage in class Image
+    """
+    print('Testing image bulk byte access')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    b = bytes([255,64,0,0,255,64,64,0,255,64,255,128,128,64,255,255,128,64])
+    
+    image = a6image.Image(p[:],2)
+    introcs.assert_equals(b,image.getBytes())
+    introcs.assert_equals(b[3:9],image.getBytes(1,3))
+    image.setBytes(bytes([1,2,3,4,5,6]),4)
+    introcs.assert_equals((1,2,3),image[4])
+    introcs.assert_equals((4,5,6),image[5])
+    
+    image = a6image.Image(pixels.Pixels(b),3)
+    introcs.assert_equals(6,len(image))
+    introcs.assert_equals(2,image.getHeight())
+    for n in range(6):
+        introcs.assert_equals(p[n],image[n])
+    introcs.assert_equals(p[4],image.getPixel(1,1))
+    image.setPixel(1,1,(7,8,9))
+    introcs.assert_equals((7,8,9),image[4])
+    introcs.assert_equals(image.getBytes(),image.copy().getBytes())
+    introcs.assert_not_equals(id(image._data),id(image.copy()._data))
+    
+    introcs.assert_error(image.setBytes,bytes([1,2]),message='setBytes does not enforce the precondition on data')
+    introcs.assert_error(image.setBytes,bytes(6),5, message='setBytes does not enforce the precondition on start')
+    introcs.assert_error(image.getBytes,0,7,        message='getBytes does not enforce the precondition on stop')
+
+
+def test_image_version():
+    """
+    Tests the content version in class Image
+    """
+    print('Testing image content version')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    
+    image = a6image.Image(p,2)
+    other = a6image.Image(p[:],2)
+    introcs.assert_not_equals(image.getVersion(),other.getVersion())
+    
+    version = image.getVersion()
+    copy = image.copy()
+    introcs.assert_equals(version,copy.getVersion())
+    image[0]
+    image.getPixel(1,1)
+    image.getBytes()
+    introcs.assert_equals(version,image.getVersion())
+    
+    versions = [version]
+    image[0] = (1,2,3)
+    versions.append(image.getVersion())
+    image.setPixel(1,1,(4,5,6))
+    versions.append(image.getVersion())
+    image.setBytes(bytes(3),2)
+    versions.append(image.getVersion())
+    image.setWidth(3)
+    versions.append(image.getVersion())
+    image.setHeight(3)
+    versions.append(image.getVersion())
+    introcs.assert_equals(len(versions),len(set(versions)))
+    introcs.assert_equals(version,copy.getVersion())
+
+
+def test_image_stats():
+    """
+    Tests the statistics methods in class Image
+    """
+    print('Testing image statistics')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    
+    for image in [a6image.Image(p[:],2),a6image.Image(pixels.Pixels(bytes(sum(p,()))),3)]:
+        histogram = image.getHistogram()
+        introcs.assert_equals(3,len(histogram))
+        introcs.assert_equals([256]*3,list(map(len,histogram)))
+        introcs.assert_equals(2,histogram[0][255])
+        introcs.assert_equals(2,histogram[0][64])
+        introcs.assert_equals(1,histogram[2][128])
+        introcs.assert_equals([6]*3,list(map(sum,histogram)))
+        
+        introcs.assert_float_lists_equal([766/6,766/6,766/6],list(image.getMean()))
+        introcs.assert_equals(((0,255),(0,255),(0,255)),image.getRange())
+        introcs.assert_equals((0,0,0),image.getPercentile(0))
+        introcs.assert_equals((64,64,64),image.getPercentile(0.5))
+        introcs.assert_equals((128,128,128),image.getPercentile(0.51))
+        introcs.assert_equals((255,255,255),image.getPercentile(1))
+        introcs.assert_error(image.getPercentile,1.5)
+        
+        # The statistics are remembered until the image changes
+        histogram[0][0] = 100
+        introcs.assert_equals(1,image.getHistogram()[0][0])
+        introcs.assert_true(image._getHistogram() is image._getHistogram())
+        copy = image.copy()
+        introcs.assert_true(copy._getHistogram() is image._getHistogram())
+        image.setPixel(0,0,(10,10,10))
+        introcs.assert_equals(((0,255),(0,255),(0,255)),copy.getRange())
+        introcs.assert_equals(((0,255),(0,255),(10,255)),image.getRange())
+        introcs.assert_equals(1,image.getHistogram()[1][10])
+        image.setBytes(bytes([200])*18)
+        introcs.assert_equals(((200,200),(200,200),(200,200)),image.getRange())
+        introcs.assert_float_lists_equal([200.0,200.0,200.0],list(image.getMean()))
+    
+    introcs.assert_error(a6image.Image([],1).getMean)
+
+
+def test_editor_buffers():
+    """
+    Tests the double-buffered edits in class Editor
+    """
+    import threading
+    print('Testing double-buffered edits')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    editor = a6filter.Filter(a6image.Image(p,2))
+    front = editor.getCurrent()
+    seen = []
+    reader = lambda : seen.append(editor.getCurrent())
+    
+    back = editor.begin()
+    introcs.assert_true(editor.isEditing())
+    introcs.assert_true(back is editor.getCurrent())
+    introcs.assert_error(editor.begin)
+    editor.invert()
+    
+    # Other threads still see the last committed image, unchanged
+    thread = threading.Thread(target=reader)
+    thread.start()
+    thread.join()
+    introcs.assert_true(seen[0] is front)
+    introcs.assert_equals((255, 64, 0),front[0])
+    introcs.assert_equals((0, 191, 255),back[0])
+    
+    editor.commit()
+    introcs.assert_false(editor.isEditing())
+    introcs.assert_true(back is editor.getCurrent())
+    introcs.assert_error(editor.commit)
+    introcs.assert_true(editor.undo())
+    introcs.assert_true(front is editor.getCurrent())
+    
+    # An aborted edit leaves the history alone
+    editor.begin()
+    editor.invert()
+    editor.abort()
+    introcs.assert_true(front is editor.getCurrent())
+    introcs.assert_false(editor.undo())
+    
+    # Committed edits are limited to MAX_HISTORY, like increment
+    for pos in range(editor.MAX_HISTORY+5):
+        editor.begin()
+        editor.commit()
+    introcs.assert_equals(editor.MAX_HISTORY,len(editor._history))
+
+
+def test_editor_regions():
+    """
+    Tests the edits committed with a region in class Editor
+    """
+    print('Testing region edits')
+    image = benchmark.make_image(20,7)
+    editor = a6filter.Filter(image)
+    front = editor.getCurrent().getBytes()
+    part = region.Region(20,20,rect=(5,5,4,6))
+    
+    editor.begin()
+    editor.applyRegion(part,'invert')
+    editor.commit(part)
+    current = editor.getCurrent()
+    introcs.assert_equals(a6image.Image,type(editor._history[-1]))
+    introcs.assert_equals(24,len(editor._history[0][1]))
+    introcs.assert_equals(tuple(255-x for x in image.getPixel(5,5)),current.getPixel(5,5))
+    introcs.assert_equals(image.getPixel(4,5),current.getPixel(4,5))
+    introcs.assert_equals(front[:3*105],current.getBytes(0,105))
+    
+    # Full edits and region edits undo in order
+    editor.begin()
+    editor.invert()
+    editor.commit()
+    editor.begin()
+    editor.applyRegion(part,'monochromify',False)
+    editor.commit(part)
+    introcs.assert_true(editor.undo())
+    introcs.assert_true(editor.undo())
+    introcs.assert_equals(current.getBytes(),editor.getCurrent().getBytes())
+    introcs.assert_true(editor.undo())
+    introcs.assert_equals(front,editor.getCurrent().getBytes())
+    introcs.assert_false(editor.undo())
+    
+    # The region must fit, and its shape cannot change
+    editor.begin()
+    introcs.assert_error(editor.applyRegion,part,'rotateRight',error=ValueError)
+    introcs.assert_error(editor.commit,region.Region(10,10,rect=(0,0,5,5)))
+    editor.abort()
+
+
 ## All of these tests hava a familiar form
 
 def compare_images(image1,image2,file1,file2):
@@ -264,6 +454,11 @@ def compare_images(image1,image2,file1,file2):
     produces an error and quits python.  We provide the file names to give
     use proper error messages
     
+    The images are compared as byte buffers, so a match costs one buffer
+    comparison no matter how large the images are.  Only a mismatch is 
+    examined further (see diff_images), to report the first pixel that is
+    different, how many pixels are different, and by how much.
+    
     Parameter image1: The first image to compare
     Precondition: image1 is an Image object
     
@@ -283,11 +478,120 @@ def compare_images(image1,image2,file1,file2):
     introcs.assert_equals(image2.getHeight(),image1.getHeight(),
                           file1+' and '+file2+' do not have the same height')
     
-    for col in range(image2.getWidth()):
-        for row in range(image2.getHeight()):
-            introcs.assert_equals(image2.getPixel(row,col),image1.getPixel(row,col),
-                                  'Pixel mismatch between '+file1+' and '+file2+
-                                  ' at ('+str(col)+','+str(row)+')')
+    data1 = image1.getBytes()
+    data2 = image2.getBytes()
+    if data1 == data2:
+        return
+    
+    first, count, error = diff_images(data1,data2)
+    row, col = divmod(first,image2.getWidth())
+    introcs.assert_equals(image2[first],image1[first],
+                          'Pixel mismatch between '+file1+' and '+file2+
+                          ' at ('+str(col)+','+str(row)+'): expected '+str(image2[first])+
+                          ' but instead got '+str(image1[first])+'; '+str(count)+
+                          ' pixels differ, with a max channel error of '+str(error))
+
+
+def diff_images(data1,data2):
+    """
+    Returns the tuple (first, count, error) describing how two pixel buffers differ.
+    
+    The value first is the position of the first pixel that is different (or
+    -1 if none are), count is the number of pixels that are different, and 
+    error is the largest difference between two color channels.  These are
+    computed a whole buffer at a time (using Python's big integers and C-level
+    iteration) rather than pixel by pixel.
+    
+    Parameter data1: The red, green and blue values of the first image
+    Precondition: data1 is a bytes-like object whose length is a multiple of 3
+    
+    Parameter data2: The red, green and blue values of the second image
+    Precondition: data2 is a bytes-like object the same length as data1
+    """
+    import operator
+    assert len(data1) == len(data2), 'the buffers do not have the same length'
+    size = len(data1)
+    
+    # Each byte of the XOR is nonzero exactly where the channels differ
+    xor = int.from_bytes(data1,'big') ^ int.from_bytes(data2,'big')
+    if xor == 0:
+        return (-1,0,0)
+    xor = xor.to_bytes(size,'big')
+    first = (size-len(xor.lstrip(b'\0')))//3
+    
+    # A pixel differs if any of its three channels do
+    pixels = size//3
+    mask = 0
+    for channel in range(3):
+        mask |= int.from_bytes(xor[channel::3],'big')
+    count = pixels-mask.to_bytes(pixels,'big').count(0)
+    
+    error = max(map(abs,map(operator.sub,data1,data2)))
+    return (first,count,error)
+
+
+def test_diff_images():
+    """
+    Tests the helper diff_images, used to explain failed image comparisons
+    """
+    print('Testing image comparison')
+    data1 = bytes(range(30))
+    introcs.assert_equals((-1,0,0),diff_images(data1,bytes(data1)))
+    
+    data2 = bytearray(data1)
+    data2[7] += 5
+    data2[8] -= 3
+    data2[29] = 0
+    introcs.assert_equals((2,2,29),diff_images(data1,data2))
+    introcs.assert_equals((2,2,29),diff_images(data2,data1))
+    
+    data2 = bytes(255-x for x in data1)
+    introcs.assert_equals((0,10,255),diff_images(data1,data2))
+
+
+def run_parallel(tests):
+    """
+    Runs the given test functions in parallel, printing their output in order.
+    
+    Each test runs in its own process, with its output captured, so the output
+    of different tests is never mixed together.  If a test fails, this function 
+    prints its output (including the error) and quits python, just like a 
+    failed assert.
+    
+    Parameter tests: The names of the test functions in this module
+    Precondition: tests is a list of strings
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(len(tests)) as executor:
+        for output, failed in executor.map(_run_captured,tests):
+            print(output,end='')
+            if failed:
+                raise SystemExit()
+
+
+def _run_captured(test):
+    """
+    Returns the pair (output, failed) from running a test function.
+    
+    The value output is everything the test printed, and failed is True if the
+    test failed (either a failed assert or an unexpected error).
+    
+    Parameter test: The name of the test function in this module
+    Precondition: test is a string
+    """
+    import io
+    import contextlib
+    buffer = io.StringIO()
+    failed = False
+    with contextlib.redirect_stdout(buffer):
+        try:
+            globals()[test]()
+        except SystemExit:
+            failed = True
+        except Exception:
+            traceback.print_exc(file=buffer)
+            failed = True
+    return (buffer.getvalue(),failed)
 
 
 def test_reflect_vert():
@@ -410,6 +714,143 @@ def test_vignette():
     compare_images(editor.getCurrent(),image2,file1,file2)
 
 
+def test_kernel():
+    """
+    Tests the class Kernel in module a6filter
+    """
+    print('Testing class Kernel')
+    kernel = a6filter.Kernel([[1,2,1],[2,4,2],[1,2,1]])
+    introcs.assert_equals(4,kernel.getShift())
+    introcs.assert_equals((3,3),kernel.getSize())
+    introcs.assert_equals([([1,2,1],[1,2,1])],kernel.getTerms())
+    introcs.assert_true(kernel.isSeparable())
+
+    # The terms always add up to the weights
+    cases = [(a6filter.Kernel.gaussian(7),1),(a6filter.Kernel.sharpen(1.5,2),2),
+             (a6filter.Kernel.laplacian(),2),(a6filter.Kernel([[1,2,0],[0,1,3],[2,0,-1]],3),3),
+             (a6filter.Kernel([[0,0,0],[0,0,0],[0,0,0]],0),0),(a6filter.Kernel([[1,2,1]]),1)]
+    for kernel, count in cases:
+        introcs.assert_equals(count,len(kernel.getTerms()))
+        width, height = kernel.getSize()
+        total = [[0]*width for row in range(height)]
+        for column, line in kernel.getTerms():
+            for row in range(height):
+                for col in range(width):
+                    total[row][col] += column[row]*line[col]
+        introcs.assert_equals(kernel.getWeights(),total)
+    introcs.assert_equals((15,15),cases[0][0].getSize())
+    introcs.assert_equals(1 << 20,sum(map(sum,cases[0][0].getWeights())))
+
+    introcs.assert_error(a6filter.Kernel,[[1,1],[1,1]])
+    introcs.assert_error(a6filter.Kernel,[[1,1,1]])
+    introcs.assert_error(a6filter.Kernel,[[1,1.5,1]],1)
+    introcs.assert_error(a6filter.Kernel,[[1 << 22,1 << 22,1]],0)
+
+
+def test_convolve():
+    """
+    Tests the method convolve (and the filters that use it) in class Filter
+    """
+    print('Testing method convolve')
+    import random
+    def expected(data, width, kernel, border):
+        # Compute every channel directly from the weights
+        height = len(data)//(3*width)
+        weights = kernel.getWeights()
+        shift = kernel.getShift()
+        down, across = len(weights)//2, len(weights[0])//2
+        result = bytearray(len(data))
+        for pos in range(len(data)):
+            row, col = divmod(pos//3,width)
+            total = 0
+            for i in range(len(weights)):
+                for j in range(len(weights[0])):
+                    y = a6filter._border_index(row+i-down,height,border)
+                    x = a6filter._border_index(col+j-across,width,border)
+                    if not y is None and not x is None:
+                        total += weights[i][j]*data[3*(y*width+x)+pos % 3]
+            result[pos] = min(max((total+((1 << shift) >> 1)) >> shift,0),255)
+        return bytes(result)
+
+    rng = random.Random(7)
+    kernels = [a6filter.Kernel.gaussian(1),a6filter.Kernel.gaussian(3),a6filter.Kernel.laplacian(),
+               a6filter.Kernel.sharpen(4,2),a6filter.Kernel([[1,2,0],[0,1,3],[2,0,-1]],3)]
+    tile = a6filter._TILE
+    try:
+        for width, height in [(7,5),(1,1),(3,9),(10,1)]:
+            data = rng.randbytes(3*width*height)
+            for kernel in kernels:
+                for border in a6filter.BORDERS:
+                    # Small tiles force several bands
+                    for a6filter._TILE in (tile,8):
+                        editor = a6filter.Filter(a6image.Image(pixels.Pixels(data),width))
+                        editor.convolve(kernel,border)
+                        introcs.assert_equals(expected(data,width,kernel,border),
+                                              editor.getCurrent().getBytes())
+    finally:
+        a6filter._TILE = tile
+
+    # Flat images stay flat, and have no edges
+    editor = a6filter.Filter(a6image.Image(pixels.Pixels(bytes([40,90,200])*300),20))
+    editor.blur(4)
+    introcs.assert_equals(bytes([40,90,200])*300,editor.getCurrent().getBytes())
+    editor.sharpen(2.0)
+    introcs.assert_equals(bytes([40,90,200])*300,editor.getCurrent().getBytes())
+    editor.edges()
+    introcs.assert_equals(bytes(900),editor.getCurrent().getBytes())
+
+    # The filters run on a region too
+    before = rng.randbytes(3*64)
+    editor = a6filter.Filter(a6image.Image(pixels.Pixels(before),8))
+    editor.applyRegion(region.Region(8,8,(2,2,4,4)),'blur',1)
+    after = editor.getCurrent().getBytes()
+    introcs.assert_equals(before[:3*18],after[:3*18])
+    introcs.assert_not_equals(before[3*18:3*22],after[3*18:3*22])
+    introcs.assert_error(editor.convolve,[[1]])
+    introcs.assert_error(editor.convolve,a6filter.Kernel.laplacian(),'mirror')
+
+
+def test_levels():
+    """
+    Tests the methods autoLevels and equalize in class Filter
+    """
+    print('Testing methods autoLevels and equalize')
+    # Red spans 50..150, green is flat, blue has one stray value
+    data = b''.join(bytes([50+value,90,100+value//10]) for value in range(101))
+    data += bytes([100,90,255])
+    editor = a6filter.Filter(a6image.Image(pixels.Pixels(data),6))
+    editor.autoLevels(0)
+    current = editor.getCurrent()
+    introcs.assert_equals(((0,255),(90,90),(0,255)),current.getRange())
+    introcs.assert_equals((0,90,0),current.getPixel(0,0))
+    introcs.assert_equals((128,90,8),current[50])
+    introcs.assert_equals((255,90,16),current[100])
+    
+    # Clipping ignores the stray value
+    editor = a6filter.Filter(a6image.Image(pixels.Pixels(data),6))
+    editor.autoLevels(0.01)
+    current = editor.getCurrent()
+    introcs.assert_equals((255,90,255),current[100])
+    introcs.assert_equals((128,90,255),current[101])
+    introcs.assert_error(editor.autoLevels,0.5)
+    
+    # Equalizing spreads the values evenly
+    data = bytes([10,10,10])*50+bytes([20,20,30])*25+bytes([30,20,200])*25
+    editor = a6filter.Filter(a6image.Image(pixels.Pixels(data),10))
+    editor.equalize()
+    current = editor.getCurrent()
+    introcs.assert_equals(((0,255),(0,255),(0,255)),current.getRange())
+    introcs.assert_equals((0,0,0),current[0])
+    introcs.assert_equals((128,255,128),current[50])
+    introcs.assert_equals((255,255,255),current[99])
+    
+    # A flat image does not change
+    editor = a6filter.Filter(a6image.Image(pixels.Pixels(bytes([7,8,9])*4),2))
+    editor.equalize()
+    editor.autoLevels()
+    introcs.assert_equals(bytes([7,8,9])*4,editor.getCurrent().getBytes())
+
+
 def test_encode():
     """
     Tests the method encode in class Encoder
@@ -485,6 +926,986 @@ def test_decode():
     encoder.transpose()
     result = encoder.decode()
     introcs.assert_equals(None,result)
+    
+    # Decoding is remembered until the image changes
+    encoder.undo()
+    encoder.increment()
+    encoder.encode('Hello World')
+    calls = []
+    encoder._decode_message = lambda : calls.append(1) or ('valid','Hello World')
+    introcs.assert_equals('Hello World',encoder.decode())
+    introcs.assert_equals('Hello World',encoder.decode())
+    introcs.assert_equals(1,len(calls))
+    encoder.increment()
+    introcs.assert_equals('Hello World',encoder.decode())
+    introcs.assert_equals(1,len(calls))
+    encoder.getCurrent()[100] = (0,0,0)
+    introcs.assert_equals('Hello World',encoder.decode())
+    introcs.assert_equals(2,len(calls))
+    encoder.undo()
+    introcs.assert_equals('Hello World',encoder.decode())
+    introcs.assert_equals(2,len(calls))
+
+
+def test_png_writer():
+    """
+    Tests that PngWriter saves a snapshot that imagefile.read_image can read back
+    """
+    print('Testing class PngWriter')
+    import os.path
+    import shutil
+    import tempfile
+    
+    image = load_image('blocks')
+    expect = image.getBytes()
+    folder = tempfile.mkdtemp()
+    try:
+        writer = imagefile.PngWriter(imagefile.PngWriter.FAST)
+        results = []
+        
+        file = os.path.join(folder,'blocks.png')
+        writer.save(image,file,lambda name, error: results.append((name,error)))
+        image[0] = (0,0,0) if image[0] != (0,0,0) else (255,255,255)   # Edit after snapshot
+        writer.wait()
+        introcs.assert_equals([(file,None)],results)
+        
+        copy = imagefile.read_image(file)
+        introcs.assert_equals(image.getWidth(),copy.getWidth())
+        introcs.assert_equals(expect,copy.getBytes())
+        
+        file = os.path.join(folder,'missing','blocks.png')
+        writer.save(image,file,lambda name, error: results.append((name,error)),imagefile.PngWriter.SMALL)
+        writer.wait()
+        introcs.assert_equals(file,results[-1][0])
+        introcs.assert_true(isinstance(results[-1][1],OSError))
+        
+        small = imagefile.read_image(os.path.join(folder,'blocks.png'),(8,8))
+        introcs.assert_true(small.getWidth() <= 8 and small.getHeight() <= 8)
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_image_cache():
+    """
+    Tests the least-recently-used behavior of class ImageCache
+    """
+    print('Testing class ImageCache')
+    import os.path
+    path = os.path.join(os.path.split(__file__)[0],'tests')
+    blocks = os.path.join(path,'blocks.png')
+    home   = os.path.join(path,'home.png')
+    
+    expect = load_image('blocks')
+    cache = imagefile.ImageCache()
+    image1 = cache.read(blocks)
+    introcs.assert_equals(1,len(cache))
+    introcs.assert_equals(len(expect)*3,cache.getUsage())
+    compare_images(image1,expect,'blocks','cached blocks')
+    
+    image1[0] = (0,0,0) if image1[0] != (0,0,0) else (255,255,255)
+    image2 = cache.read(blocks)
+    introcs.assert_equals(1,len(cache))
+    introcs.assert_not_equals(id(image1),id(image2))
+    compare_images(image2,expect,'blocks','cached blocks')
+    
+    # Only room for one of the two files
+    cache = imagefile.ImageCache(len(expect)*3)
+    cache.read(blocks)
+    cache.read(home)
+    introcs.assert_true(len(cache) <= 1)
+    introcs.assert_true(cache.getUsage() <= cache.capacity)
+    cache.clear()
+    introcs.assert_equals(0,len(cache))
+    introcs.assert_equals(0,cache.getUsage())
+
+
+def test_read_rows():
+    """
+    Tests that imagefile.read_rows matches the top of imagefile.read_image
+    """
+    print('Testing function read_rows')
+    import os.path
+    path = os.path.join(os.path.split(__file__)[0],'tests')
+    for name in ['blocks.png','home.png','blocks-grey.png']:
+        file  = os.path.join(path,name)
+        image = imagefile.read_image(file)
+        width = image.getWidth()
+        for rows in [1,3,image.getHeight(),image.getHeight()+10]:
+            top = imagefile.read_rows(file,rows)
+            introcs.assert_equals(width,top.getWidth())
+            introcs.assert_equals(min(rows,image.getHeight()),top.getHeight())
+            introcs.assert_equals(image.getBytes(0,len(top)),top.getBytes())
+    
+    # If stopping early fails, the whole file is read instead
+    def broken(image, rows):
+        raise AttributeError('tile')
+    fast = imagefile._read_top
+    try:
+        imagefile._read_top = broken
+        top = imagefile.read_rows(file,3)
+    finally:
+        imagefile._read_top = fast
+    introcs.assert_equals(image.getBytes(0,3*width),top.getBytes())
+
+
+def test_scanner():
+    """
+    Tests the parallel scan of a folder in module scanner
+    """
+    print('Testing module scanner')
+    import io
+    import os
+    import json
+    import random
+    import shutil
+    import tempfile
+    random.seed(3110)
+    
+    folder = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(folder,'sub'))
+        expect = {}
+        for n in range(12):
+            image = a6image.Image(pixels.Pixels(random.randbytes(3*4000)),80)
+            encoder = a6encode.Encoder(image)
+            file = os.path.join(folder,'sub' if n % 2 else '','image'+str(n)+'.png')
+            if n % 4 == 0:
+                encoder.encode('Message '+str(n),4)
+                expect[file] = ('valid','Message '+str(n))
+            elif n == 3:
+                encoder.encode('Old message')
+                expect[file] = ('unchecked','Old message')
+            elif n == 5:
+                encoder.encode('Broken message',0)
+                encoder.getCurrent()[20] = (9,9,9)
+                expect[file] = ('corrupt',None)
+            imagefile.write_png(encoder.getCurrent(),file,1)
+        
+        with open(os.path.join(folder,'notes.txt'),'w') as file:
+            file.write('Not an image')
+        bad = os.path.join(folder,'bad.png')
+        with open(bad,'w') as file:
+            file.write('Not an image')
+        
+        introcs.assert_equals(13,len(list(scanner.find_images([folder]))))
+        introcs.assert_equals(None,scanner.scan_file(os.path.join(folder,'image2.png')))
+        
+        output = io.StringIO()
+        introcs.assert_equals((13,len(expect)+1),scanner.scan([folder],output,2))
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        for result in results:
+            if result['file'] == bad:
+                introcs.assert_equals('error',result['status'])
+            else:
+                introcs.assert_equals(expect[result['file']],(result['status'],result.get('message')))
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_action_queue():
+    """
+    Tests the coalescing in class ActionQueue
+    """
+    print('Testing class ActionQueue')
+    queue = actions.ActionQueue()
+    introcs.assert_true(queue.push('invert'))
+    introcs.assert_false(queue.push('vignette'))
+    introcs.assert_true(queue.isBusy())
+    introcs.assert_equals([('invert',),('vignette',)],queue.getPending())
+    
+    queue.push('invert')
+    queue.push('invert')
+    introcs.assert_equals([('invert',),('vignette',)],queue.getPending())
+    
+    queue.push('monochromify',True)
+    queue.push('monochromify',True)
+    introcs.assert_equals(4,len(queue))
+    
+    queue.clear()
+    for n in range(4):
+        queue.push('rotateRight')
+    introcs.assert_equals([],queue.getPending())
+    
+    for n in range(3):
+        queue.push('rotateRight')
+    introcs.assert_equals([('rotateLeft',)],queue.getPending())
+    queue.push('rotateRight')
+    introcs.assert_equals([],queue.getPending())
+    
+    queue.push('rotateLeft')
+    queue.push('rotateLeft')
+    introcs.assert_equals([('rotateRight',),('rotateRight',)],queue.getPending())
+    
+    queue.clear()
+    queue.push('transpose')
+    introcs.assert_equals(('transpose',),queue.pop())
+    introcs.assert_true(queue.isBusy())
+    introcs.assert_equals(None,queue.pop())
+    introcs.assert_true(queue.isBusy())
+    introcs.assert_false(queue.finish())
+    introcs.assert_false(queue.isBusy())
+    introcs.assert_true(queue.push('transpose'))
+    
+    # An action pushed while the worker is finishing goes to a new worker
+    introcs.assert_equals(('transpose',),queue.pop())
+    introcs.assert_equals(None,queue.pop())
+    introcs.assert_false(queue.push('invert'))
+    introcs.assert_true(queue.isBusy())
+    introcs.assert_true(queue.finish())
+    introcs.assert_true(queue.isBusy())
+    introcs.assert_false(queue.push('vignette'))
+    introcs.assert_equals(('invert',),queue.pop())
+    introcs.assert_equals(('vignette',),queue.pop())
+    introcs.assert_equals(None,queue.pop())
+    introcs.assert_false(queue.finish())
+    introcs.assert_true(queue.push('transpose'))
+    
+    introcs.assert_error(queue.push,message='push does not enforce the precondition on action')
+    
+    # Actions on different regions never coalesce
+    queue.clear()
+    part1 = region.Region(10,10,rect=(0,0,4,4))
+    part2 = region.Region(10,10,rect=(2,2,4,4))
+    queue.push('invert',part1)
+    queue.push('invert',part2)
+    queue.push('rotateRight',part1)
+    queue.push('rotateRight',part2)
+    queue.push('rotateRight',part2)
+    queue.push('rotateRight',part2)
+    introcs.assert_equals(('rotateLeft',part2),queue.getPending()[-1])
+    queue.push('rotateRight',part2)
+    introcs.assert_equals([('invert',part1),('invert',part2),('rotateRight',part1)],queue.getPending())
+    queue.push('rotateRight',part1)
+    introcs.assert_equals(('rotateRight',part1),queue.getPending()[-1])
+    queue.push('invert',region.Region(10,10,rect=(2,2,4,4)))
+    queue.push('invert',part2)
+    introcs.assert_equals(4,len(queue))
+
+
+def test_encode_bulk():
+    """
+    Tests the bulk encode/decode helpers in class Encoder on arbitrary pixels
+    """
+    print('Testing bulk encode and decode')
+    import random
+    random.seed(1110)
+    
+    # Every channel value, including the ones near 255
+    data = bytes(random.randrange(256) for n in range(3*3000))
+    data = bytes(range(256))*3 + data
+    image = a6image.Image(pixels.Pixels(data),1)
+    encoder = a6encode.Encoder(image)
+    
+    payload = bytes(range(256))*10
+    encoder._encode_bytes(payload,7)
+    introcs.assert_equals(payload,encoder._decode_bytes(7,len(payload)))
+    for pos in range(len(payload)):
+        introcs.assert_equals(payload[pos],encoder._decode_pixel(pos+7))
+    
+    # Pixels that hold a number over 255
+    encoder.getCurrent()[7] = (3,0,0)
+    introcs.assert_error(encoder._decode_bytes,7,1,error=ValueError)
+    encoder.getCurrent()[7] = (2,5,6)
+    introcs.assert_error(encoder._decode_bytes,7,1,error=ValueError)
+    encoder.getCurrent()[7] = (2,5,5)
+    introcs.assert_equals(bytes([255]),encoder._decode_bytes(7,1))
+    
+    for trial in range(20):
+        encoder.increment()
+        text = ''.join(random.choice('ab c\n😊é') for n in range(random.randrange(500)))
+        introcs.assert_true(encoder.encode(text))
+        introcs.assert_equals(text,encoder.decode())
+        encoder.undo()
+    
+    text = 'x'*(len(encoder.getCurrent())-6)
+    introcs.assert_false(encoder.encode(text))
+    introcs.assert_true(encoder.encode(text[1:]))
+    introcs.assert_equals(text[1:],encoder.decode())
+
+
+def test_encode_packed():
+    """
+    Tests the packed (bit plane) format of encode and decode in class Encoder
+    """
+    print('Testing packed encode and decode')
+    import random
+    random.seed(2110)
+    
+    data = bytes(range(256))*3 + bytes(random.randrange(256) for n in range(3*2000))
+    image = a6image.Image(pixels.Pixels(data),1)
+    encoder = a6encode.Encoder(image)
+    
+    payload = bytes(range(256))*2
+    for bits in [1,2,4]:
+        encoder.increment()
+        encoder._pack_bits(payload,8,bits)
+        introcs.assert_equals(payload,encoder._unpack_bits(8,len(payload),bits))
+        
+        # Only the lowest bits change
+        count = encoder._packed_pixels(len(payload),bits)
+        before = encoder.getOriginal().getBytes(8,8+count)
+        after  = encoder.getCurrent().getBytes(8,8+count)
+        for pos in range(len(before)):
+            introcs.assert_equals(before[pos] >> bits,after[pos] >> bits)
+        encoder.undo()
+    
+    for bits in [1,2,4]:
+        for trial in range(10):
+            encoder.increment()
+            text = ''.join(random.choice('ab c\n😊é') for n in range(random.randrange(300)))
+            introcs.assert_true(encoder.encode(text,bits))
+            introcs.assert_true(encoder._check_for_indicator(True))
+            introcs.assert_false(encoder._check_for_indicator())
+            introcs.assert_equals(text,encoder.decode())
+            encoder.undo()
+    
+    # 4 bits per channel holds 1.5 bytes per pixel (after a 15 pixel header)
+    size = len(encoder.getCurrent())
+    text = 'x'*((size-15)*3//2)
+    encoder.increment()
+    introcs.assert_false(encoder.encode(text,2))
+    introcs.assert_false(encoder.encode(text+'x',4))
+    introcs.assert_true(encoder.encode(text,4))
+    introcs.assert_equals(text,encoder.decode())
+    introcs.assert_error(encoder.encode,text,3,message='encode does not enforce the precondition on bits')
+
+
+def test_encode_extended():
+    """
+    Tests the extended header (with a variable-length size) in class Encoder
+    """
+    print('Testing extended header')
+    import random
+    import zlib
+    random.seed(3110)
+    
+    for value in [0,1,127,128,300,16383,16384,999999,1000000,2**34]:
+        data = a6encode._varint(value)
+        image = a6image.Image(pixels.Pixels(bytes(3*20)),1)
+        encoder = a6encode.Encoder(image)
+        encoder._encode_bytes(data,7)
+        introcs.assert_equals((value,7+len(data)),encoder._read_varint(7))
+    
+    # Larger than the original format allows
+    size = 1000500
+    image = a6image.Image(pixels.Pixels(random.randbytes(3*size)),size//100)
+    encoder = a6encode.Encoder(image)
+    text = 'abcdefghij'*100001
+    introcs.assert_false(encoder.encode(text))
+    for bits in [0,4]:
+        encoder.increment()
+        introcs.assert_true(encoder.encode(text,bits))
+        checksum = zlib.crc32(text.encode('utf-8'))
+        introcs.assert_equals((bits,0,checksum,len(text),16),encoder._read_header())
+        introcs.assert_equals(text,encoder.decode())
+        encoder.undo()
+    
+    encoder.increment()
+    introcs.assert_false(encoder.encode(text+'x'*500,0))
+    introcs.assert_false(encoder.encode(text,2))
+    
+    # Only the current version of the extended header is read
+    encoder._indicate_encode(True)
+    encoder._encode_bytes(bytes([2 << 4 | 0, 0])+a6encode._varint(11),5)
+    encoder._encode_bytes('Hello World'.encode('utf-8'),8)
+    introcs.assert_equals(None,encoder.decode())
+    introcs.assert_equals(a6encode.Encoder.NONE,encoder.getStatus())
+
+
+def test_encode_compressed():
+    """
+    Tests the compressed payloads in class Encoder
+    """
+    print('Testing compressed messages')
+    import random
+    import zlib
+    random.seed(3110)
+    
+    size = 10000
+    image = a6image.Image(pixels.Pixels(random.randbytes(3*size)),100)
+    encoder = a6encode.Encoder(image)
+    text = 'The quick brown fox jumps over the lazy dög. '*1000
+    introcs.assert_false(encoder.encode(text,0))
+    for method in ['zlib','lzma']:
+        for bits in [None,0,4]:
+            encoder.increment()
+            introcs.assert_true(encoder.encode(text,bits,method))
+            header = encoder._read_header()
+            introcs.assert_equals(a6encode._COMPRESSION[method],header[1])
+            introcs.assert_true(header[3] < len(text)//10)
+            introcs.assert_equals(text,encoder.decode())
+            encoder.undo()
+    
+    # Short messages are stored as is
+    encoder.increment()
+    introcs.assert_true(encoder.encode('Hi',None,'zlib'))
+    introcs.assert_equals((0,0,zlib.crc32(b'Hi'),2,14),encoder._read_header())
+    introcs.assert_equals('Hi',encoder.decode())
+    
+    # Unknown flags or corrupt data are not messages
+    encoder._encode_bytes(bytes([7]),8)
+    introcs.assert_equals(None,encoder.decode())
+    encoder.undo()
+    encoder.increment()
+    introcs.assert_true(encoder.encode(text,0,'zlib'))
+    encoder._encode_bytes(b'garbage',encoder._read_header()[4])
+    introcs.assert_equals(None,encoder.decode())
+
+
+def test_encode_checksum():
+    """
+    Tests the magic value and checksum of the extended header in class Encoder
+    """
+    print('Testing checksummed header')
+    import io
+    import random
+    random.seed(3110)
+    
+    size = 10000
+    image = a6image.Image(pixels.Pixels(random.randbytes(3*size)),100)
+    encoder = a6encode.Encoder(image)
+    introcs.assert_equals(encoder.NONE,encoder.getStatus())
+    
+    text = 'Hello World! '*100
+    for bits in [0,1,4]:
+        encoder.increment()
+        introcs.assert_true(encoder.encode(text,bits))
+        introcs.assert_equals(encoder.VALID,encoder.getStatus())
+        introcs.assert_equals(text,encoder.decode())
+        
+        # Damage one byte of the message
+        pos = encoder._read_header()[4]
+        encoder.getCurrent()[pos+20] = (9,9,9) if bits == 0 else (0,0,0)
+        introcs.assert_equals(encoder.CORRUPT,encoder.getStatus())
+        introcs.assert_equals(None,encoder.decode())
+        output = io.BytesIO()
+        introcs.assert_error(encoder.decode_stream,output,error=ValueError)
+        introcs.assert_equals(b'',output.getvalue())
+        encoder.undo()
+    
+    # A length past the end of the image is corrupt
+    encoder.increment()
+    encoder.encode(text,0)
+    encoder._encode_bytes(a6encode._varint(size,2),13)
+    introcs.assert_equals(encoder.CORRUPT,encoder.getStatus())
+    encoder.undo()
+    
+    # A photo that matches the indicator by accident has no magic value
+    encoder.increment()
+    encoder._indicate_encode(True)
+    encoder._encode_bytes(bytes([encoder.FORMAT << 4, 0, 0]),5)
+    introcs.assert_equals(encoder.NONE,encoder.getStatus())
+    introcs.assert_equals(None,encoder.decode_stream(io.BytesIO()))
+    encoder.undo()
+    
+    # The original format has no checksum
+    encoder.increment()
+    encoder.encode('Hello World')
+    introcs.assert_equals(encoder.UNCHECKED,encoder.getStatus())
+    introcs.assert_equals('Hello World',encoder.decode())
+
+
+def test_encode_rewrite():
+    """
+    Tests that encode only rewrites the changed pixels of an existing message
+    """
+    print('Testing incremental encode')
+    import random
+    random.seed(3110)
+    
+    size = 30000
+    image = a6image.Image(pixels.Pixels(random.randbytes(3*size)),100)
+    text = ''.join(random.choice('abcdef gh\n') for n in range(15000))
+    edits = [text[:5000]+'Z'+text[5001:], text[:5000]+'é'+text[5001:], text+'More text', 
+             text[:-100], 'Short']
+    
+    for bits in [None,0,2,4]:
+        for edit in edits:
+            encoder = a6encode.Encoder(image)
+            introcs.assert_true(encoder.encode(text,bits))
+            before = encoder.getCurrent().getBytes()
+            introcs.assert_true(encoder.encode(edit,bits))
+            introcs.assert_equals(edit,encoder.decode())
+            
+            after = encoder.getCurrent().getBytes()
+            changed = sum(before[pos:pos+3] != after[pos:pos+3] for pos in range(0,3*size,3))
+            if edit == edits[0]:
+                introcs.assert_true(changed <= 12)
+            elif edit == edits[2]:
+                introcs.assert_true(changed <= 30)
+    
+    # Only the differing bytes are found
+    introcs.assert_equals([],a6encode._changed_ranges(b'abcdef',b'abcdef'))
+    introcs.assert_equals([(2,6)],a6encode._changed_ranges(b'abcdef',b'abXdeY'))
+    introcs.assert_equals([(0,6)],a6encode._changed_ranges(b'abcdef',b'abXdeY',3))
+    introcs.assert_equals([(6,8)],a6encode._changed_ranges(b'abcdef',b'abcdefgh'))
+    old = bytes(5000)
+    new = bytearray(old)
+    new[2047] = 1
+    new[2048] = 1
+    new[4000] = 1
+    introcs.assert_equals([(2047,2049),(4000,4001)],a6encode._changed_ranges(old,new))
+
+
+def test_encode_shards():
+    """
+    Tests the functions encode_shards and decode_shards in module a6encode
+    """
+    print('Testing sharded messages')
+    import random
+    random.seed(3110)
+    
+    sizes  = [6000,3000,9000,1500]
+    images = [a6image.Image(pixels.Pixels(random.randbytes(3*size)),50) for size in sizes]
+    before = [image.getBytes() for image in images]
+    text = ''.join(random.choice('abcdefgh é😊\n') for n in range(12000))
+    introcs.assert_equals(None,a6encode.encode_shards(images[:1],text))
+    
+    # Every carrier must have room for its shard header
+    tiny = [benchmark.make_image(64),benchmark.make_image(3)]
+    introcs.assert_equals(0,a6encode.shard_capacity(tiny[1]))
+    introcs.assert_equals(None,a6encode.encode_shards(tiny,'hello',0,workers=1))
+    introcs.assert_equals(None,a6encode.encode_shards(tiny[1:],'',0,workers=1))
+    job = (tiny[1].getBytes(),3,b'',(0,0,1),0,0)
+    introcs.assert_equals(None,a6encode._encode_shard(job))
+    tiny[1] = benchmark.make_image(6)
+    shards = a6encode.encode_shards(tiny,'hello',0,workers=1)
+    introcs.assert_equals('hello',a6encode.decode_shards(shards,1))
+    
+    for bits in [0,4]:
+        for compress in [None,'lzma']:
+            shards = a6encode.encode_shards(images,text,bits,compress,1)
+            introcs.assert_equals(len(images),len(shards))
+            for pos in range(len(shards)):
+                introcs.assert_equals(before[pos],images[pos].getBytes())
+                encoder = a6encode.Encoder(shards[pos])
+                introcs.assert_equals(encoder.SHARD,encoder.getStatus())
+                introcs.assert_equals(None,encoder.decode())
+                introcs.assert_equals(pos,encoder.decode_shard()[0][1])
+            
+            introcs.assert_equals(text,a6encode.decode_shards(shards,1))
+            introcs.assert_equals(text,a6encode.decode_shards(shards[::-1]+images,1))
+            introcs.assert_equals(None,a6encode.decode_shards(shards[1:],1))
+    
+    # The shards are shared out by capacity
+    shards = a6encode.encode_shards(images,text,0)
+    pieces = [a6encode.Encoder(shard).decode_shard()[2] for shard in shards]
+    introcs.assert_equals(len(text.encode('utf-8')),sum(map(len,pieces)))
+    introcs.assert_true(len(pieces[2]) > len(pieces[0]) > len(pieces[1]) > len(pieces[3]))
+    introcs.assert_equals(text,a6encode.decode_shards(shards))
+    
+    # A damaged shard spoils the message
+    shards[1][100] = (9,9,9)
+    introcs.assert_equals(a6encode.Encoder.CORRUPT,a6encode.Encoder(shards[1]).getStatus())
+    introcs.assert_equals(None,a6encode.decode_shards(shards,1))
+
+
+def test_encode_capacity():
+    """
+    Tests the pre-flight methods getCapacity, getRequired and canEncode in class Encoder
+    """
+    print('Testing capacity planning')
+    import random
+    random.seed(3110)
+    
+    introcs.assert_equals(5,a6encode._utf8_length('Hello'))
+    introcs.assert_equals(len('héllo😊'.encode('utf-8')),a6encode._utf8_length('héllo😊'))
+    
+    for size in [5,7,14,20,150,1000,20000]:
+        image = a6image.Image(pixels.Pixels(random.randbytes(3*size)),1)
+        encoder = a6encode.Encoder(image)
+        for bits in [None,0,1,2,4]:
+            capacity = encoder.getCapacity(bits)
+            if encoder.getRequired('',bits) > size:
+                introcs.assert_equals(0,capacity)
+                introcs.assert_false(encoder.canEncode('',bits))
+                continue
+            
+            # A failed encode writes nothing
+            before = encoder.getCurrent().getBytes()
+            version = encoder.getCurrent().getVersion()
+            introcs.assert_false(encoder.canEncode('x'*(capacity+1),bits))
+            introcs.assert_false(encoder.encode('x'*(capacity+1),bits))
+            introcs.assert_equals(before,encoder.getCurrent().getBytes())
+            introcs.assert_equals(version,encoder.getCurrent().getVersion())
+            
+            introcs.assert_true(encoder.canEncode('x'*capacity,bits))
+            introcs.assert_true(encoder.getRequired('x'*capacity,bits) <= size)
+            introcs.assert_true(encoder.encode('x'*capacity,bits))
+    
+    encoder = a6encode.Encoder(a6image.Image(pixels.Pixels(bytes(3*100)),10))
+    introcs.assert_equals(7+6,encoder.getRequired('héllo'))
+    introcs.assert_equals(14+6,encoder.getRequired('héllo',0))
+    introcs.assert_equals(14+4,encoder.getRequired('héllo',4))
+    introcs.assert_equals(None,encoder.getRequired('x'*1000000))
+    introcs.assert_true(encoder.canEncode('x'*1000,0,'zlib'))
+
+
+def test_encode_stream():
+    """
+    Tests the methods encode_stream and decode_stream in class Encoder
+    """
+    print('Testing streamed encode and decode')
+    import io
+    import random
+    random.seed(3110)
+    
+    size = 200000
+    image = a6image.Image(pixels.Pixels(random.randbytes(3*size)),500)
+    encoder = a6encode.Encoder(image)
+    data = random.randbytes(150000)
+    for bits in [0,1,2,4]:
+        for compress in [None,'zlib']:
+            encoder.increment()
+            before = encoder.getCurrent().getBytes()
+            result = encoder.encode_stream(io.BytesIO(data),bits,compress)
+            if bits in [1,2]:
+                # Does not fit (random bytes do not compress), so nothing changes
+                introcs.assert_false(result)
+                introcs.assert_equals(before,encoder.getCurrent().getBytes())
+            else:
+                introcs.assert_true(result)
+                output = io.BytesIO()
+                introcs.assert_equals(len(data),encoder.decode_stream(output))
+                introcs.assert_equals(data,output.getvalue())
+            encoder.undo()
+    
+    # Text files are converted to and from UTF-8
+    text = 'Dög days ✓ '*20000
+    encoder.increment()
+    introcs.assert_true(encoder.encode_stream(io.StringIO(text),4,'lzma'))
+    introcs.assert_equals(text,encoder.decode())
+    output = io.StringIO()
+    introcs.assert_equals(len(text.encode('utf-8')),encoder.decode_stream(output))
+    introcs.assert_equals(text,output.getvalue())
+    
+    # Messages from encode can be streamed out too
+    encoder.increment()
+    encoder.encode('Hello World')
+    output = io.BytesIO()
+    introcs.assert_equals(11,encoder.decode_stream(output))
+    introcs.assert_equals(b'Hello World',output.getvalue())
+    
+    # A file that fails after the first block is hidden leaves the image as it was
+    class Broken(io.BytesIO):
+        def read(self, size=-1):
+            if self.tell() > a6encode._BLOCK:
+                raise OSError('disk error')
+            return super().read(size)
+    
+    for compress in [None,'zlib']:
+        encoder.increment()
+        before = encoder.getCurrent().getBytes()
+        introcs.assert_error(encoder.encode_stream,Broken(data*2),4,compress,error=OSError)
+        introcs.assert_equals(before,encoder.getCurrent().getBytes())
+    encoder.increment()
+    before = encoder.getCurrent().getBytes()
+    introcs.assert_error(encoder.encode_stream,io.TextIOWrapper(io.BytesIO(b'ok'*150000+b'\xff')),
+                         4,error=UnicodeDecodeError)
+    introcs.assert_equals(before,encoder.getCurrent().getBytes())
+    
+    encoder = a6encode.Encoder(a6image.Image(pixels.Pixels(random.randbytes(300)),10))
+    output = io.BytesIO()
+    introcs.assert_equals(None,encoder.decode_stream(output))
+    introcs.assert_equals(b'',output.getvalue())
+
+
+def test_benchmark():
+    """
+    Tests the measurements and regression check in module benchmark
+    """
+    print('Testing module benchmark')
+    operations = [('invert',),('monochromify',True),('encode',),('decode',),('undo',)]
+    results = benchmark.run([8,16],operations)
+    introcs.assert_equals(10,len(results))
+    introcs.assert_equals('monochromify(True)',results[1]['operation'])
+    for result in results:
+        introcs.assert_true(result['seconds'] >= 0)
+        introcs.assert_true(result['peak_bytes'] >= 0)
+        introcs.assert_equals(result['size']**2,result['pixels'])
+    
+    # Everything past the limit is skipped
+    results = benchmark.run([8,16],operations[:1],limit=0.0,memory=False)
+    introcs.assert_equals(None,results[0]['peak_bytes'])
+    introcs.assert_true(results[1]['skipped'])
+    
+    baseline = [{'operation':'invert','size':8,'seconds':1.0,'peak_bytes':1000},
+                {'operation':'jail','size':8,'seconds':0.001,'peak_bytes':None}]
+    current  = [{'operation':'invert','size':8,'seconds':1.2,'peak_bytes':1500},
+                {'operation':'jail','size':8,'seconds':0.004,'peak_bytes':None},
+                {'operation':'invert','size':16,'skipped':True}]
+    introcs.assert_equals(['invert at 8x8: 50% more memory'],benchmark.compare(current,baseline))
+    introcs.assert_equals(2,len(benchmark.compare(current,baseline,0.1)))
+    
+    # Headless modules must not pull in the GUI (or PIL before an image is read)
+    for result in benchmark.startup(['imagefile','a6encode','scanner'],1):
+        introcs.assert_equals([],result['gui'])
+        introcs.assert_false(result['pil'])
+        introcs.assert_true(0 < result['seconds'] <= result['process'])
+    
+    log = """import time: self [us] | cumulative | imported package
+import time:       100 |        100 | site
+import time:       300 |        300 |   json
+import time:       200 |        500 |     kivy.core
+import time:       100 |        900 |   pixels
+import time:       200 |       1900 | a6image"""
+    result = benchmark._parse_imports('a6image',log)
+    introcs.assert_equals(0.0019,result['seconds'])
+    introcs.assert_equals('pixels',result['slowest'])
+    introcs.assert_equals(['kivy'],result['gui'])
+    introcs.assert_false(result['pil'])
+
+
+def test_profiler():
+    """
+    Tests the stage timers and trace output in module profiler
+    """
+    import os
+    import json
+    import tempfile
+    print('Testing module profiler')
+    timers = profiler.Profiler(window=2)
+    for pos in range(3):
+        with timers.measure('invert'):
+            pass
+    try:
+        with timers.measure('decode'):
+            raise ValueError()
+    except ValueError:
+        pass
+    stats = timers.getStats()
+    introcs.assert_equals(['decode','invert'],sorted(stats))
+    introcs.assert_equals(3,stats['invert']['count'])
+    introcs.assert_equals(1,stats['decode']['count'])
+    introcs.assert_equals(None,stats['invert']['peak'])
+    introcs.assert_true(0 <= stats['invert']['min'] <= stats['invert']['mean'] <= stats['invert']['max'])
+    introcs.assert_equals(3,len(timers.report().split('\n')))
+    
+    # Recording stops when disabled
+    timers.enabled = False
+    with timers.measure('invert'):
+        pass
+    introcs.assert_equals(3,timers.getStats()['invert']['count'])
+    
+    # Memory peaks
+    timers = profiler.Profiler(memory=True)
+    with timers.measure('increment'):
+        data = bytearray(100000)
+    introcs.assert_true(timers.getStats()['increment']['peak'] >= 100000)
+    
+    # Only the memory allocated during a stage counts, not what is left over
+    with timers.measure('update'):
+        more = bytearray(1000)
+    introcs.assert_true(1000 <= timers.getStats()['update']['peak'] < 100000)
+    del data, more
+    
+    lines = timers.report(['increment']).split('\n')
+    introcs.assert_equals(4,len(lines))
+    introcs.assert_true(lines[-1].startswith('*'))
+    rows = {line.split()[0]: line.split()[-1] for line in lines[1:3]}
+    introcs.assert_equals('-',rows['increment*'])
+    introcs.assert_true(rows['update'].endswith('K'))
+    
+    # Traces
+    timers.startTrace()
+    with timers.measure('update'):
+        pass
+    timers.record('filter',0.5)
+    with tempfile.TemporaryDirectory() as folder:
+        file = os.path.join(folder,'trace.json')
+        timers.saveTrace(file)
+        with open(file) as handle:
+            events = json.load(handle)['traceEvents']
+    introcs.assert_equals(['update','filter'],[event['name'] for event in events])
+    introcs.assert_equals(500000,events[1]['dur'])
+    introcs.assert_equals('X',events[0]['ph'])
+    
+    import tracemalloc
+    tracemalloc.stop()
+
+
+def test_service():
+    """
+    Tests the image service and client in module service
+    """
+    import os
+    import tempfile
+    import threading
+    print('Testing module service')
+    introcs.assert_equals(('127.0.0.1',8000),service.parse_address('8000'))
+    introcs.assert_equals(('localhost',8000),service.parse_address('localhost:8000'))
+    introcs.assert_equals('/tmp/imager.sock',service.parse_address('/tmp/imager.sock'))
+    introcs.assert_error(service.check_chain,[['_lookup']],error=ValueError)
+    introcs.assert_error(service.check_chain,[('invert',)],error=ValueError)
+    
+    image = benchmark.make_image(16)
+    chain = [('invert',),('encode','Hello World'),('rotateRight',),('decode',)]
+    local = a6encode.Encoder(image.copy())
+    results = [getattr(local,action[0])(*action[1:]) for action in chain]
+    
+    with tempfile.TemporaryDirectory() as folder:
+        address = os.path.join(folder,'imager.sock')
+        server = service.Service(address,1)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            client = service.Client(server.address)
+            for attempt in range(2):
+                result, values = client.run(image,chain)
+                introcs.assert_equals(local.getCurrent().getBytes(),result.getBytes())
+                introcs.assert_equals(local.getCurrent().getWidth(),result.getWidth())
+                introcs.assert_equals(results,values)
+            introcs.assert_error(client.run,image,[('monochromify','sepia')],error=ValueError)
+            capacity = a6encode.Encoder(image).getCapacity(0)
+            introcs.assert_equals([capacity,None],client.run(image,[('getCapacity',0),('transpose',)])[1])
+            client.close()
+        finally:
+            server.shutdown()
+            thread.join()
+            server.close()
+        introcs.assert_false(os.path.exists(address))
+
+
+def test_filter_worker():
+    """
+    Tests running filters in a separate process in module filterworker
+    """
+    print('Testing class FilterWorker')
+    worker = filterworker.FilterWorker()
+    try:
+        for size in (12,20):
+            for action in [('invert',),('rotateRight',),('monochromify',True),('vignette',)]:
+                image  = benchmark.make_image(size,size)
+                editor = a6filter.Filter(image.copy())
+                getattr(editor,action[0])(*action[1:])
+                introcs.assert_equals(None,worker.run(image,action))
+                introcs.assert_equals(editor.getCurrent().getWidth(),image.getWidth())
+                compare_images(image,editor.getCurrent(),'worker '+action[0],'local '+action[0])
+        
+        # Errors come back unchanged, and leave the image alone
+        image = benchmark.make_image(8)
+        data  = image.getBytes()
+        introcs.assert_error(worker.run,image,('monochromify','sepia'))
+        introcs.assert_equals(data,image.getBytes())
+        introcs.assert_error(worker.run,image,('encode','Hello'))
+        
+        # A dead process is restarted
+        worker._process.kill()
+        worker._process.join()
+        worker.run(image,('invert',))
+        introcs.assert_equals(bytes(255-x for x in data),image.getBytes())
+        introcs.assert_true(worker.isAlive())
+    finally:
+        worker.close()
+    introcs.assert_false(worker.isAlive())
+
+
+def test_region():
+    """
+    Tests rectangle and bitmask regions in module region
+    """
+    print('Testing class Region')
+    part = region.Region(10,8,rect=(-2,6,5,5))
+    introcs.assert_equals((0,6,3,2),part.getBounds())
+    introcs.assert_equals(6,part.getCount())
+    introcs.assert_true(part.isRect())
+    introcs.assert_error(region.Region,10,8,(20,0,5,5))
+    introcs.assert_error(region.Region,10,8,(0,0,5,5),bytes(80))
+    
+    # Masks are trimmed to their bounds, and a full mask is a rectangle
+    mask = bytearray(80)
+    mask[12] = mask[13] = mask[23] = 7
+    part = region.Region(10,8,mask=mask)
+    introcs.assert_equals((2,1,2,2),part.getBounds())
+    introcs.assert_equals(3,part.getCount())
+    introcs.assert_false(part.isRect())
+    introcs.assert_equals(region.Region(10,8,mask=bytes(mask)),part)
+    introcs.assert_not_equals(region.Region(10,8,rect=(2,1,2,2)),part)
+    mask[22] = 1
+    introcs.assert_equals(region.Region(10,8,rect=(2,1,2,2)),region.Region(10,8,mask=mask))
+    introcs.assert_error(region.Region,10,8,None,bytes(80))
+    
+    # Only the selected pixels change
+    introcs.assert_false(part.fits(benchmark.make_image(10)))
+    image = a6image.Image(pixels.Pixels(benchmark.make_image(10,3).getBytes()[:240]),10)
+    before = image.copy()
+    crop = part.crop(image)
+    introcs.assert_equals(2,crop.getWidth())
+    introcs.assert_equals(image.getPixel(1,2),crop.getPixel(0,0))
+    result = region.apply(image,part,lambda pict : pict.setBytes(bytes(12)))
+    introcs.assert_equals(None,result)
+    for pos in range(80):
+        if pos in (12,13,23):
+            introcs.assert_equals((0,0,0),image[pos])
+        else:
+            introcs.assert_equals(before[pos],image[pos])
+    introcs.assert_error(part.paste,image,a6image.Image(pixels.Pixels(bytes(12)),4),error=ValueError)
+    
+    # A click without a drag selects nothing, even between pixel boundaries
+    introcs.assert_equals(None,region.between(10,8,(3.4,5.6),(3.4,5.6)))
+    introcs.assert_equals(None,region.between(10,8,(3.4,5.6),(3.45,5.62)))
+    introcs.assert_equals(None,region.between(10,8,(3.4,5.6),(7.2,5.7)))
+    introcs.assert_equals(region.Region(10,8,rect=(3,2,4,4)),region.between(10,8,(7.2,5.6),(3.4,2.1)))
+    introcs.assert_equals((0,0,10,8),region.between(10,8,(0,0),(10,8)).getBounds())
+
+
+def test_image_panel():
+    """
+    Tests the rubber band selection in class ImagePanel of module widgets
+    
+    The methods are called on a plain stand-in object, so that the test does
+    not need a window.  The test is skipped if Kivy is not installed.
+    """
+    try:
+        import widgets
+    except ImportError:
+        print('Kivy is not installed; skipping class ImagePanel')
+        return
+    print('Testing class ImagePanel')
+    
+    class Panel(object):
+        DRAG = widgets.ImagePanel.DRAG
+        getRegion = widgets.ImagePanel.getRegion
+        clearSelection = widgets.ImagePanel.clearSelection
+        on_touch_up = widgets.ImagePanel.on_touch_up
+        _toImage = widgets.ImagePanel._toImage
+        _select = widgets.ImagePanel._select
+        _placeBand = widgets.ImagePanel._placeBand
+    
+    class Touch(object):
+        def __init__(self, panel, start, end):
+            self.grab_current = panel
+            self.ox, self.oy = start
+            self.x, self.y = end
+            self.pos = end
+        def ungrab(self, widget):
+            self.grab_current = None
+    
+    # The image is 10x8 pixels, shown at 10 times its size
+    panel = Panel()
+    panel.picture = a6image.Image(pixels.Pixels(bytes(240)),10)
+    panel.x, panel.y, panel.imageoff, panel.imagesize = 0, 0, (0,0), (100,80)
+    panel.selection, panel.band = [], []
+    
+    panel._select((3.4,2.1),(7.2,5.6))
+    introcs.assert_equals([3,2,4,4],panel.selection)
+    introcs.assert_equals([30,20,40,40],panel.band)
+    introcs.assert_equals(region.Region(10,8,rect=(3,2,4,4)),panel.getRegion())
+    panel._select((3.4,5.6),(3.45,5.62))
+    introcs.assert_equals([],panel.selection)
+    introcs.assert_equals([],panel.band)
+    
+    # A drag selects the rectangle, but a click clears the selection
+    panel._anchor = (3.4,2.1)
+    touch = Touch(panel,(34,59),(72,24))
+    introcs.assert_true(panel.on_touch_up(touch))
+    introcs.assert_equals(None,touch.grab_current)
+    introcs.assert_equals([3,2,4,4],panel.selection)
+    panel._anchor = (3.4,2.1)
+    introcs.assert_true(panel.on_touch_up(Touch(panel,(34,59),(35,58))))
+    introcs.assert_equals([],panel.selection)
+    introcs.assert_equals([],panel.band)
+    introcs.assert_equals(None,panel.getRegion())
 
 
 def test_all():
@@ -502,18 +1923,74 @@ def test_all():
     test_image_operators()
     test_image_access()
     test_image_str()
+    test_image_bytes()
+    test_image_version()
+    test_image_stats()
     print('Class Image passed all tests.')
     print()
     
+    print('Testing class Editor')
+    test_editor_buffers()
+    test_editor_regions()
+    print('Class Editor passed all tests.')
+    print()
+    
     print('Testing class Filter')
-    test_reflect_vert()
-    test_monochromify()
-    test_jail()
-    test_vignette()
+    test_diff_images()
+    run_parallel(['test_reflect_vert','test_monochromify','test_jail','test_vignette'])
+    test_kernel()
+    test_convolve()
+    test_levels()
     print('Class Filter passed all tests.')
     print()
     
     print('Testing class Encoder')
     test_encode()
     test_decode()
-    print('Class Encoder passed all tests.')
\ No newline at end of file
+    test_encode_bulk()
+    test_encode_packed()
+    test_encode_extended()
+    test_encode_compressed()
+    test_encode_checksum()
+    test_encode_rewrite()
+    test_encode_shards()
+    test_encode_capacity()
+    test_encode_stream()
+    print('Class Encoder passed all tests.')
+    print()
+    
+    test_action_queue()
+    print('Class ActionQueue passed all tests.')
+    print()
+    
+    test_png_writer()
+    test_image_cache()
+    test_read_rows()
+    print('Module imagefile passed all tests.')
+    print()
+    
+    test_scanner()
+    print('Module scanner passed all tests.')
+    print()
+    
+    test_benchmark()
+    print('Module benchmark passed all tests.')
+    print()
+    
+    test_profiler()
+    print('Module profiler passed all tests.')
+    print()
+    
+    test_service()
+    print('Module service passed all tests.')
+    print()
+    
+    test_filter_worker()
+    print('Class FilterWorker passed all tests.')
+    print()
+    
+    test_region()
+    print('Module region passed all tests.')
+    print()
+    
+    test_image_panel()
@@ -0,0 +1,184 @@
+"""
+A serialized action queue for the imager application.
+
+The GUI runs every image operation on a worker thread.  Rather than locking
+the user out while an operation is running, the GUI pushes each requested
+operation onto an ActionQueue, and a single worker drains the queue one
+action at a time.
+
+Because the actions are only executed when the worker gets to them, the
+queue has a chance to throw out work that would have no visible effect.  Two
+inverts in a row cancel out, as do two reflections along the same axis, and
+four rotations to the right put the image back where it started.
+
+This module does not depend on Kivy, so it can be used (and tested) without
+the GUI.
+
+Nick Trejo nt286
+19 October 2026
+"""
+import threading
+
+
+class ActionQueue(object):
+    """
+    A thread-safe queue of pending image actions, with coalescing.
+
+    An action is a tuple whose first element is the name of a Filter (or
+    Encoder) method and whose remaining elements are the arguments to that
+    method, such as ('invert',) or ('monochromify',True).  This is the same
+    format used by the drop-down menus and InterfacePanel.do_async.  The GUI
+    adds a region.Region as the last element when the action should only 
+    change part of the image.
+
+    Only actions that have not started yet can be coalesced.  Once the worker
+    has popped an action off of the queue, it will run to completion.
+
+    Attribute SELF_INVERSE: A CLASS ATTRIBUTE for actions that undo themselves
+    Invariant: SELF_INVERSE is a set of method names (strings)
+
+    Attribute TURNS: A CLASS ATTRIBUTE for the quarter turns of each rotation
+    Invariant: TURNS is a dictionary mapping method names to 1 (right) or -1 (left)
+    """
+    # HIDDEN ATTRIBUTES
+    # Attribute _pending: The actions waiting to be run, in order
+    # Invariant: _pending is a list of non-empty tuples
+    #
+    # Attribute _busy: Whether a worker is currently draining the queue
+    # Invariant: _busy is a bool
+    #
+    # Attribute _lock: The lock guarding _pending and _busy
+    # Invariant: _lock is a threading.Lock
+
+    # Actions that are their own inverse (applying them twice does nothing)
+    SELF_INVERSE = {'invert','reflectHori','reflectVert','transpose'}
+
+    # Actions that rotate the image, as quarter turns clockwise
+    TURNS = {'rotateRight':1, 'rotateLeft':-1}
+
+    def __init__(self):
+        """
+        Initializes an empty, idle action queue.
+        """
+        self._pending = []
+        self._busy = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Returns the number of actions waiting to be run
+        """
+        with self._lock:
+            return len(self._pending)
+
+    def isBusy(self):
+        """
+        Returns True if a worker is currently draining this queue
+        """
+        with self._lock:
+            return self._busy
+
+    def getPending(self):
+        """
+        Returns a COPY of the list of actions waiting to be run
+        """
+        with self._lock:
+            return self._pending[:]
+
+    def push(self,*action):
+        """
+        Returns True if the caller must start a worker to drain the queue.
+
+        This method adds the action to the end of the queue, coalescing it
+        with any pending actions that it cancels out.  If the queue was idle,
+        it is marked busy and this method returns True; the caller is then
+        responsible for starting a worker that calls pop until it gets None,
+        and then calls finish.  Otherwise the existing worker will get to 
+        this action in turn, and this method returns False.
+
+        Parameter(s) *action: An expanded tuple defining the action
+        Precondition: The first element of action is a method name (a string)
+        """
+        assert len(action) > 0 and type(action[0]) == str, repr(action)+' is not an action'
+        with self._lock:
+            self._pending.append(action)
+            self._coalesce()
+            if self._busy:
+                return False
+            self._busy = True
+            return True
+
+    def pop(self):
+        """
+        Returns the next action to run, or None if there is nothing left.
+
+        The queue stays busy when this method returns None, since the worker
+        usually has clean-up left to do.  The queue is only marked idle by 
+        finish, so an action pushed during the clean-up does not start a 
+        second worker.
+        """
+        with self._lock:
+            if len(self._pending) == 0:
+                return None
+            return self._pending.pop(0)
+
+    def finish(self):
+        """
+        Returns True if the caller must start another worker to drain the queue.
+
+        This method is called once the worker has finished its clean-up (in 
+        the GUI, on the main thread).  If actions were pushed since the last
+        pop, the queue stays busy and this method returns True, just like 
+        push.  Otherwise the queue is marked idle and this returns False.
+        """
+        with self._lock:
+            if len(self._pending) > 0:
+                return True
+            self._busy = False
+            return False
+
+    def clear(self):
+        """
+        Removes all pending actions from the queue.
+
+        This does not stop an action that is already running.
+        """
+        with self._lock:
+            self._pending = []
+
+    # HELPER METHODS
+    def _coalesce(self):
+        """
+        Removes redundant actions from the end of the pending queue.
+
+        This method is called after each push, so only the tail of the queue
+        ever needs to be examined.  A self-inverse action directly following
+        the same action removes both.  A run of rotations is replaced by its
+        net effect: nothing, one right turn, two right turns or one left turn.
+        Actions only coalesce if they have the same arguments (such as the 
+        same region of the image).
+        """
+        if len(self._pending) >= 2:
+            last = self._pending[-1]
+            if last[0] in self.SELF_INVERSE and self._pending[-2] == last:
+                del self._pending[-2:]
+                return
+
+        start = len(self._pending)
+        extra = self._pending[-1][1:] if start else ()
+        turns = 0
+        while start > 0 and self._pending[start-1][0] in self.TURNS and self._pending[start-1][1:] == extra:
+            start -= 1
+            turns += self.TURNS[self._pending[start][0]]
+
+        if len(self._pending)-start < 2:
+            return
+
+        turns = turns % 4
+        if turns == 0:
+            tail = []
+        elif turns == 3:
+            tail = [('rotateLeft',)+extra]
+        else:
+            tail = [('rotateRight',)+extra]*turns
+        self._pending[start:] = tail
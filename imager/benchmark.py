@@ -0,0 +1,341 @@
+"""
+A benchmark suite for the imager application.
+
+This module times every Filter and Encoder operation (plus the Editor methods
+increment and undo) on generated square images, from 64x64 up to 8192x8192
+pixels.  For each operation and size it records the wall time, the peak memory
+allocated during the operation (measured with tracemalloc) and the number of
+pixels processed per second.  Together these give a scaling curve for each
+operation.
+
+Many of the filters loop over every pixel in Python, so the largest sizes can
+take a very long time.  Once an operation takes longer than a time limit, it
+is skipped at every larger size.
+
+The results can be saved as JSON and compared against a saved baseline, so
+that a change that makes an operation slower (or use more memory) by more
+than a threshold is reported as a regression.
+
+This module also measures how long the headless modules take to import in a
+fresh interpreter.  None of them may import Kivy (only interface and widgets
+do that), and none of them may import PIL until an image is actually read, so
+that a headless run spends its startup time decoding images.
+
+Nick Trejo nt286
+19 October 2026
+"""
+import time
+
+# The side lengths of the generated images
+SIZES = (64,128,256,512,1024,2048,4096,8192)
+
+# The operations to time, as actions (see actions.ActionQueue)
+OPERATIONS = (('invert',), ('transpose',), ('reflectHori',), ('reflectVert',),
+              ('rotateRight',), ('rotateLeft',), ('monochromify',False),
+              ('monochromify',True), ('jail',), ('vignette',), ('blur',1), ('blur',7),
+              ('sharpen',), ('edges',), ('autoLevels',), ('equalize',), ('encode',),
+              ('decode',), ('increment',), ('undo',))
+
+# Baseline times shorter than this (in seconds) are too noisy to compare
+MIN_TIME = 0.005
+
+# The modules used by the headless modes (--test, --encode, --decode, --scan, ...)
+HEADLESS = ('a6image','a6encode','imagefile','scanner','benchmark','profiler','a6test')
+
+# The top-level packages that a headless import must not load
+GUI_PACKAGES = ('kivy',)
+
+
+def make_image(size, seed=0):
+    """
+    Returns a square image of random pixels.
+
+    Parameter size: The width and height of the image
+    Precondition: size is an int > 0
+
+    Parameter seed: The random seed, so that runs use the same pixels
+    Precondition: seed is an int
+    """
+    import random
+    import a6image
+    from pixels import Pixels
+    data = random.Random(seed).randbytes(3*size*size)
+    return a6image.Image(Pixels(data),size)
+
+
+def measure(action, image, memory=True):
+    """
+    Returns a dictionary of the measurements for one action on image.
+
+    The action is run on a new Encoder for a copy of image, so image is not
+    changed.  Any setup (such as hiding a message before timing decode) is
+    not timed.  The dictionary has the keys 'operation', 'size', 'pixels',
+    'seconds', 'pixels_per_second' and 'peak_bytes'.  If memory is True, the
+    action is run a second time with tracemalloc to find the peak memory
+    allocated; otherwise 'peak_bytes' is None.
+
+    Parameter action: The operation to measure
+    Precondition: action is a tuple in OPERATIONS
+
+    Parameter image: The image to run it on
+    Precondition: image is an Image object
+
+    Parameter memory: Whether to measure the peak memory
+    Precondition: memory is a bool
+    """
+    import tracemalloc
+
+    task = _prepare(action,image)
+    start = time.perf_counter()
+    task()
+    seconds = time.perf_counter()-start
+
+    peak = None
+    if memory:
+        task = _prepare(action,image)
+        tracemalloc.start()
+        try:
+            task()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {'operation': _name(action), 'size': image.getWidth(), 'pixels': len(image),
+            'seconds': seconds, 'pixels_per_second': len(image)/max(seconds,1e-9),
+            'peak_bytes': peak}
+
+
+def run(sizes=SIZES, operations=OPERATIONS, limit=10.0, memory=True, report=None):
+    """
+    Returns a list of measurements for every operation at every size.
+
+    Each measurement is a dictionary from measure.  Once an operation takes
+    longer than limit seconds, its larger sizes are not run; they get the
+    dictionary {'operation':..., 'size':..., 'skipped':True} instead.
+
+    Parameter sizes: The image sizes to try, smallest first
+    Precondition: sizes is a list of ints > 0
+
+    Parameter operations: The operations to measure
+    Precondition: operations is a list of tuples from OPERATIONS
+
+    Parameter limit: The time (in seconds) after which to stop growing an operation
+    Precondition: limit is a number > 0
+
+    Parameter memory: Whether to measure the peak memory
+    Precondition: memory is a bool
+
+    Parameter report: A function to call with each measurement as it is made
+    Precondition: report is None or callable with one argument
+    """
+    results = []
+    slow = set()
+    for size in sizes:
+        image = make_image(size)
+        for action in operations:
+            if action in slow:
+                result = {'operation': _name(action), 'size': size, 'skipped': True}
+            else:
+                result = measure(action,image,memory)
+                if result['seconds'] > limit:
+                    slow.add(action)
+            results.append(result)
+            if not report is None:
+                report(result)
+        del image
+    return results
+
+
+def compare(results, baseline, threshold=0.25):
+    """
+    Returns a list of the regressions in results compared to baseline.
+
+    A regression is a measurement whose time or peak memory is more than
+    threshold (as a fraction) above the baseline measurement of the same
+    operation and size.  Skipped measurements, and times too short to compare
+    (see MIN_TIME), are ignored.  Each regression is a string describing it.
+
+    Parameter results: The new measurements
+    Precondition: results is a list of dictionaries from run
+
+    Parameter baseline: The old measurements
+    Precondition: baseline is a list of dictionaries from run
+
+    Parameter threshold: The allowed increase, as a fraction
+    Precondition: threshold is a number >= 0
+    """
+    old = {(item['operation'],item['size']): item for item in baseline if not item.get('skipped')}
+    regressions = []
+    for item in results:
+        key = (item['operation'],item['size'])
+        if item.get('skipped') or not key in old:
+            continue
+        before = old[key]
+        label = item['operation']+' at '+str(item['size'])+'x'+str(item['size'])
+        if before['seconds'] >= MIN_TIME and item['seconds'] > before['seconds']*(1+threshold):
+            regressions.append(label+': '+_change(before['seconds'],item['seconds'])+' slower')
+        if before.get('peak_bytes') and item.get('peak_bytes') and item['peak_bytes'] > before['peak_bytes']*(1+threshold):
+            regressions.append(label+': '+_change(before['peak_bytes'],item['peak_bytes'])+' more memory')
+    return regressions
+
+
+def startup(modules=HEADLESS, repeat=3):
+    """
+    Returns a list of import measurements for the given modules.
+    
+    Each module is imported in a fresh Python interpreter, using the option 
+    -X importtime.  The measurement is a dictionary with the keys 'module',
+    'seconds' (the time to import the module and everything it imports), 
+    'process' (the wall time of the whole interpreter run), 'slowest' (the 
+    direct import that took longest, or None), 'gui' (the GUI packages that 
+    were loaded) and 'pil' (whether PIL was loaded).  The times are the best
+    of repeat runs.
+    
+    Parameter modules: The modules to import
+    Precondition: modules is a list of module names in this folder
+    
+    Parameter repeat: The number of times to import each module
+    Precondition: repeat is an int > 0
+    """
+    import os
+    import sys
+    import subprocess
+    assert type(repeat) == int and repeat > 0, repr(repeat)+' is not a valid repeat count'
+    
+    folder = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for module in modules:
+        best = None
+        for attempt in range(repeat):
+            start = time.perf_counter()
+            done = subprocess.run([sys.executable,'-X','importtime','-c','import '+module],
+                                  cwd=folder,capture_output=True,text=True,check=True)
+            process = time.perf_counter()-start
+            result = _parse_imports(module,done.stderr)
+            result['process'] = process
+            if best is None or result['seconds'] < best['seconds']:
+                best = result
+        results.append(best)
+    return results
+
+
+def save(results, file):
+    """
+    Writes the measurements to a JSON file, along with the Python version.
+
+    Parameter results: The measurements
+    Precondition: results is a list of dictionaries from run
+
+    Parameter file: The file to write
+    Precondition: file is a filename string
+    """
+    import json
+    import platform
+    data = {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+    with open(file,'w') as handle:
+        json.dump(data,handle,indent=1)
+
+
+def load(file):
+    """
+    Returns the measurements saved in a JSON file by save.
+
+    Parameter file: The file to read
+    Precondition: file is a filename string
+    """
+    import json
+    with open(file) as handle:
+        return json.load(handle)['results']
+
+
+# HELPER FUNCTIONS
+def _name(action):
+    """
+    Returns the name of an operation as a string, such as 'monochromify(True)'.
+
+    Parameter action: The operation
+    Precondition: action is a tuple in OPERATIONS
+    """
+    if len(action) == 1:
+        return action[0]
+    return action[0]+'('+','.join(map(repr,action[1:]))+')'
+
+
+def _change(before, after):
+    """
+    Returns the increase from before to after as a percentage string.
+
+    Parameter before: The old value
+    Precondition: before is a number > 0
+
+    Parameter after: The new value
+    Precondition: after is a number >= 0
+    """
+    return str(round(100*(after-before)/before))+'%'
+
+
+def _parse_imports(module, log):
+    """
+    Returns a startup measurement (see startup) from the output of -X importtime.
+    
+    Each line of the output has the form 'import time: self | cumulative | name',
+    with the times in microseconds and name indented by its import depth.
+    
+    Parameter module: The module that was imported
+    Precondition: module is a string
+    
+    Parameter log: The standard error of the interpreter
+    Precondition: log is a string
+    """
+    seconds = 0
+    slowest = None
+    children = []
+    loaded = []
+    for line in log.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        cumulative = int(parts[1])/1e6
+        name = parts[2].rstrip()
+        depth = (len(name)-len(name.lstrip()))//2
+        name = name.strip()
+        loaded.append(name.split('.')[0])
+        # A module is listed after everything that it imports
+        if depth == 1:
+            children.append((cumulative,name))
+        elif depth == 0:
+            if name == module:
+                seconds = cumulative
+                slowest = max(children)[1] if children else None
+            children = []
+    gui = sorted(set(loaded) & set(GUI_PACKAGES))
+    return {'module': module, 'seconds': seconds, 'slowest': slowest,
+            'gui': gui, 'pil': 'PIL' in loaded}
+
+
+def _prepare(action, image):
+    """
+    Returns a function of no arguments that runs action on a copy of image.
+
+    Any setup that should not be timed is done here, before returning.  The
+    encode operation hides a message as long as a quarter of the pixels, and
+    the decode operation reads back a message of that length.
+
+    Parameter action: The operation
+    Precondition: action is a tuple in OPERATIONS
+
+    Parameter image: The image to run it on
+    Precondition: image is an Image object
+    """
+    from a6encode import Encoder
+    encoder = Encoder(image)
+    name = action[0]
+    if name in ('encode','decode'):
+        text = 'x'*min(encoder.getCapacity(0),len(image)//4)
+        if name == 'decode':
+            encoder.encode(text,0)
+            return encoder.decode
+        return lambda : encoder.encode(text,0)
+    elif name == 'undo':
+        encoder.increment()
+    return lambda : getattr(encoder,name)(*action[1:])
@@ -0,0 +1,241 @@
+"""
+A separate process for running filters in the imager application.
+
+The GUI runs each filter on a worker thread, but the filters are pure Python,
+so they hold the GIL and compete with Kivy's main loop, and the window
+stutters during a long filter.  The class in this module runs the filters in
+a child process instead.  The worker thread only waits on a pipe, which lets
+the main loop run freely.
+
+The pixels are never pickled.  They are copied into a block of shared memory
+(see multiprocessing.shared_memory), the child process filters them there, and
+the parent copies the result back out.  Only the action and the image width
+go through the pipe.
+
+This module does not depend on Kivy, so it can be used (and tested) without
+the GUI.
+
+Nick Trejo nt286
+19 October 2026
+"""
+import threading
+
+
+class FilterWorker(object):
+    """
+    A child process that runs Filter methods on images in shared memory.
+
+    The process is started by the first call to run (or by start), and it
+    keeps running until close is called.  If the process dies, the next call
+    to run starts a new one.  Only one action runs at a time; run is safe to
+    call from several threads, but the calls take turns.
+
+    Attribute ACTIONS: A CLASS ATTRIBUTE for the methods that can be run
+    Invariant: ACTIONS is a set of names of Filter methods (strings)
+    """
+    # HIDDEN ATTRIBUTES
+    # Attribute _process: The child process (None if not started)
+    # Invariant: _process is a multiprocessing Process or None
+    #
+    # Attribute _conn: The parent end of the pipe to the child (None if not started)
+    # Invariant: _conn is a multiprocessing Connection or None
+    #
+    # Attribute _memory: The shared memory for the pixels (None until the first run)
+    # Invariant: _memory is a SharedMemory or None
+    #
+    # Attribute _capacity: The number of bytes of _memory that we may use
+    # Invariant: _capacity is an int >= 0 (0 if _memory is None)
+    #
+    # Attribute _lock: The lock making calls to run take turns
+    # Invariant: _lock is a threading.Lock
+
+    # The methods that only change the current image (so they can run anywhere)
+    ACTIONS = {'invert','transpose','reflectHori','reflectVert','rotateRight',
+               'rotateLeft','monochromify','jail','vignette','convolve','blur',
+               'sharpen','edges','autoLevels','equalize'}
+
+    def __init__(self):
+        """
+        Initializes a worker with no process started yet.
+        """
+        self._process = None
+        self._conn = None
+        self._memory = None
+        self._capacity = 0
+        self._lock = threading.Lock()
+
+    def isAlive(self):
+        """
+        Returns True if the child process is running
+        """
+        return not self._process is None and self._process.is_alive()
+
+    def start(self):
+        """
+        Starts the child process, if it is not running already.
+
+        The process is spawned (not forked), so it does not inherit the GUI.
+        """
+        import multiprocessing
+        with self._lock:
+            if self.isAlive():
+                return
+            self._stop()
+            context = multiprocessing.get_context('spawn')
+            self._conn, child = context.Pipe()
+            self._process = context.Process(target=_serve,args=(child,),daemon=True)
+            self._process.start()
+            child.close()
+
+    def run(self, image, action):
+        """
+        Returns the value of running action on image, in the child process.
+
+        The image is changed in place, exactly as if the action was run on a
+        Filter for it (including its width, for rotations).  If the action
+        raises an error, the same error is raised here and image is not
+        changed.  If the child process dies, this raises a RuntimeError.
+
+        Parameter image: The image to filter
+        Precondition: image is an Image object
+
+        Parameter action: The method to run and its arguments
+        Precondition: action is a tuple whose first element is in ACTIONS
+        """
+        assert action and action[0] in self.ACTIONS, repr(action)+' is not a valid action'
+        if not self.isAlive():
+            self.start()
+
+        with self._lock:
+            size = 3*len(image)
+            self._reserve(size)
+            self._memory.buf[:size] = image.getBytes()
+            try:
+                self._conn.send((self._memory.name,size,image.getWidth(),tuple(action)))
+                status, value = self._conn.recv()
+            except (EOFError, OSError):
+                raise RuntimeError('the filter process stopped unexpectedly')
+            if status == 'error':
+                raise value
+
+            image.setBytes(self._memory.buf[:size])
+            if value[0] != image.getWidth():
+                image.setWidth(value[0])
+            return value[1]
+
+    def close(self):
+        """
+        Stops the child process and frees the shared memory.
+        """
+        with self._lock:
+            self._stop()
+            if not self._memory is None:
+                self._memory.close()
+                self._memory.unlink()
+                self._memory = None
+                self._capacity = 0
+
+    # HELPER METHODS
+    def _reserve(self, size):
+        """
+        Makes sure that the shared memory can hold size bytes.
+
+        This method must be called with the lock held.
+
+        Parameter size: The number of bytes needed
+        Precondition: size is an int >= 0
+        """
+        from multiprocessing import shared_memory
+        if size <= self._capacity:
+            return
+        if not self._memory is None:
+            self._memory.close()
+            self._memory.unlink()
+        self._memory = shared_memory.SharedMemory(create=True,size=max(size,1))
+        self._capacity = size
+
+    def _stop(self):
+        """
+        Stops the child process, if any.
+
+        This method must be called with the lock held.
+        """
+        if not self._conn is None:
+            try:
+                self._conn.send(None)
+            except (OSError, ValueError):
+                pass
+            self._conn.close()
+            self._conn = None
+        if not self._process is None:
+            self._process.join(1)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+            self._process = None
+
+
+# HELPER FUNCTIONS
+def _serve(conn):
+    """
+    Runs actions sent through conn until it receives None; this is the child process.
+
+    Each message is a tuple (name,size,width,action): the name of the shared
+    memory, the number of bytes of pixels in it, the image width, and the
+    action to run.  The reply is ('done',(width,value)) with the new width
+    and the value returned by the action, or ('error',exception), where the
+    exception has a note with the traceback from this process.
+
+    Parameter conn: The child end of the pipe
+    Precondition: conn is a multiprocessing Connection
+    """
+    import traceback
+    import a6image
+    import a6filter
+    from pixels import Pixels
+
+    memory = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        name, size, width, action = message
+        try:
+            if memory is None or memory.name != name:
+                if not memory is None:
+                    memory.close()
+                memory = _attach(name)
+            editor = a6filter.Filter(a6image.Image(Pixels(memory.buf[:size]),width))
+            value = getattr(editor,action[0])(*action[1:])
+            current = editor.getCurrent()
+            memory.buf[:size] = current.getBytes()
+            reply = ('done',(current.getWidth(),value))
+        except Exception as e:
+            # Keep the child traceback, since it is lost when e is pickled
+            if hasattr(e,'add_note'):
+                e.add_note('In the filter process:\n'+traceback.format_exc())
+            reply = ('error',e)
+        conn.send(reply)
+
+    if not memory is None:
+        memory.close()
+    conn.close()
+
+
+def _attach(name):
+    """
+    Returns the existing shared memory with the given name.
+
+    The child is spawned, so it shares the resource tracker of the parent.
+    Attaching registers the memory a second time, which is harmless; the
+    parent still owns it and unlinks it in close.
+
+    Parameter name: The name of the shared memory
+    Precondition: name is a string
+    """
+    from multiprocessing import shared_memory
+    return shared_memory.SharedMemory(name=name)
@@ -0,0 +1,387 @@
+"""
+Image file support for the imager application.
+
+This module reads image files into Image objects.  It is shared by the GUI
+and by anything that runs without it, so it does not depend on Kivy.
+
+The decoded pixels go straight from PIL's byte buffer into a Pixels object.
+They are never converted to a list of tuples, and they are never checked
+pixel by pixel, which makes loading large photos many times faster.  Recently
+decoded files can also be kept in an ImageCache, so that switching back to
+them does not decode them again.  When only the top of an image is needed, 
+read_rows avoids decoding the rest of it.
+
+Nick Trejo nt286
+19 October 2026
+"""
+import a6image
+from pixels import Pixels
+
+
+def read_image(file, size=None):
+    """
+    Returns an Image object for the given file.
+
+    If size is not None, the image is decoded at a reduced size that fits
+    inside it (keeping the aspect ratio), which is useful for previews.  For
+    JPEG files, this uses draft mode so that the decoder itself does less
+    work.  Other formats are decoded in full and then shrunk.
+
+    This function raises an OSError if the file cannot be read or is not an
+    image file.  It does not touch the GUI, so it is safe to call from any
+    thread.
+
+    Parameter file: An absolute path to an image file
+    Precondition: file is a string
+
+    Parameter size: The maximum (width, height) to decode, or None for full size
+    Precondition: size is None or a tuple of two ints > 0
+    """
+    from PIL import Image as CoreImage
+    assert size is None or (len(size) == 2 and size[0] > 0 and size[1] > 0), repr(size)+' is not a size'
+
+    with CoreImage.open(file) as image:
+        if not size is None:
+            image.draft('RGB',size)
+            if image.size[0] > size[0] or image.size[1] > size[1]:
+                image.thumbnail(size)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        width = image.size[0]
+        data = image.tobytes()
+
+    return a6image.Image(Pixels(data),width)
+
+
+def read_rows(file, rows):
+    """
+    Returns an Image object for the first rows of the given file.
+    
+    This is much faster than read_image when only the top of an image is 
+    needed (such as a steganography header).  For PNG files that are not 
+    interlaced, the decoder stops after the given number of rows, so the 
+    rest of the file is never decompressed.  Other files are decoded in full
+    and then cut down.  Stopping early relies on details of PIL that are not
+    public; if that fails for any reason, the file is decoded in full too.
+    
+    This function raises an OSError if the file cannot be read or is not an
+    image file.
+    
+    Parameter file: An absolute path to an image file
+    Precondition: file is a string
+    
+    Parameter rows: The number of rows to read
+    Precondition: rows is an int > 0
+    """
+    from PIL import Image as CoreImage
+    assert type(rows) == int and rows > 0, repr(rows)+' is not a valid number of rows'
+    
+    data = None
+    with CoreImage.open(file) as image:
+        width, height = image.size
+        rows = min(rows,height)
+        if image.format == 'PNG' and rows < height:
+            try:
+                data = _read_top(image,rows)
+            except Exception:
+                data = None
+    
+    if data is None:
+        with CoreImage.open(file) as image:
+            image = image.crop((0,0,width,rows))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            data = image.tobytes()
+    
+    return a6image.Image(Pixels(data),width)
+
+
+def _read_top(image, rows):
+    """
+    Returns the first rows of an open PNG file as RGB bytes, or None.
+    
+    This shrinks the area that PIL decodes, which PIL has no public way to 
+    do, so it depends on PIL internals (the tile list and the size).  It 
+    returns None if the image is not a simple PNG, and the result is checked,
+    so any change to those internals gives None or an error (not a broken 
+    image).  Either way, the image must not be used afterwards.
+    
+    Parameter image: The image to read
+    Precondition: image is a PIL image for a PNG file that has not been loaded
+    
+    Parameter rows: The number of rows to read
+    Precondition: rows is an int, 0 < rows <= image height
+    """
+    width = image.size[0]
+    if len(image.tile) != 1 or image.info.get('interlace'):
+        return None
+    tile = image.tile[0]
+    if tuple(tile[1]) != (0,0)+image.size:
+        return None
+    image.tile = [(tile[0],(0,0,width,rows))+tuple(tile[2:])]
+    image._size = (width,rows)
+    image.load()
+    if image.size != (width,rows):
+        return None
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    data = image.tobytes()
+    return data if len(data) == 3*width*rows else None
+
+
+def write_png(image, file, level=6):
+    """
+    Writes the given image to a PNG file.
+
+    The pixels are handed to PIL as a single RGB byte buffer, so there is no
+    per-pixel conversion.  This function raises an OSError if the file cannot
+    be written.
+
+    Parameter image: The image to save
+    Precondition: image is an Image object
+
+    Parameter file: An absolute path to the PNG file
+    Precondition: file is a string
+
+    Parameter level: The zlib compression level (1 is fastest, 9 is smallest)
+    Precondition: level is an int in 0..9
+    """
+    _write_png(image.getBytes(),image.getWidth(),image.getHeight(),file,level)
+
+
+def _write_png(data, width, height, file, level):
+    """
+    Writes RGB pixel data to a PNG file.
+
+    Parameter data: The red, green and blue values of each pixel, in order
+    Precondition: data is a bytes-like object of length 3*width*height
+
+    Parameter width: The image width
+    Precondition: width is an int > 0
+
+    Parameter height: The image height
+    Precondition: height is an int > 0
+
+    Parameter file: An absolute path to the PNG file
+    Precondition: file is a string
+
+    Parameter level: The zlib compression level (1 is fastest, 9 is smallest)
+    Precondition: level is an int in 0..9
+    """
+    from PIL import Image as CoreImage
+    assert type(level) == int and 0 <= level <= 9, repr(level)+' is not a compression level'
+    image = CoreImage.frombytes('RGB',(width,height),bytes(data))
+    image.save(file,'PNG',compress_level=level)
+
+
+class ImageCache(object):
+    """
+    A least-recently-used cache of decoded image files.
+
+    The cache remembers the decoded pixels of the files that it reads, up to
+    a memory limit.  A file is identified by its path, modification time and
+    size, so a file that changes on disk is decoded again.  When the cache is
+    full, the files that were used least recently are forgotten first.
+
+    Every call to read returns a new Image object, so edits to one image do
+    not change the cached pixels.  The cache is safe to use from several 
+    threads.
+
+    Attribute capacity: The maximum number of bytes of pixel data to keep
+    Invariant: capacity is an int >= 0
+    """
+    # HIDDEN ATTRIBUTES
+    # Attribute _entries: The cached pixels, least recently used first
+    # Invariant: _entries is an OrderedDict mapping (path,mtime,filesize,size) keys
+    # to (bytes,width) pairs
+    #
+    # Attribute _usage: The number of bytes of pixel data in the cache
+    # Invariant: _usage is the sum of the lengths of the bytes in _entries
+    #
+    # Attribute _lock: The lock guarding _entries and _usage
+    # Invariant: _lock is a threading.Lock
+
+    def __init__(self, capacity=512*1024*1024):
+        """
+        Initializes an empty cache with the given memory limit.
+
+        Parameter capacity: The maximum number of bytes of pixel data to keep
+        Precondition: capacity is an int >= 0
+        """
+        import collections
+        import threading
+        assert type(capacity) == int and capacity >= 0, repr(capacity)+' is not a valid capacity'
+        self.capacity = capacity
+        self._entries = collections.OrderedDict()
+        self._usage = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Returns the number of decoded files in the cache
+        """
+        with self._lock:
+            return len(self._entries)
+
+    def getUsage(self):
+        """
+        Returns the number of bytes of pixel data currently in the cache
+        """
+        with self._lock:
+            return self._usage
+
+    def read(self, file, size=None):
+        """
+        Returns an Image object for the given file, decoding it only if necessary.
+
+        This has the same behavior as the function read_image, including the
+        errors it raises.  Images larger than the capacity are never cached.
+
+        Parameter file: An absolute path to an image file
+        Precondition: file is a string
+
+        Parameter size: The maximum (width, height) to decode, or None for full size
+        Precondition: size is None or a tuple of two ints > 0
+        """
+        import os
+        path = os.path.abspath(file)
+        stat = os.stat(path)
+        key = (path,stat.st_mtime_ns,stat.st_size,None if size is None else tuple(size))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry is None:
+                self._entries.move_to_end(key)
+        if not entry is None:
+            return a6image.Image(Pixels(entry[0]),entry[1])
+
+        image = read_image(path,size)
+        data = image.getBytes()
+        with self._lock:
+            if len(data) <= self.capacity and not key in self._entries:
+                self._entries[key] = (data,image.getWidth())
+                self._usage += len(data)
+                self._shrink()
+        return image
+
+    def clear(self):
+        """
+        Removes every file from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._usage = 0
+
+    # HELPER METHODS
+    def _shrink(self):
+        """
+        Forgets the least recently used files until the cache fits its capacity.
+
+        This method must be called with the lock held.
+        """
+        while self._usage > self.capacity:
+            key, entry = self._entries.popitem(last=False)
+            self._usage -= len(entry[0])
+
+
+class PngWriter(object):
+    """
+    A background thread for saving PNG files.
+
+    Saving a large photo spends most of its time compressing, so this class
+    does the work on its own thread.  The image is copied (snapshotted) when
+    the save is requested, so the caller can keep editing the image while it
+    is written.  Saves are performed in the order they are requested.  The 
+    thread is a daemon thread, so it does not keep a program running; call
+    wait before exiting, or any saves still queued are lost.
+
+    Attribute FAST: A CLASS ATTRIBUTE for the fastest compression level
+    Invariant: FAST is an int in 0..9
+
+    Attribute SMALL: A CLASS ATTRIBUTE for the smallest compression level
+    Invariant: SMALL is an int in 0..9
+
+    Attribute level: The default compression level for this writer
+    Invariant: level is an int in 0..9
+    """
+    # HIDDEN ATTRIBUTES
+    # Attribute _jobs: The saves waiting to be written
+    # Invariant: _jobs is a queue.Queue of tuples (data,width,height,file,level,callback)
+    #
+    # Attribute _thread: The thread writing the files (None until the first save)
+    # Invariant: _thread is a threading.Thread or None
+
+    # Compression levels (PIL uses 6 by default)
+    FAST  = 1
+    SMALL = 9
+
+    def __init__(self, level=6):
+        """
+        Initializes a writer with the given default compression level.
+
+        The thread is not started until the first save.
+
+        Parameter level: The default compression level (1 is fastest, 9 is smallest)
+        Precondition: level is an int in 0..9
+        """
+        import queue
+        assert type(level) == int and 0 <= level <= 9, repr(level)+' is not a compression level'
+        self.level = level
+        self._jobs = queue.Queue()
+        self._thread = None
+
+    def save(self, image, file, callback=None, level=None):
+        """
+        Snapshots the image and queues it to be written to file.
+
+        When the file is written (or fails to be written), the callback is 
+        called with two arguments: the file name and the exception raised (or
+        None if the save succeeded).  The callback is called on the writer 
+        thread, NOT the thread that requested the save.
+
+        Parameter image: The image to save
+        Precondition: image is an Image object
+
+        Parameter file: An absolute path to the PNG file
+        Precondition: file is a string
+
+        Parameter callback: The function to call when the save is done
+        Precondition: callback is None or callable with two arguments
+
+        Parameter level: The compression level (None for the writer default)
+        Precondition: level is None or an int in 0..9
+        """
+        import threading
+        if level is None:
+            level = self.level
+        assert type(level) == int and 0 <= level <= 9, repr(level)+' is not a compression level'
+
+        job = (image.getBytes(),image.getWidth(),image.getHeight(),file,level,callback)
+        self._jobs.put(job)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,daemon=True)
+            self._thread.start()
+
+    def wait(self):
+        """
+        Blocks until every queued save has been written.
+        """
+        self._jobs.join()
+
+    # HELPER METHODS
+    def _run(self):
+        """
+        Writes queued saves forever; this is the body of the writer thread.
+        """
+        while True:
+            data, width, height, file, level, callback = self._jobs.get()
+            error = None
+            try:
+                _write_png(data,width,height,file,level)
+            except Exception as e:
+                error = e
+            try:
+                if not callback is None:
+                    callback(file,error)
+            finally:
+                self._jobs.task_done()
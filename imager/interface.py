@@ -25,6 +25,11 @@ from kivy.app import App
 from kivy.metrics import sp
 
 from widgets import *
+from actions import ActionQueue
+from imagefile import PngWriter, ImageCache
+from profiler import Profiler
+from filterworker import FilterWorker
+import region
 import traceback
 
 class InterfacePanel(BoxLayout):
@@ -54,6 +59,10 @@ class InterfacePanel(BoxLayout):
     
     # The menu bar
     menubar   = ObjectProperty(None)
+    # The image menu button (disabled while actions are running)
+    imagemenu = ObjectProperty(None)
+    # The text menu button (disabled while actions are running)
+    textmenu  = ObjectProperty(None)
     # The progress monitor
     progress  = ObjectProperty(None)
     
@@ -73,6 +82,12 @@ class InterfacePanel(BoxLayout):
     # For handling the "progress" monitor
     processing = BooleanProperty(False)
     
+    # The decoded image cache, shared by all panels (see imagefile.ImageCache)
+    cache = ImageCache()
+    
+    # The stage timers (disabled unless the application is launched with --profile)
+    profiler = Profiler(False)
+    
     def config(self):
         """
         Configures the application at start-up.
@@ -83,6 +98,12 @@ class InterfacePanel(BoxLayout):
         """
         # For working with pop-ups (Hidden since not .kv aware)
         self._popup = None
+        self.async_action = None
+        self.async_thread = None
+        self.actions = ActionQueue()
+        self.writer  = PngWriter()
+        self.filters = FilterWorker()
+        self.loading = False
         self.place_image('',self.source)
         self.imagedrop = ImageDropDown(choices=['load','save','undo','reset'], 
                                        save=[self.save_image], load=[self.load_image],
@@ -107,8 +128,7 @@ class InterfacePanel(BoxLayout):
                                        p50=[self.do_async,'pixellate',50],
                                        p100=[self.do_async,'pixellate',100],
                                        p200=[self.do_async,'pixellate',200])
-        self.async_action = None
-        self.async_thread = None
+        self.workimage.selectable = True
         
         self.textpanel.hide_widget(True)
         self.textdrop.disable(True)
@@ -218,37 +238,30 @@ class InterfacePanel(BoxLayout):
             self._popup = None
     
     # FILE HANDLING
-    def read_image(self, file):
+    def read_image(self, file, size=None):
         """
         Returns an Image object for the give file.
         
         If it cannot read the image (either Image is not defined or the file 
         is not an image file), this method returns None.
         
+        The pixels are decoded straight into the Image storage (see the module
+        imagefile).  Recently opened files are kept in the image cache, so 
+        they are only decoded once.  This method does not touch the widgets, 
+        so it may be called from a worker thread.
+        
         Parameter file: An absolute path to an image file
         Precondition: file is a string
-        """
-        import a6image
-        from PIL import Image as CoreImage
         
+        Parameter size: The maximum (width, height) to decode, or None for full size
+        Precondition: size is None or a tuple of two ints > 0
+        """
         try:
-            image = CoreImage.open(file)
-            image = image.convert("RGB")
-            buffer = list(image.getdata())
-            size  = image.size[0]*image.size[1]
-            width = image.size[0]
+            result = self.cache.read(file,size)
         except:
             traceback.print_exc()
             self.error('Could not load the image file')
-            buffer = None
-        
-        result = None
-        if not buffer is None:
-            try:
-                result = a6image.Image(buffer,width)
-            except:
-                traceback.print_exc()
-                result = None
+            result = None
         return result
     
     def check_save_png(self, path, filename):
@@ -301,26 +314,36 @@ class InterfacePanel(BoxLayout):
         """
         Saves the current image, without user confirmation.
         
+        The image is snapshotted and written by a background thread, so the 
+        user can keep editing while the file is compressed.  The compression 
+        level is set by the writer attribute (see imagefile.PngWriter).
+        
         Parameter filename: An absolute filename
         Precondition: filename is a string
         """
         import os.path
-        import traceback
         self.dismiss_popup()
-        
-        # prepare image for saving
-        from PIL import Image as CoreImage
-
-        # This worked (Unlike Kivy)!  But is slow.
-        current = self.workspace.getCurrent()
         try:
-            im = CoreImage.new('RGBA',(current.getWidth(),current.getHeight()))
-            im.putdata(tuple(current.getData()))
-            im.save(filename,'PNG')
+            self.writer.save(self.workspace.getCurrent(),filename,self.saved_png)
         except:
             traceback.print_exc()
             self.error('Cannot save image file ' + os.path.split(filename)[1])
-                # These fields are 'hooks' to connect to the imager.kv file
+    
+    @mainthread
+    def saved_png(self, filename, error):
+        """
+        Reports the result of a background save.
+        
+        Parameter filename: An absolute filename
+        Precondition: filename is a string
+        
+        Parameter error: The error that occurred, if any
+        Precondition: error is None if the save was successful
+        """
+        import os.path
+        if not error is None:
+            traceback.print_exception(type(error),error,error.__traceback__)
+            self.error('Cannot save image file ' + os.path.split(filename)[1])
     
     def place_image(self, path, filename):
         """
@@ -329,6 +352,12 @@ class InterfacePanel(BoxLayout):
         If it cannot read the image (either Image is not defined or the file 
         is not an image file), this method does nothing.
         
+        The file is decoded in a separate thread so that the GUI stays 
+        responsive for large photos. The result is installed by show_image in 
+        the main event thread.  Until then, no new actions are accepted (see 
+        do_async), and any actions still waiting for the old image are 
+        dropped.
+        
         Parameter path: The base path to the file
         Precondition: path is a string
         
@@ -336,6 +365,7 @@ class InterfacePanel(BoxLayout):
         Precondition: filename is a string
         """
         import os.path
+        import threading
         self.dismiss_popup()
         
         if os.path.isabs(filename):
@@ -343,10 +373,27 @@ class InterfacePanel(BoxLayout):
         else:
             file = os.path.join(path,filename)
         
+        self.processing = True
+        self.loading = True
+        self.actions.clear()
+        thread = threading.Thread(target=lambda : self.show_image(self.read_image(file)))
+        thread.start()
+    
+    @mainthread
+    def show_image(self, picture):
+        """
+        Stores the given picture in the image panel(s), making a new workspace
+        
+        Parameter picture: The image that was loaded
+        Precondition: picture is an Image object or None
+        """
         import a6encode
-        self.picture = self.read_image(file)
+        self.processing = not self.async_thread is None
+        self.loading = False
+        self.picture = picture
         try:
             self.workspace = a6encode.Encoder(self.picture)
+            self.workimage.clearSelection()
             self.workimage.setImage(self.workspace.getCurrent())
             self.origimage.setImage(self.workspace.getOriginal())
         except:
@@ -533,57 +580,140 @@ class InterfacePanel(BoxLayout):
     
     def do_async(self,*action):
         """
-        Launchs the given action in an asynchronous thread
+        Queues the given action to run in an asynchronous thread
         
         The action parameters are an expanded list where the first element is 
-        a callable and any other elements are parameters to the callable.
+        the name of a workspace method and any other elements are parameters 
+        to that method.
+        
+        Actions are pushed onto the action queue, which coalesces any that 
+        cancel out (such as two inverts in a row).  If no worker is running, 
+        this method starts one; otherwise the running worker will get to the 
+        action in turn.  When the queue is drained, the worker will call 
+        async_complete in the main event thread.
         
-        The thread progress is monitored by async_monitor.  When the thread 
-        is done, it will call async_complete in the main event thread.
+        If part of the working image is selected (with the rubber band), the
+        action only changes that part.  The selection is added to the end of
+        the action as a Region.
+        
+        While a new image is loading (see place_image), the action is ignored,
+        since it would apply to the image that is being replaced.
         
         Parameter(s) *action: An expanded list defining the action
-        Precondition: The first element of action is callable
+        Precondition: The first element of action is a method name
+        """
+        if self.loading:
+            return
+        selection = self.workimage.getRegion()
+        if not selection is None:
+            action = action+(selection,)
+        if not self.actions.push(*action):
+            return
+        
+        self.imagemenu.disabled = True
+        self.textmenu.disabled = True
+        self.processing = True
+        self.async_start()
+    
+    def async_start(self):
+        """
+        Starts a worker thread to drain the action queue.
+        
+        This must only be called from the main thread, when the action queue
+        says that a worker is needed (see actions.ActionQueue.push).
         """
         import threading
-        self.menubar.disabled = True
-        self.processing = True
-        self.async_thread = threading.Thread(target=self.async_work,args=action)
+        self.async_thread = threading.Thread(target=self.async_work)
         self.async_thread.start()
 
-    def async_work(self,*action):
+    def async_work(self):
         """
-        Performs the given action asynchronously.
+        Performs the queued actions asynchronously.
         
-        The action parameters are an expanded list where the first element is 
-        a callable and any other elements are parameters to the callable.
+        This is the function that is launched in a separate thread.  It runs 
+        the actions on the action queue back-to-back, each as its own edit, 
+        until the queue is empty.  Even if an action fails, it is guaranteed 
+        to call async_complete for clean-up.
         
-        This is the function that is launched in a separate thread.  Even if 
-        the action fails, it is guaranteed to call async_complete for clean-up
+        Filters are run in a separate process (see filterworker.FilterWorker),
+        with the pixels passed through shared memory.  This thread just waits
+        for them, so the GUI does not stutter.  Any other action is run here.
         
-        Parameter(s) *action: An expanded list defining the action
-        Precondition: The first element of action is callable
+        Each action edits a back buffer (see a6editor.Editor.begin), which is
+        committed to the edit history when the action is done.  Until then the
+        main thread keeps drawing the previous image, never a partial one.
+        
+        An action that ends with a Region only processes that region, and the
+        edit history only records the old pixels of that region.
+        
+        Each action begins, commits (or aborts) on the same workspace, even 
+        if a new image is loaded (replacing the workspace) while it runs.
         """
-        try:
-            self.workspace.increment()
-            getattr(self.workspace,action[0])(*action[1:])
-            self.decode()
-        except:
-            traceback.print_exc()
-            self.error('Action '+action[0]+' could not be completed')
+        action = self.actions.pop()
+        while not action is None:
+            workspace = self.workspace
+            selection = None
+            if isinstance(action[-1],region.Region):
+                selection = action[-1]
+                action = action[:-1]
+            try:
+                with self.profiler.measure('increment'):
+                    back = workspace.begin()
+                with self.profiler.measure(action[0]):
+                    if not selection is None and not selection.fits(back):
+                        raise ValueError('the selection does not fit the image')
+                    if action[0] in FilterWorker.ACTIONS and selection is None:
+                        self.filters.run(back,action)
+                    elif action[0] in FilterWorker.ACTIONS:
+                        region.apply(back,selection,lambda part : self.filters.run(part,action))
+                    elif selection is None:
+                        getattr(workspace,action[0])(*action[1:])
+                    else:
+                        workspace.applyRegion(selection,*action)
+                workspace.commit(selection)
+            except:
+                workspace.abort()
+                traceback.print_exc()
+                self.error('Action '+action[0]+' could not be completed')
+            self.async_step()
+            action = self.actions.pop()
+        self.decode()
         self.async_complete()
+    
+    @mainthread
+    def async_step(self):
+        """
+        Displays the result of a single action while the queue is drained.
+        """
+        with self.profiler.measure('update'):
+            self.workimage.update(self.workspace.getCurrent())
+        self.canvas.ask_update()
      
     @mainthread
     def async_complete(self):
         """
         Cleans up an asynchronous thread after completion.
+        
+        The action queue is only marked idle here, on the main thread, after 
+        the worker has finished.  If more actions were queued while the 
+        worker was finishing, a new worker is started for them.
+        
+        If the profiler is enabled, this prints the table of stage timings.
         """
-        self.workimage.update(self.workspace.getCurrent())
+        with self.profiler.measure('update'):
+            self.workimage.update(self.workspace.getCurrent())
+        if self.profiler.enabled:
+            print(self.profiler.report(FilterWorker.ACTIONS))
         self.async_thread.join()
-        Clock.unschedule(self.async_action)
         self.async_thread = None
+        if self.actions.finish():
+            self.async_start()
+            return
+        Clock.unschedule(self.async_action)
         self.async_action = None
-        self.menubar.disabled = False
-        self.processing = False
+        self.imagemenu.disabled = False
+        self.textmenu.disabled = False
+        self.processing = self.loading
         #self.progress.canvas.ask_update()
         self.canvas.ask_update()
     
@@ -612,18 +742,23 @@ class InterfacePanel(BoxLayout):
         Encodes the message provided in the text panel into the image.
         
         This will not save the image, but it will store the result on the 
-        edit stack.
+        edit stack.  The message is always stored with the extended header 
+        (bits 0), which has a magic number and a checksum, so the image 
+        reports a valid message (see Encoder.getStatus).  The original 
+        format is only for old images.  The size is checked first, so a 
+        message that does not fit leaves the edit stack alone.
         """
         try:
             self.textpanel.active = True
-            self.workspace.increment()
-            if not self.workspace.encode(self.textpanel.hidden.text):
-                traceback.print_exc()
-                self.error('The message could not be encoded')
-                self.workspace.undo()
+            text = self.textpanel.hidden.text
+            bits = 0
+            if not self.workspace.canEncode(text,bits):
+                self.error('The message is too long for this image')
                 self.textpanel.active = False
                 self.textpanel.hidden.text = ''
             else:
+                self.workspace.increment()
+                self.workspace.encode(text,bits)
                 self.workimage.update(self.workspace.getCurrent())
         except:
             traceback.print_exc()
@@ -638,11 +773,15 @@ class InterfacePanel(BoxLayout):
         """
         Decodes the message from the image, and stores it in the text panel.
         
-        This will display an error message if there is no hidden message.
+        This will display an error message if there is no hidden message.  
+        The workspace remembers recent results (see Encoder.decode), and the 
+        text panel is left alone if the message has not changed.
         """
         try:
-            message = self.workspace.decode()
-            print(message)
+            with self.profiler.measure('decode'):
+                message = self.workspace.decode()
+            if not message is None and self.textpanel.active and self.textpanel.hidden.text == message:
+                return
             if not message is None:
                 from kivy.metrics import sp
                 self.textpanel.hidden.text = message
@@ -666,7 +805,7 @@ class InterfaceApp(App):
     the primary event loop. It is the root class for the application.
     """
     
-    def __init__(self,file):
+    def __init__(self,file,profiler=None,trace=None):
         """
         Initializes a new application window.
         
@@ -675,9 +814,17 @@ class InterfaceApp(App):
         
         Parameter file: The location of the initial image file.
         Precondition: file is a string or None.
+        
+        Parameter profiler: The stage timers for the panel (None to disable)
+        Precondition: profiler is a Profiler or None
+        
+        Parameter trace: The file to save the profiler trace to on exit
+        Precondition: trace is a string or None
         """
         super().__init__()
         self.source = file
+        self.profiler = profiler
+        self.trace = trace
     
     def build(self):
         """
@@ -686,6 +833,10 @@ class InterfaceApp(App):
         panel = InterfacePanel()
         if self.source:
             panel.source = self.source
+        if self.profiler:
+            panel.profiler = self.profiler
+            if self.trace:
+                self.profiler.startTrace()
         return panel
 
     def on_start(self):
@@ -694,16 +845,39 @@ class InterfaceApp(App):
         """
         super().on_start()
         self.root.config()
+    
+    def on_stop(self):
+        """
+        Finishes any queued saves, stops the filter process, and saves the 
+        profiler trace (if any) on exit
+        """
+        self.root.writer.wait()
+        self.root.filters.close()
+        if self.profiler and self.trace:
+            self.profiler.saveTrace(self.trace)
 
 
-def launch(image):
+def launch(image, profile=False, trace=None):
     """
     Launches the application with the given image file.
     
     It will start with the given image file. If file is None or cannot be
     read, it will use the default application image (the instructor).
     
+    If profile is True, the time (and peak memory) of each stage of each 
+    action is printed after the action completes.  If trace is not None, 
+    every stage is also saved to that file (as a Chrome trace) on exit.
+    
     Parameter file: The location of the initial image file.
     Precondition: file is a string or None.
+    
+    Parameter profile: Whether to time the stages of each action
+    Precondition: profile is a bool
+    
+    Parameter trace: The file to save the stage trace to
+    Precondition: trace is a string or None
     """
-    InterfaceApp(image).run()
\ No newline at end of file
+    profiler = None
+    if profile or trace:
+        profiler = Profiler(True,memory=profile)
+    InterfaceApp(image,profiler,trace).run()
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+A compact pixel list for the imager application.
+
+A pixel list is normally a Python list of 3-element tuples.  That is easy to
+work with, but it is very expensive for large photos: every pixel is its own
+tuple object.  The class in this module stores the same information as a flat
+buffer of bytes (red, green, blue, red, green, blue, ...), while still acting
+like a list of tuples.  Image objects accept either one as their data.
+
+Nick Trejo nt286
+19 October 2026
+"""
+
+
+class Pixels(object):
+    """
+    A pixel list backed by a flat byte buffer.
+
+    An instance of this class acts like a 1-dimensional list of pixels, where
+    a pixel is a tuple of 3 ints in the range 0..255.  You can get its length
+    with len, access pixels with [], loop over it, and copy it.  However, the
+    pixels are not stored as tuples.  They are stored in a single bytearray,
+    three bytes per pixel.  A new tuple is created each time you access a
+    pixel.
+
+    Because every byte is in the range 0..255, a Pixels object is always a
+    valid pixel list.  This means that it does not need to be checked pixel
+    by pixel when it is used to make an Image.
+    """
+    # HIDDEN ATTRIBUTES
+    # Attribute _buffer: The red, green and blue values of each pixel, in order
+    # Invariant: _buffer is a bytearray whose length is a multiple of 3
+
+    def __init__(self, data=b''):
+        """
+        Initializes a pixel list from the given bytes.
+
+        The data is copied; the new object does not share it with the caller.
+
+        Parameter data: The red, green and blue values of each pixel, in order
+        Precondition: data is a bytes-like object whose length is a multiple of 3
+        """
+        self._buffer = bytearray(data)
+        assert len(self._buffer) % 3 == 0, 'buffer length is not a multiple of 3'
+
+    def getBuffer(self):
+        """
+        Returns the underlying bytearray (NOT a copy).
+
+        Changes to the bytearray will change this pixel list.  It is up to the
+        caller to keep its length a multiple of 3.
+        """
+        return self._buffer
+
+    def copy(self):
+        """
+        Returns a copy of this pixel list.
+        """
+        return Pixels(self._buffer)
+
+    def __len__(self):
+        """
+        Returns the number of pixels in this list
+        """
+        return len(self._buffer) // 3
+
+    def __getitem__(self, pos):
+        """
+        Returns the pixel at the given position, or a Pixels object for a slice.
+
+        Parameter pos: The position in the pixel list
+        Precondition: pos is an int or a slice with no step
+        """
+        if type(pos) == slice:
+            start, stop, step = pos.indices(len(self))
+            assert step == 1, 'Pixels does not support extended slices'
+            result = Pixels()
+            result._buffer = self._buffer[start*3:max(start,stop)*3]
+            return result
+
+        if pos < 0:
+            pos += len(self)
+        index = pos*3
+        buffer = self._buffer
+        if pos < 0 or index >= len(buffer):
+            raise IndexError('pixel index out of range')
+        return (buffer[index],buffer[index+1],buffer[index+2])
+
+    def __setitem__(self, pos, pixel):
+        """
+        Sets the pixel at the given position.
+
+        Parameter pos: The position in the pixel list
+        Precondition: pos is an int and a valid position in the pixel list
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        if pos < 0:
+            pos += len(self)
+        index = pos*3
+        buffer = self._buffer
+        if pos < 0 or index >= len(buffer):
+            raise IndexError('pixel index out of range')
+        buffer[index:index+3] = bytes(pixel)
+
+    def __iter__(self):
+        """
+        Returns an iterator over the pixels (as tuples) in this list
+        """
+        values = iter(self._buffer)
+        return zip(values,values,values)
+
+    def __eq__(self, other):
+        """
+        Returns True if other has the same pixels as this list.
+
+        Parameter other: The value to compare
+        Precondition: NONE (other can be anything)
+        """
+        if isinstance(other,Pixels):
+            return self._buffer == other._buffer
+        try:
+            return len(self) == len(other) and list(self) == list(other)
+        except TypeError:
+            return False
+
+    def __repr__(self):
+        """
+        Returns the unambiguous string representation of this pixel list
+        """
+        return 'Pixels('+repr(bytes(self._buffer))+')'
@@ -0,0 +1,275 @@
+"""
+Timing and memory instrumentation for the imager application.
+
+The GUI runs each action in several stages: it adds a copy of the image to the
+edit history (increment), runs the filter, decodes any hidden message, and
+copies the result to the screen (ImagePanel.update).  A Profiler times each of
+these stages separately, so that we can tell which one dominates on real
+images.  It keeps rolling statistics for the most recent runs of each stage,
+which can be printed as a table, and it can also record every run to a trace
+file that can be opened in a trace viewer (such as chrome://tracing or
+Perfetto).
+
+This module does not depend on Kivy, so it can be used (and tested) without
+the GUI.
+
+Nick Trejo nt286
+19 October 2026
+"""
+import time
+import threading
+import collections
+
+
+class Profiler(object):
+    """
+    A collection of timers for the stages of image operations.
+
+    Stages are timed with the measure method, in a with statement:
+
+        with profiler.measure('invert'):
+            workspace.invert()
+
+    The profiler keeps the last `window` runs of each stage, and getStats
+    summarizes them.  A disabled profiler does nothing, so it is safe to leave
+    the timers in place.  The profiler is safe to use from several threads.
+
+    If memory is True, the profiler also records the peak memory allocated
+    during each stage (above what was allocated when it started), using 
+    tracemalloc.  This slows everything down, and the peaks are approximate
+    when stages on different threads overlap.  Only memory allocated by this
+    process is seen, so a stage that runs in another process (such as a 
+    filter run by a FilterWorker) can be marked as remote in the report.
+
+    Attribute enabled: Whether the timers record anything
+    Invariant: enabled is a bool
+
+    Attribute window: The number of recent runs to keep for each stage
+    Invariant: window is an int > 0
+
+    Attribute memory: Whether to record the peak memory of each stage
+    Invariant: memory is a bool (and cannot change after initialization)
+    """
+    # HIDDEN ATTRIBUTES
+    # Attribute _runs: The recent runs of each stage, oldest first
+    # Invariant: _runs is a dictionary mapping stage names to deques of
+    # (seconds,peak) pairs, where peak is an int or None
+    #
+    # Attribute _counts: The total number of runs of each stage
+    # Invariant: _counts is a dictionary mapping stage names to ints > 0
+    #
+    # Attribute _trace: The recorded trace events (None if not tracing)
+    # Invariant: _trace is a list of dictionaries or None
+    #
+    # Attribute _lock: The lock guarding _runs, _counts and _trace
+    # Invariant: _lock is a threading.Lock
+
+    def __init__(self, enabled=True, window=100, memory=False):
+        """
+        Initializes a profiler with no recorded runs.
+
+        Parameter enabled: Whether the timers record anything
+        Precondition: enabled is a bool
+
+        Parameter window: The number of recent runs to keep for each stage
+        Precondition: window is an int > 0
+
+        Parameter memory: Whether to record the peak memory of each stage
+        Precondition: memory is a bool
+        """
+        assert type(window) == int and window > 0, repr(window)+' is not a valid window'
+        self.enabled = enabled
+        self.window = window
+        self.memory = memory
+        self._runs = {}
+        self._counts = {}
+        self._trace = None
+        self._lock = threading.Lock()
+        if memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def measure(self, stage):
+        """
+        Returns a context manager that times the code in a with statement.
+
+        Parameter stage: The name of the stage being timed
+        Precondition: stage is a string
+        """
+        return _Timer(self,stage)
+
+    def record(self, stage, seconds, peak=None, start=None):
+        """
+        Records one run of a stage.
+
+        This is called by the timers from measure, but it can also be used to
+        record a stage that was timed some other way.
+
+        Parameter stage: The name of the stage
+        Precondition: stage is a string
+
+        Parameter seconds: How long the stage took
+        Precondition: seconds is a number >= 0
+
+        Parameter peak: The peak memory allocated during the stage, in bytes
+        Precondition: peak is None or an int >= 0
+
+        Parameter start: When the stage started (from time.perf_counter)
+        Precondition: start is None or a number
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if not stage in self._runs:
+                self._runs[stage] = collections.deque(maxlen=self.window)
+                self._counts[stage] = 0
+            self._runs[stage].append((seconds,peak))
+            self._counts[stage] += 1
+            if not self._trace is None:
+                if start is None:
+                    start = time.perf_counter()-seconds
+                event = {'name': stage, 'cat': 'imager', 'ph': 'X',
+                         'ts': round(start*1e6), 'dur': round(seconds*1e6),
+                         'pid': 1, 'tid': threading.get_ident()}
+                if not peak is None:
+                    event['args'] = {'peak_bytes': peak}
+                self._trace.append(event)
+
+    def getStats(self):
+        """
+        Returns a dictionary of statistics for each stage.
+
+        The keys are the stage names.  Each value is a dictionary with the keys
+        'count' (the total number of runs), 'last', 'mean', 'min' and 'max' (in
+        seconds, over the recent runs) and 'peak' (the largest recent peak
+        memory in bytes, or None if memory is not recorded).
+        """
+        result = {}
+        with self._lock:
+            for stage, runs in self._runs.items():
+                times = [run[0] for run in runs]
+                peaks = [run[1] for run in runs if not run[1] is None]
+                result[stage] = {'count': self._counts[stage], 'last': times[-1],
+                                 'mean': sum(times)/len(times), 'min': min(times),
+                                 'max': max(times), 'peak': max(peaks) if peaks else None}
+        return result
+
+    def report(self, remote=()):
+        """
+        Returns the statistics as a table (a string), slowest mean first.
+        
+        The stages in remote run (mostly) in another process, so their peak
+        memory is not shown; they are marked with a * and a note instead.
+        
+        Parameter remote: The stages that run in another process
+        Precondition: remote is a collection of stage names (strings)
+        """
+        stats = self.getStats()
+        lines = ['%-20s %6s %10s %10s %10s %10s %10s' % ('stage','count','last','mean','min','max','peak')]
+        marked = False
+        for stage in sorted(stats,key=lambda stage: -stats[stage]['mean']):
+            item = stats[stage]
+            peak = '-' if item['peak'] is None else str(item['peak']//1024)+'K'
+            name = stage
+            if stage in remote:
+                name, peak, marked = stage+'*', '-', True
+            lines.append('%-20s %6d %9.1fms %9.1fms %9.1fms %9.1fms %10s' % (name,item['count'],
+                         1000*item['last'],1000*item['mean'],1000*item['min'],1000*item['max'],peak))
+        if marked:
+            lines.append('* runs in another process (its memory is not measured)')
+        return '\n'.join(lines)
+
+    def clear(self):
+        """
+        Forgets every recorded run (but keeps tracing if it was started).
+        """
+        with self._lock:
+            self._runs = {}
+            self._counts = {}
+            if not self._trace is None:
+                self._trace = []
+
+    def startTrace(self):
+        """
+        Starts recording every run as a trace event.
+        """
+        with self._lock:
+            self._trace = []
+
+    def saveTrace(self, file):
+        """
+        Writes the recorded trace events to a file, and stops tracing.
+
+        The file uses the Chrome trace event format (JSON), with one complete
+        event for each run of a stage.  If tracing was not started, the file
+        has no events.
+
+        Parameter file: The file to write
+        Precondition: file is a filename string
+        """
+        import json
+        with self._lock:
+            events = self._trace or []
+            self._trace = None
+        with open(file,'w') as handle:
+            json.dump({'traceEvents': events},handle)
+
+
+class _Timer(object):
+    """
+    A context manager that times one run of a stage for a Profiler.
+    """
+    # HIDDEN ATTRIBUTES
+    # Attribute _profiler: The profiler to report to
+    # Invariant: _profiler is a Profiler
+    #
+    # Attribute _stage: The name of the stage being timed
+    # Invariant: _stage is a string
+    #
+    # Attribute _start: When the stage started (from time.perf_counter)
+    # Invariant: _start is a number or None
+    #
+    # Attribute _base: The memory allocated when the stage started (None if not measured)
+    # Invariant: _base is an int >= 0 or None
+
+    def __init__(self, profiler, stage):
+        """
+        Initializes a timer for the given profiler and stage.
+
+        Parameter profiler: The profiler to report to
+        Precondition: profiler is a Profiler
+
+        Parameter stage: The name of the stage being timed
+        Precondition: stage is a string
+        """
+        self._profiler = profiler
+        self._stage = stage
+        self._start = None
+        self._base = None
+
+    def __enter__(self):
+        """
+        Starts the timer.
+        """
+        if self._profiler.enabled:
+            if self._profiler.memory:
+                import tracemalloc
+                tracemalloc.reset_peak()
+                self._base = tracemalloc.get_traced_memory()[0]
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, value, tb):
+        """
+        Stops the timer and records the run (even if the stage failed).
+        """
+        if self._start is None:
+            return False
+        seconds = time.perf_counter()-self._start
+        peak = None
+        if not self._base is None:
+            import tracemalloc
+            peak = max(tracemalloc.get_traced_memory()[1]-self._base,0)
+        self._profiler.record(self._stage,seconds,peak,self._start)
+        return False
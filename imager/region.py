@@ -0,0 +1,288 @@
+"""
+Regions of interest for the imager application.
+
+Every filter normally processes the whole image.  A Region selects part of an
+image, either as a rectangle or as a bitmask, so that a filter can be run on
+just that part.  The region is cut out of the image (cropping it to the
+bounding box of the selection), filtered as if it were an image of its own,
+and pasted back.  For a bitmask, only the selected pixels are pasted back.
+So the cost of a filter is proportional to the size of the selection, not the
+size of the image.
+
+This module does not depend on Kivy, so it can be used (and tested) without
+the GUI.
+
+Nick Trejo nt286
+19 October 2026
+"""
+import a6image
+from pixels import Pixels
+
+
+class Region(object):
+    """
+    A selected part of an image, as a rectangle or a bitmask.
+
+    A region is made for images of a particular size.  Its bounds are the
+    smallest rectangle containing every selected pixel.  A rectangle selects
+    every pixel in its bounds, while a bitmask may select only some of them.
+    Regions are compared by value, so two regions with the same selection
+    are equal.
+    """
+    # HIDDEN ATTRIBUTES
+    # Attribute _size: The width and height of the images this region is for
+    # Invariant: _size is a tuple of two ints > 0
+    #
+    # Attribute _bounds: The bounding box (left, top, width, height) of the selection
+    # Invariant: _bounds is a tuple of four ints, inside _size, with width, height > 0
+    #
+    # Attribute _mask: The selection within the bounds (None for a rectangle)
+    # Invariant: _mask is None or bytes with 3 bytes for every pixel in the bounds,
+    # each 255 (selected) or 0 (not selected)
+
+    def __init__(self, width, height, rect=None, mask=None):
+        """
+        Initializes a region from a rectangle or a bitmask (but not both).
+
+        The rectangle is clipped to the image.  The bitmask has one byte for
+        every pixel of the image, in the same order as the pixels, and any
+        nonzero byte selects its pixel.  The selection may not be empty.
+
+        Parameter width: The width of the images this region is for
+        Precondition: width is an int > 0
+
+        Parameter height: The height of the images this region is for
+        Precondition: height is an int > 0
+
+        Parameter rect: The selected rectangle (left, top, width, height)
+        Precondition: rect is None or a tuple of four ints, overlapping the image
+
+        Parameter mask: The selected pixels
+        Precondition: mask is None or a bytes-like object of length width*height,
+        with at least one nonzero byte
+        """
+        assert type(width) == int and width > 0, repr(width)+' is not a valid width'
+        assert type(height) == int and height > 0, repr(height)+' is not a valid height'
+        assert (rect is None) != (mask is None), 'a region needs exactly one of rect and mask'
+        self._size = (width,height)
+        self._mask = None
+        if mask is None:
+            assert len(rect) == 4 and all(type(x) == int for x in rect), repr(rect)+' is not a rectangle'
+            left = max(rect[0],0)
+            top  = max(rect[1],0)
+            right  = min(rect[0]+rect[2],width)
+            bottom = min(rect[1]+rect[3],height)
+            assert left < right and top < bottom, repr(rect)+' does not overlap the image'
+            self._bounds = (left,top,right-left,bottom-top)
+        else:
+            self._setMask(mask)
+
+    def getSize(self):
+        """
+        Returns the (width, height) of the images this region is for
+        """
+        return self._size
+
+    def getBounds(self):
+        """
+        Returns the bounding box (left, top, width, height) of the selection
+        """
+        return self._bounds
+
+    def getCount(self):
+        """
+        Returns the number of selected pixels
+        """
+        if self._mask is None:
+            return self._bounds[2]*self._bounds[3]
+        return (len(self._mask)-self._mask.count(0))//3
+
+    def isRect(self):
+        """
+        Returns True if this region selects every pixel in its bounds
+        """
+        return self._mask is None
+
+    def fits(self, image):
+        """
+        Returns True if this region is for images the size of image.
+
+        Parameter image: The image to check
+        Precondition: image is an Image object
+        """
+        return (image.getWidth(),image.getHeight()) == self._size
+
+    def crop(self, image):
+        """
+        Returns a new image with the pixels of image inside the bounds.
+
+        Parameter image: The image to crop
+        Precondition: image is an Image object that this region fits
+        """
+        assert self.fits(image), 'the region does not fit the image'
+        return a6image.Image(Pixels(self._read(image)),self._bounds[2])
+
+    def paste(self, image, part):
+        """
+        Copies the selected pixels of part into image.
+
+        The image part is the size of the bounds (such as from crop).  For a
+        rectangle, all of it is copied; for a bitmask, only the pixels that
+        are selected.  This raises a ValueError if part is not the size of
+        the bounds (which happens if a filter changed its shape, such as
+        rotating a region that is not square).
+
+        Parameter image: The image to change
+        Precondition: image is an Image object that this region fits
+
+        Parameter part: The new pixels for the bounds
+        Precondition: part is an Image object
+        """
+        assert self.fits(image), 'the region does not fit the image'
+        left, top, width, height = self._bounds
+        if part.getWidth() != width or len(part) != width*height:
+            raise ValueError('the filter changed the shape of the region')
+
+        data = part.getBytes()
+        if not self._mask is None:
+            # Keep the old value of every byte that is not selected
+            size = len(data)
+            old  = int.from_bytes(self._read(image),'big')
+            new  = int.from_bytes(data,'big')
+            mask = int.from_bytes(self._mask,'big')
+            data = ((new & mask) | (old & ~mask)).to_bytes(size,'big')
+
+        stride = 3*width
+        for row in range(height):
+            image.setBytes(data[row*stride:(row+1)*stride],(top+row)*self._size[0]+left)
+
+    def __eq__(self, other):
+        """
+        Returns True if other is a region with the same selection.
+
+        Parameter other: The value to compare
+        Precondition: NONE (other can be anything)
+        """
+        return (isinstance(other,Region) and self._size == other._size and
+                self._bounds == other._bounds and self._mask == other._mask)
+
+    def __hash__(self):
+        """
+        Returns a hash code consistent with equality
+        """
+        return hash((self._size,self._bounds,self._mask))
+
+    def __repr__(self):
+        """
+        Returns the unambiguous string representation of this region
+        """
+        kind = 'rect' if self._mask is None else 'mask'
+        return 'Region('+kind+' '+repr(self._bounds)+' of '+repr(self._size)+')'
+
+    # HELPER METHODS
+    def _read(self, image):
+        """
+        Returns the pixels of image inside the bounds, as bytes.
+
+        Parameter image: The image to read
+        Precondition: image is an Image object that this region fits
+        """
+        left, top, width, height = self._bounds
+        if width == self._size[0]:
+            return image.getBytes(top*width,(top+height)*width)
+        rows = []
+        for row in range(top,top+height):
+            start = row*self._size[0]+left
+            rows.append(image.getBytes(start,start+width))
+        return b''.join(rows)
+
+    def _setMask(self, mask):
+        """
+        Sets the bounds and the mask from a bitmask of the whole image.
+
+        Parameter mask: The selected pixels
+        Precondition: mask is a bytes-like object of length width*height,
+        with at least one nonzero byte
+        """
+        width, height = self._size
+        assert len(mask) == width*height, 'the mask is not the size of the image'
+        flags = bytes(mask).translate(_SELECT)
+
+        left, right, top, bottom = width, 0, None, None
+        for row in range(height):
+            line = flags[row*width:(row+1)*width]
+            first = line.find(1)
+            if first >= 0:
+                if top is None:
+                    top = row
+                bottom = row+1
+                left  = min(left,first)
+                right = max(right,line.rfind(1)+1)
+        assert not top is None, 'the mask selects nothing'
+        self._bounds = (left,top,right-left,bottom-top)
+
+        inside = b''.join(flags[row*width+left:row*width+right] for row in range(top,bottom))
+        if inside.count(0) == 0:
+            return
+        inside = inside.translate(_EXPAND)
+        expanded = bytearray(3*len(inside))
+        expanded[0::3] = inside
+        expanded[1::3] = inside
+        expanded[2::3] = inside
+        self._mask = bytes(expanded)
+
+
+def apply(image, region, function):
+    """
+    Returns the result of calling function on just the region of image.
+
+    The function is given a new image with the pixels inside the bounds of
+    the region (see Region.crop), which it changes in place.  The selected
+    pixels are then copied back into image.
+
+    Parameter image: The image to change
+    Precondition: image is an Image object that region fits
+
+    Parameter region: The part of the image to change
+    Precondition: region is a Region
+
+    Parameter function: The operation to run on the region
+    Precondition: function is callable with one argument (an Image object)
+    """
+    part = region.crop(image)
+    result = function(part)
+    region.paste(image,part)
+    return result
+
+
+def between(width, height, corner1, corner2):
+    """
+    Returns the Region between two corners, or None if it has no pixels.
+
+    The corners are positions on the image, such as the ends of a drag with
+    the mouse.  They can be fractional, and each one is rounded to the 
+    nearest pixel boundary.  So a click without a drag (or with a drag of 
+    less than half a pixel) selects nothing.
+
+    Parameter width: The width of the images the region is for
+    Precondition: width is an int > 0
+
+    Parameter height: The height of the images the region is for
+    Precondition: height is an int > 0
+
+    Parameter corner1: One corner, as a (column, row) of the image
+    Precondition: corner1 is a pair of numbers, 0 <= column <= width, 0 <= row <= height
+
+    Parameter corner2: The opposite corner, as a (column, row) of the image
+    Precondition: corner2 is a pair of numbers, 0 <= column <= width, 0 <= row <= height
+    """
+    left, right = sorted((round(corner1[0]),round(corner2[0])))
+    top, bottom = sorted((round(corner1[1]),round(corner2[1])))
+    if left == right or top == bottom:
+        return None
+    return Region(width,height,rect=(left,top,right-left,bottom-top))
+
+
+# Translation tables: any nonzero byte to 1, and 1 to 255
+_SELECT = bytes([0]+[1]*255)
+_EXPAND = bytes([0,255]+[0]*254)
@@ -0,0 +1,120 @@
+"""
+A parallel steganography scanner for the imager application.
+
+This module searches folders of image files for hidden messages, without the
+GUI.  Most images in a folder have no message, so each file is first probed
+by reading only its first row or so of pixels (see imagefile.read_rows) and
+checking for a message header.  Only the files that pass are decoded in full.
+The files are probed by a pool of processes, so the scan uses every core.
+
+The results are written as JSON lines: one JSON object per line, for each
+file that has a message header or could not be read.  Each object has the
+keys 'file' and 'status'.  The status is one of the statuses of
+Encoder.getStatus, or 'error' if the file could not be read.  Messages that
+could be read also have the keys 'length' (in bytes) and 'message'.  Shards
+(see a6encode.encode_shards) have the key 'shard', a list of the shard id, 
+sequence number and number of shards.  Files that could not be read have 
+the key 'error' instead.
+
+Nick Trejo nt286
+19 October 2026
+"""
+import os
+
+# The file extensions to scan
+EXTENSIONS = ('.png','.bmp','.tif','.tiff','.gif','.jpg','.jpeg','.webp')
+
+# The most pixels that a message header can use
+HEADER_PIXELS = 32
+
+
+def find_images(paths):
+    """
+    Yields the image files in the given files and folders, in sorted order.
+
+    Folders are searched recursively, and only files with one of the
+    EXTENSIONS are included.  Files given directly are always included.
+
+    Parameter paths: The files and folders to search
+    Precondition: paths is a list of strings
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for folder, subfolders, files in os.walk(path):
+            subfolders.sort()
+            for name in sorted(files):
+                if name.lower().endswith(EXTENSIONS):
+                    yield os.path.join(folder,name)
+
+
+def scan_file(file):
+    """
+    Returns the scan result for file as a dictionary, or None if it has no message.
+
+    The file is probed by reading just enough rows to hold a message header.
+    It is only decoded in full if the header is present.  This function
+    never raises an error for a bad file; the error is part of the result.
+
+    Parameter file: The image file to scan
+    Precondition: file is a string
+    """
+    from imagefile import read_image, read_rows
+    from a6encode import Encoder
+
+    try:
+        image = read_rows(file,1)
+        if len(image) < HEADER_PIXELS:
+            image = read_rows(file,-(-HEADER_PIXELS // image.getWidth()))
+        if not Encoder(image).hasMessage():
+            return None
+
+        encoder = Encoder(read_image(file))
+        message = encoder.decode()
+        status  = encoder.getStatus()
+        shard   = encoder.decode_shard() if status == Encoder.SHARD else None
+    except Exception as e:
+        return {'file': file, 'status': 'error', 'error': str(e)}
+
+    result = {'file': file, 'status': status}
+    if not shard is None:
+        result['shard'] = list(shard[0])
+    if not message is None:
+        result['length']  = len(message.encode('utf-8'))
+        result['message'] = message
+    return result
+
+
+def scan(paths, output, workers=None):
+    """
+    Returns the pair (files, found) after scanning the given files and folders.
+
+    The value files is the number of files scanned, and found is the number
+    of results written to output as JSON lines (see the module description).
+    The files are scanned by a pool of worker processes, but the results are
+    written in the same order as find_images, as soon as they are ready.
+
+    Parameter paths: The files and folders to scan
+    Precondition: paths is a list of strings
+
+    Parameter output: The file to write the results to
+    Precondition: output is a writable text file
+
+    Parameter workers: The number of worker processes (None for one per core)
+    Precondition: workers is None or an int > 0
+    """
+    import json
+    from concurrent.futures import ProcessPoolExecutor
+    assert workers is None or (type(workers) == int and workers > 0), repr(workers)+' is not a number of workers'
+
+    files = 0
+    found = 0
+    with ProcessPoolExecutor(workers) as executor:
+        for result in executor.map(scan_file,find_images(paths),chunksize=16):
+            files += 1
+            if not result is None:
+                output.write(json.dumps(result)+'\n')
+                output.flush()
+                found += 1
+    return (files,found)
@@ -0,0 +1,433 @@
+"""
+A local image-processing service for the imager application.
+
+Starting Python and importing the imager modules takes longer than many of the
+filters themselves on small images.  This module keeps a warm process running
+instead.  Other programs connect to it over a Unix socket (or a localhost TCP
+port), send an image along with a chain of Filter and Encoder methods, and get
+back the processed image and the value returned by each method.
+
+Jobs run on a pool of worker processes, so several clients can be served at
+once without the GIL serializing the filters.  The workers are started (and
+import everything they need) when the service starts, and each worker keeps a
+cache of its recent results, so a repeated request is answered without
+running the filters again.
+
+Every message, in either direction, is a frame: a 4-byte big-endian length,
+a JSON header of that length, and then a payload of header['size'] bytes.
+A request header has the keys 'width' (the image width), 'size' (the length
+of the RGB pixel data that follows) and 'chain' (a list of actions, each a
+list of a method name and its arguments, such as ['monochromify', true]).  A
+response header has the keys 'status' ('ok' or 'error'), 'size', and either
+'width' and 'results' (the return value of each action) or 'error' (the
+error message).  A client may send several requests on one connection; the
+responses come back in the same order, each one as soon as it is ready.
+
+This module does not depend on Kivy, so it can be used (and tested) without
+the GUI.
+
+Nick Trejo nt286
+19 October 2026
+"""
+import os
+import struct
+import socket
+import socketserver
+
+# The methods that a chain may call
+ACTIONS = ('invert','transpose','reflectHori','reflectVert','rotateRight','rotateLeft',
+           'monochromify','jail','vignette','blur','sharpen','edges','autoLevels',
+           'equalize','encode','decode','hasMessage','getStatus','getCapacity','canEncode')
+
+# The largest JSON header that will be accepted
+MAX_HEADER = 1 << 16
+
+# The size of the pieces that a payload is sent in
+CHUNK = 1 << 20
+
+# The most bytes of results each worker keeps in its cache
+CACHE_SIZE = 64 << 20
+
+
+def parse_address(text):
+    """
+    Returns the socket address for text, as a string path or a (host,port) pair.
+
+    The text 'PORT' or 'HOST:PORT' (where PORT is a number) is a TCP address;
+    a bare port uses the host 127.0.0.1, so that the service is only reachable
+    from this machine.  Anything else is the path of a Unix socket.
+
+    Parameter text: The address to parse
+    Precondition: text is a non-empty string
+    """
+    assert type(text) == str and text, repr(text)+' is not a valid address'
+    host, sep, port = text.rpartition(':')
+    if port.isdigit():
+        return (host or '127.0.0.1',int(port))
+    return text
+
+
+def run_chain(width, data, chain):
+    """
+    Returns the triple (width, data, results) after running chain on an image.
+
+    The image is given by its width and RGB pixel data.  Each action in the
+    chain is called on an Encoder for that image, in order, and results is the
+    list of values that they return.  The width may change (if the chain
+    rotates or transposes the image).
+
+    Results are cached in this process by the contents of the image and the
+    chain, so running the same chain on the same image again is free.
+
+    Parameter width: The image width
+    Precondition: width is an int > 0 that divides len(data)//3
+
+    Parameter data: The red, green and blue values of each pixel, in order
+    Precondition: data is a bytes object whose length is a multiple of 3
+
+    Parameter chain: The actions to run
+    Precondition: chain is a list of lists, each a name in ACTIONS and its arguments
+    """
+    import hashlib
+    import a6image
+    from a6encode import Encoder
+    from pixels import Pixels
+
+    check_chain(chain)
+    key = (hashlib.sha1(data).digest(),width,repr(chain))
+    cached = _cache_get(key)
+    if not cached is None:
+        return cached
+
+    encoder = Encoder(a6image.Image(Pixels(data),width))
+    results = [getattr(encoder,action[0])(*action[1:]) for action in chain]
+    image = encoder.getCurrent()
+    result = (image.getWidth(),bytes(image.getBytes()),results)
+    _cache_put(key,result)
+    return result
+
+
+def check_chain(chain):
+    """
+    Raises a ValueError if chain is not a valid chain of actions.
+
+    Parameter chain: The value to check
+    Precondition: NONE (chain can be anything)
+    """
+    if type(chain) != list:
+        raise ValueError(repr(chain)+' is not a list of actions')
+    for action in chain:
+        if type(action) != list or not action or not action[0] in ACTIONS:
+            raise ValueError(repr(action)+' is not a valid action')
+
+
+def read_frame(stream):
+    """
+    Returns the pair (header, payload) for the next frame in stream, or None at the end.
+
+    This function raises a ValueError if the frame is malformed or cut short.
+
+    Parameter stream: The stream to read from
+    Precondition: stream is a binary file object (such as from socket.makefile)
+    """
+    import json
+    prefix = stream.read(4)
+    if not prefix:
+        return None
+    if len(prefix) < 4:
+        raise ValueError('the frame is cut short')
+    length = struct.unpack('>I',prefix)[0]
+    if length > MAX_HEADER:
+        raise ValueError('the frame header is too long')
+    header = json.loads(stream.read(length).decode('utf-8'))
+    if type(header) != dict or type(header.get('size',0)) != int or header.get('size',0) < 0:
+        raise ValueError('the frame header is not valid')
+    payload = stream.read(header.get('size',0))
+    if len(payload) < header.get('size',0):
+        raise ValueError('the frame is cut short')
+    return (header,payload)
+
+
+def write_frame(stream, header, payload=b''):
+    """
+    Writes a frame to stream, sending the payload in pieces of CHUNK bytes.
+
+    The key 'size' of header is set to the length of payload.
+
+    Parameter stream: The stream to write to
+    Precondition: stream is a binary file object (such as from socket.makefile)
+
+    Parameter header: The frame header
+    Precondition: header is a dictionary that can be converted to JSON
+
+    Parameter payload: The frame payload
+    Precondition: payload is a bytes-like object
+    """
+    import json
+    header = dict(header,size=len(payload))
+    data = json.dumps(header).encode('utf-8')
+    stream.write(struct.pack('>I',len(data))+data)
+    view = memoryview(payload)
+    for pos in range(0,len(view),CHUNK):
+        stream.write(view[pos:pos+CHUNK])
+    stream.flush()
+
+
+class Service(object):
+    """
+    A local image-processing service.
+
+    The service listens on an address (see parse_address) and runs each request
+    on a pool of worker processes.  Call serve_forever to handle requests until
+    shutdown is called (from another thread), and then close to release the
+    socket and the workers.
+
+    Attribute address: The address that the service listens on
+    Invariant: address is a string path or a (host,port) pair
+    """
+    # HIDDEN ATTRIBUTES
+    # Attribute _server: The server accepting connections
+    # Invariant: _server is a socketserver server (Unix or TCP, threading)
+    #
+    # Attribute _pool: The worker processes
+    # Invariant: _pool is a concurrent.futures.ProcessPoolExecutor
+
+    def __init__(self, address, workers=None):
+        """
+        Initializes a service listening on address, with its workers started.
+
+        If address is the path of a Unix socket left over from an earlier 
+        service, it is replaced (but any other file at that path is an error).
+        For a TCP address with port 0, the system picks a free port, and the
+        attribute address has the port that was picked.
+
+        Parameter address: The address to listen on
+        Precondition: address is a string path or a (host,port) pair
+
+        Parameter workers: The number of worker processes (None for one per core)
+        Precondition: workers is None or an int > 0
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        assert workers is None or (type(workers) == int and workers > 0), repr(workers)+' is not a number of workers'
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self._pool = ProcessPoolExecutor(workers,initializer=_warm)
+        # Start every worker now, rather than on the first request
+        list(self._pool.map(_ready,range(workers)))
+
+        if type(address) == str:
+            if _is_socket(address):
+                os.remove(address)
+            self._server = _UnixServer(address,_Handler)
+        else:
+            self._server = _TCPServer(address,_Handler)
+        self._server.pool = self._pool
+        self.address = self._server.server_address
+
+    def serve_forever(self):
+        """
+        Handles requests until shutdown is called.
+        """
+        self._server.serve_forever()
+
+    def shutdown(self):
+        """
+        Stops serve_forever (which must be running on another thread).
+        """
+        self._server.shutdown()
+
+    def close(self):
+        """
+        Closes the socket and stops the worker processes.
+        """
+        self._server.server_close()
+        self._pool.shutdown()
+        if type(self.address) == str and _is_socket(self.address):
+            os.remove(self.address)
+
+
+class Client(object):
+    """
+    A connection to a running Service.
+
+    Attribute address: The address of the service
+    Invariant: address is a string path or a (host,port) pair
+    """
+    # HIDDEN ATTRIBUTES
+    # Attribute _socket: The connected socket
+    # Invariant: _socket is a socket.socket
+    #
+    # Attribute _stream: A buffered binary file for the socket
+    # Invariant: _stream is a file object opened for reading and writing
+
+    def __init__(self, address):
+        """
+        Initializes a client connected to the service at address.
+
+        This raises an OSError if the service cannot be reached.
+
+        Parameter address: The address of the service
+        Precondition: address is a string path or a (host,port) pair
+        """
+        self.address = address
+        family = socket.AF_UNIX if type(address) == str else socket.AF_INET
+        self._socket = socket.socket(family,socket.SOCK_STREAM)
+        self._socket.connect(address)
+        self._stream = self._socket.makefile('rwb')
+
+    def run(self, image, chain):
+        """
+        Returns the pair (image, results) after running chain on image remotely.
+
+        The image returned is a new Image object, and image is not changed.
+        The value results is the list of values returned by each action.  This
+        method raises a ValueError if the service could not run the chain.
+
+        Parameter image: The image to process
+        Precondition: image is an Image object
+
+        Parameter chain: The actions to run
+        Precondition: chain is a list of tuples or lists, each a name in ACTIONS and its arguments
+        """
+        import a6image
+        from pixels import Pixels
+
+        chain = [list(action) for action in chain]
+        write_frame(self._stream,{'width': image.getWidth(), 'chain': chain},image.getBytes())
+        frame = read_frame(self._stream)
+        if frame is None:
+            raise ValueError('the service closed the connection')
+        header, payload = frame
+        if header['status'] != 'ok':
+            raise ValueError(header['error'])
+        return (a6image.Image(Pixels(payload),header['width']),header['results'])
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self._stream.close()
+        self._socket.close()
+
+
+# HELPER CLASSES AND FUNCTIONS
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    The handler for one client connection.
+    """
+
+    def handle(self):
+        """
+        Answers requests on this connection until the client closes it.
+        """
+        while True:
+            try:
+                frame = read_frame(self.rfile)
+            except ValueError as e:
+                write_frame(self.wfile,{'status': 'error', 'error': str(e)})
+                return
+            if frame is None:
+                return
+            header, payload = frame
+            try:
+                width = header.get('width')
+                if type(width) != int or width <= 0 or len(payload) % 3 or (len(payload)//3) % width:
+                    raise ValueError('the image width does not match the pixel data')
+                check_chain(header.get('chain'))
+                future = self.server.pool.submit(run_chain,width,payload,header['chain'])
+                width, data, results = future.result()
+            except Exception as e:
+                write_frame(self.wfile,{'status': 'error', 'error': str(e) or type(e).__name__})
+                continue
+            write_frame(self.wfile,{'status': 'ok', 'width': width, 'results': results},data)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A threaded server on a Unix socket.
+    """
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    A threaded server on a TCP port.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# The cached results of this (worker) process: (sha1,width,chain) -> (width,data,results)
+_results = None
+_cached  = 0
+
+
+def _is_socket(path):
+    """
+    Returns True if path is an existing Unix socket file.
+
+    Parameter path: The path to check
+    Precondition: path is a string
+    """
+    import stat
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def _warm():
+    """
+    Imports everything a worker needs, so that the first request is not slow.
+    """
+    import hashlib
+    import a6image
+    import a6encode
+    import pixels
+
+
+def _ready(pos):
+    """
+    Returns pos; this is a trivial job used to start every worker process.
+
+    Parameter pos: Any value
+    Precondition: NONE
+    """
+    return pos
+
+
+def _cache_get(key):
+    """
+    Returns the cached result for key, or None if it is not cached.
+
+    Parameter key: The cache key
+    Precondition: key is a tuple (sha1,width,chain)
+    """
+    if _results is None or not key in _results:
+        return None
+    _results.move_to_end(key)
+    return _results[key]
+
+
+def _cache_put(key, result):
+    """
+    Caches result for key, forgetting the least recently used results if full.
+
+    Parameter key: The cache key
+    Precondition: key is a tuple (sha1,width,chain)
+
+    Parameter result: The result of run_chain
+    Precondition: result is a triple (width,data,results)
+    """
+    import collections
+    global _results, _cached
+    if len(result[1]) > CACHE_SIZE:
+        return
+    if _results is None:
+        _results = collections.OrderedDict()
+    _results[key] = result
+    _cached += len(result[1])
+    while _cached > CACHE_SIZE:
+        old = _results.popitem(last=False)[1]
+        _cached -= len(old[1])
@@ -23,6 +23,7 @@ from kivy.properties import *
 from array import array             # Byte buffers
 from io import StringIO             # Making complex strings
 import traceback
+import region
 
 
 # DIALOGS
@@ -295,6 +296,10 @@ class ImagePanel(Widget):
     The view for this application is defined the interface.kv file. This class 
     simply contains the hooks for the view properties.  In addition, it has 
     several helpful methods for image processing.
+    
+    If the panel is selectable, the user can drag a rubber band over the 
+    image to select a rectangle of it (see getRegion).  A click without a 
+    drag clears the selection.
     """
     # These fields are 'hooks' to connect to the imager.kv file
     # The image, represented as an Image object
@@ -307,6 +312,15 @@ class ImagePanel(Widget):
     imagesize = ListProperty((0,0))
     # The position offset of the current image
     imageoff  = ListProperty((0,0))
+    # Whether the user can select a rectangle with a rubber band
+    selectable = BooleanProperty(False)
+    # The selected rectangle in pixels [left, top, width, height] (empty if none)
+    selection = ListProperty([])
+    # The selected rectangle on screen [x, y, width, height] (empty if none)
+    band = ListProperty([])
+    
+    # A touch that moves less than this (in screen pixels) is a click, not a drag
+    DRAG = 4
     
     @classmethod
     def getResource(self,filename):
@@ -326,11 +340,13 @@ class ImagePanel(Widget):
         return os.path.join(dir,filename)
     
     def blit(self,picture):
-        for pos in range(len(picture)):
-            pixel = picture[pos]
-            self._blitter[pos*3  ] = pixel[0]
-            self._blitter[pos*3+1] = pixel[1]
-            self._blitter[pos*3+2] = pixel[2]
+        """
+        Returns the pixels of picture as a byte buffer for the texture
+        
+        Parameter picture: The image to convert
+        Precondition: picture is an Image object
+        """
+        self._blitter = array('B',picture.getBytes())
         return self._blitter
     
     def setImage(self,picture):
@@ -346,6 +362,9 @@ class ImagePanel(Widget):
         """
         import a6image
         
+        if not self.picture is None and (picture is None or picture.getWidth() != self.picture.getWidth() 
+                                         or len(picture) != len(self.picture)):
+            self.clearSelection()
         self.picture = None
         self.texture = None
         self.imagesize = self.inside
@@ -358,7 +377,6 @@ class ImagePanel(Widget):
             self.picture  = picture
             self.texture  = Texture.create(size=(picture.getWidth(), picture.getHeight()), 
                                            colorfmt='rgb', bufferfmt='ubyte')
-            self._blitter = array('B',[0]*len(picture)*3)
             self.texture.blit_buffer(self.blit(picture), colorfmt='rgb', bufferfmt='ubyte')
             self.texture.flip_vertical()
             
@@ -416,6 +434,137 @@ class ImagePanel(Widget):
         elif dohide:
             self.saved_attrs = self.height, self.size_hint_y, self.opacity, self.disabled
             self.height, self.size_hint_y, self.opacity, self.disabled = 0, None, 0, True
+    
+    # Rubber band selection
+    def getRegion(self):
+        """
+        Returns the selected rectangle as a region.Region, or None if there is no selection
+        """
+        if not self.selection or self.picture is None:
+            return None
+        return region.Region(self.picture.getWidth(),self.picture.getHeight(),rect=tuple(self.selection))
+    
+    def clearSelection(self):
+        """
+        Removes the selection (and the rubber band)
+        """
+        self.selection = []
+        self.band = []
+    
+    def on_touch_down(self, touch):
+        """
+        Starts a rubber band selection if the touch is on a selectable image.
+        
+        Parameter touch: The touch event
+        Precondition: touch is a Kivy MotionEvent
+        """
+        if not self.selectable or self.picture is None or self.disabled:
+            return super().on_touch_down(touch)
+        left = self.x+self.imageoff[0]
+        bottom = self.y+self.imageoff[1]
+        if not (left <= touch.x <= left+self.imagesize[0] and bottom <= touch.y <= bottom+self.imagesize[1]):
+            return super().on_touch_down(touch)
+        
+        touch.grab(self)
+        self._anchor = self._toImage(touch.pos)
+        self.clearSelection()
+        return True
+    
+    def on_touch_move(self, touch):
+        """
+        Resizes the rubber band selection as the touch moves.
+        
+        Parameter touch: The touch event
+        Precondition: touch is a Kivy MotionEvent
+        """
+        if touch.grab_current is not self:
+            return super().on_touch_move(touch)
+        self._select(self._anchor,self._toImage(touch.pos))
+        return True
+    
+    def on_touch_up(self, touch):
+        """
+        Finishes the rubber band selection.
+        
+        Parameter touch: The touch event
+        Precondition: touch is a Kivy MotionEvent
+        """
+        if touch.grab_current is not self:
+            return super().on_touch_up(touch)
+        touch.ungrab(self)
+        if abs(touch.x-touch.ox) < self.DRAG and abs(touch.y-touch.oy) < self.DRAG:
+            self.clearSelection()
+        else:
+            self._select(self._anchor,self._toImage(touch.pos))
+        return True
+    
+    def on_imagesize(self, instance, value):
+        """
+        Moves the rubber band to follow the image on screen.
+        """
+        self._placeBand()
+    
+    def on_imageoff(self, instance, value):
+        """
+        Moves the rubber band to follow the image on screen.
+        """
+        self._placeBand()
+    
+    def on_pos(self, instance, value):
+        """
+        Moves the rubber band to follow the image on screen.
+        """
+        self._placeBand()
+    
+    def _toImage(self, pos):
+        """
+        Returns the (column, row) of the image at the screen position pos.
+        
+        The result is a pair of floats, clamped to the edges of the image.
+        
+        Parameter pos: The screen position
+        Precondition: pos is a pair of numbers
+        """
+        width  = self.picture.getWidth()
+        height = self.picture.getHeight()
+        col = (pos[0]-self.x-self.imageoff[0])*width/max(self.imagesize[0],1)
+        row = (self.y+self.imageoff[1]+self.imagesize[1]-pos[1])*height/max(self.imagesize[1],1)
+        return (min(max(col,0),width),min(max(row,0),height))
+    
+    def _select(self, corner1, corner2):
+        """
+        Selects the pixels in the rectangle between two corners.
+        
+        The corners are rounded to the nearest pixel boundaries (see 
+        region.between).  If the rectangle has no pixels in it, the selection
+        is cleared.
+        
+        Parameter corner1: One corner, as an image (column, row)
+        Precondition: corner1 is a pair of numbers inside the image
+        
+        Parameter corner2: The opposite corner, as an image (column, row)
+        Precondition: corner2 is a pair of numbers inside the image
+        """
+        part = region.between(self.picture.getWidth(),self.picture.getHeight(),corner1,corner2)
+        if part is None:
+            self.clearSelection()
+        else:
+            self.selection = list(part.getBounds())
+            self._placeBand()
+    
+    def _placeBand(self):
+        """
+        Positions the rubber band on screen around the selection.
+        """
+        if not self.selection or self.picture is None:
+            self.band = []
+            return
+        left, top, width, height = self.selection
+        xscale = self.imagesize[0]/self.picture.getWidth()
+        yscale = self.imagesize[1]/self.picture.getHeight()
+        self.band = [self.x+self.imageoff[0]+left*xscale,
+                     self.y+self.imageoff[1]+(self.picture.getHeight()-top-height)*yscale,
+                     width*xscale,height*yscale]
 
 
 class MessagePanel(Widget):